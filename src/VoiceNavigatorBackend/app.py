@@ -1,15 +1,54 @@
-from flask import Flask, Blueprint, request, jsonify
-from operate.operate import main_for_api
+from flask import Flask, Blueprint, Response, request, jsonify
+from operate.operate import main_for_api, replay
+from operate.exceptions import DesktopBusyException
+from operate.utils.desktop_lock import desktop_session
+from operate.utils.trajectory import get_trajectory_path
+from operate.utils.metrics import render_prometheus
+from operate.utils.usage import render_prometheus as render_usage_prometheus
+from operate.utils.readiness import get_state, set_ready
+from operate.utils.worker_metrics import get_metrics_dir, render_all_metrics
 import os
 from flask_cors import CORS
 
 # Create a Blueprint for pages
 bp = Blueprint("pages", __name__)
 
+# Model of the API sessions; plans need clicks located by OCR, so they use an OCR model
+API_MODEL = "gpt-4"
+API_PLAN_MODEL = "gpt-4-with-ocr"
+
 @bp.route("/", methods=["GET"])
 def home():
     return "🌟 Welcome to the **Voice Navigator Project**! 🗺️🎤"
 
+@bp.route("/healthz", methods=["GET"])
+def healthz():
+    """
+    Liveness probe: the worker is up and answering.
+    """
+    return jsonify({"status": "ok", "pid": os.getpid()}), 200
+
+@bp.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness probe: 200 when every preloaded component loaded, 503 when one failed.
+    server.py only starts answering once the warm-up is done.
+    """
+    state = get_state()
+    return jsonify(state), 200 if state["ready"] else 503
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Per-stage latency histograms and provider usage, in the Prometheus text format.
+    Under server.py they are summed over all the workers, see `operate.utils.worker_metrics`.
+    """
+    if get_metrics_dir():
+        text = render_all_metrics()
+    else:
+        text = render_prometheus() + render_usage_prometheus()
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
 @bp.route("/api/operate", methods=["POST"])
 def opearte_api():
     """
@@ -24,16 +63,53 @@ def opearte_api():
         if not terminal_prompt:
             return  jsonify({"error": "No terminal prompt provided."}), 400
         
-        # - Call the main_for_api to execute the logic
-        result = main_for_api(
-            model="gpt-4",
-            terminal_prompt=terminal_prompt,
-            voice_mode=False,
-            verbose_mode=False,
-            image2text= False
-        )
+        plan_mode = bool(data.get("plan", False))
+
+        # - Call the main_for_api to execute the logic, one session per desktop
+        with desktop_session():
+            result = main_for_api(
+                model=API_PLAN_MODEL if plan_mode else API_MODEL,
+                terminal_prompt=terminal_prompt,
+                voice_mode=False,
+                verbose_mode=False,
+                image2text= False,
+                stream=bool(data.get("stream", False)),
+                plan_mode=plan_mode,
+                cache=bool(data.get("cache", False)),
+                budget=data.get("budget"),
+            )
+
+        return jsonify(result), 200
+    except DesktopBusyException as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error":str(e)}), 500
+
+@bp.route("/api/replay", methods=["POST"])
+def replay_api():
+    """
+    API endpoint to replay a recorded session without calling a model.
+    """
+    try:
+        data = request.get_json()
+        session_id = data.get("session_id", "")
+
+        if not session_id:
+            return jsonify({"error": "No session ID provided."}), 400
+
+        # - Only trajectories saved under their session's UUID can be replayed
+        try:
+            get_trajectory_path(session_id)
+        except ValueError:
+            return jsonify({"error": "The session ID must be a UUID."}), 400
 
+        with desktop_session():
+            result = replay(session_id)
         return jsonify(result), 200
+    except DesktopBusyException as e:
+        return jsonify({"error": str(e)}), 409
+    except FileNotFoundError:
+        return jsonify({"error": f"No trajectory recorded for session '{session_id}'."}), 404
     except Exception as e:
         return jsonify({"error":str(e)}), 500
 
@@ -74,16 +150,19 @@ def read_api():
         if not terminal_prompt:
             return  jsonify({"error": "No terminal prompt provided."}), 400
         
-        # - Call the main_for_api to execute the logic
-        result = main_for_api(
-            model="gpt-4",
-            terminal_prompt=terminal_prompt,
-            voice_mode=False,
-            verbose_mode=False,
-            image2text= True
-        )
+        # - Call the main_for_api to execute the logic, one session per desktop
+        with desktop_session():
+            result = main_for_api(
+                model="gpt-4",
+                terminal_prompt=terminal_prompt,
+                voice_mode=False,
+                verbose_mode=False,
+                image2text= True
+            )
 
         return jsonify(result), 200
+    except DesktopBusyException as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         return jsonify({"error":str(e)}), 500
 
@@ -96,4 +175,6 @@ def create_app():
 
 if __name__ == "__main__":
     app = create_app()
+    # the dev server loads models lazily, so it is ready right away; see server.py for production
+    set_ready()
     app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
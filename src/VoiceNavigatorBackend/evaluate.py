@@ -4,14 +4,24 @@ import subprocess
 import platform
 import base64
 import json
+import glob
+import shutil
+import tempfile
+import time
+import multiprocessing
+import shlex
+import statistics
+from concurrent.futures import ProcessPoolExecutor
 import openai
 import argparse
 
 from dotenv import load_dotenv
 
-# "Objective for `operate`" : "Guideline for passing this test case given to GPT-4v"
+# "Objective for `operate`" : Guideline for passing this test case, either checks
+# judged locally on the final screenshot (see `check_guideline` in
+# operate/utils/verify.py) or free-form text given to GPT-4o
 TEST_CASES = {
-    "Go to Github.com": "A Github page is visible.",
+    "Go to Github.com": {"text": "GitHub", "window": "GitHub"},
     "Go to Youtube.com and play a video": "The YouTube video player is visible.",
 }
 
@@ -27,6 +37,16 @@ Guideline: {guideline}
 
 SCREENSHOT_PATH = os.path.join("screenshots", "screenshot.png")
 
+# First X display number tried for the virtual displays
+FIRST_DISPLAY = 99
+DISPLAY_START_TIMEOUT = 10
+# Desktop session started on each virtual display. A bare Xvfb has no window
+# manager, so the search key opens nothing and no window is ever focused.
+DEFAULT_DESKTOP = "dbus-run-session xfce4-session"
+
+# Whether this worker's display runs a desktop, see `use_display`
+_has_desktop = True
+
 
 # Check if on a windows terminal that supports ANSI escape codes
 def supports_ansi():
@@ -85,9 +105,9 @@ def parse_eval_content(content):
         exit(1)
 
 
-def evaluate_final_screenshot(guideline):
+def evaluate_final_screenshot(guideline, screenshot_path=SCREENSHOT_PATH):
     """Load the final screenshot and return True or False if it meets the given guideline."""
-    with open(SCREENSHOT_PATH, "rb") as img_file:
+    with open(screenshot_path, "rb") as img_file:
         img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
 
         eval_message = [
@@ -108,7 +128,7 @@ def evaluate_final_screenshot(guideline):
             messages=eval_message,
             presence_penalty=1,
             frequency_penalty=1,
-            temperature=0.7,
+            temperature=0,
         )
 
         eval_content = response.choices[0].message.content
@@ -116,6 +136,20 @@ def evaluate_final_screenshot(guideline):
         return parse_eval_content(eval_content)
 
 
+def judge_final_screenshot(guideline, screenshot_path=SCREENSHOT_PATH):
+    """Judges the final screenshot locally when the guideline is a dict of checks, with the vision model otherwise."""
+    if isinstance(guideline, str):
+        return evaluate_final_screenshot(guideline, screenshot_path)
+
+    # imported here, the checks load the OCR and detection models
+    from operate.utils.verify import check_guideline
+
+    met, reason = check_guideline(guideline, screenshot_path)
+    if not met:
+        print(reason)
+    return met
+
+
 def run_test_case(objective, guideline, model):
     """Returns True if the result of the test with the given prompt meets the given guideline for the given model."""
     # Run `operate` with the model to evaluate and the test case prompt
@@ -125,7 +159,7 @@ def run_test_case(objective, guideline, model):
     )
 
     try:
-        result = evaluate_final_screenshot(guideline)
+        result = judge_final_screenshot(guideline)
     except OSError:
         print("[Error] Couldn't open the screenshot for evaluation")
         return False
@@ -133,31 +167,208 @@ def run_test_case(objective, guideline, model):
     return result
 
 
-def get_test_model():
-    parser = argparse.ArgumentParser(
-        description="Run the self-operating-computer with a specified model."
-    )
+def start_displays(count, screen, desktop=DEFAULT_DESKTOP):
+    """
+    Starts `count` Xvfb displays, each with the `desktop` session running on it.
 
-    parser.add_argument(
-        "-m",
-        "--model",
-        help="Specify the model to evaluate.",
-        required=False,
-        default="gpt-4-with-ocr",
-    )
+    Returns:
+    dict: Display number -> its processes, and whether the desktops started.
+    """
+    if shutil.which("Xvfb") is None:
+        print(f"{ANSI_RED}[Error] Xvfb is not installed, e.g. `apt install xvfb`{ANSI_RESET}")
+        exit(1)
 
-    return parser.parse_args().model
+    displays = {}
+    number = FIRST_DISPLAY
+    while len(displays) < count:
+        # skip displays already taken by another X server
+        if os.path.exists(f"/tmp/.X{number}-lock"):
+            number += 1
+            continue
+        displays[number] = [
+            subprocess.Popen(
+                ["Xvfb", f":{number}", "-screen", "0", screen, "-nolisten", "tcp"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        ]
+        number += 1
+
+    deadline = time.monotonic() + DISPLAY_START_TIMEOUT
+    for number, processes in displays.items():
+        while not os.path.exists(f"/tmp/.X11-unix/X{number}"):
+            if processes[0].poll() is not None or time.monotonic() > deadline:
+                stop_displays(displays)
+                print(f"{ANSI_RED}[Error] Xvfb couldn't start display :{number}{ANSI_RESET}")
+                exit(1)
+            time.sleep(0.1)
+
+    desktop_command = shlex.split(desktop or "")
+    if not desktop_command or shutil.which(desktop_command[0]) is None:
+        print(
+            f"{ANSI_YELLOW}[Warning] No desktop session ({desktop or 'none'}) on the displays: "
+            f"apps can't be opened from the search key and window checks are skipped{ANSI_RESET}"
+        )
+        return displays, False
+    for number, processes in displays.items():
+        processes.append(
+            subprocess.Popen(
+                desktop_command,
+                env=dict(os.environ, DISPLAY=f":{number}"),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        )
+    return displays, True
 
 
-def main():
-    load_dotenv()
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+def stop_displays(displays):
+    # desktops first, then their X servers
+    for processes in displays.values():
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
 
-    model = get_test_model()
 
-    print(f"{ANSI_BLUE}[EVALUATING MODEL `{model}`]{ANSI_RESET}")
-    print(f"{ANSI_BRIGHT_MAGENTA}[STARTING EVALUATION]{ANSI_RESET}")
+def use_display(display_queue, has_desktop):
+    """Process pool initializer: gives each worker a display of its own for all its runs."""
+    global _has_desktop
+    os.environ["DISPLAY"] = f":{display_queue.get()}"
+    _has_desktop = has_desktop
+
+
+def count_steps(workspace):
+    """Returns the number of loop steps in the run's trajectory, or None without one."""
+    trajectories = glob.glob(os.path.join(workspace, "trajectories", "*.json"))
+    if not trajectories:
+        return None
+    with open(max(trajectories, key=os.path.getmtime), "r", encoding="utf-8") as file:
+        return len(json.load(file)["steps"])
+
+
+def run_isolated_test_case(objective, guideline, model, keep_workspace=False):
+    """
+    Runs one test case on the worker's display, in a workspace of its own so
+    screenshots, logs and trajectories of concurrent runs don't overwrite each other.
+    """
+    if not _has_desktop and isinstance(guideline, dict) and "window" in guideline:
+        # nothing gets focused without a window manager
+        guideline = {key: value for key, value in guideline.items() if key != "window"}
+
+    workspace = tempfile.mkdtemp(prefix="operate-eval-")
+    start = time.monotonic()
+    subprocess.run(
+        ["operate", "-m", model, "--prompt", f'"{objective}"'],
+        stdout=subprocess.DEVNULL,
+        cwd=workspace,
+    )
+    wall_time = time.monotonic() - start
+
+    try:
+        passed = judge_final_screenshot(guideline, os.path.join(workspace, SCREENSHOT_PATH))
+    except OSError:
+        print(f"[Error] Couldn't open the screenshot for evaluation of '{objective}'")
+        passed = False
+    except SystemExit:
+        # a judge response that couldn't be parsed fails this run, not the whole suite
+        passed = False
+
+    result = {
+        "objective": objective,
+        "passed": bool(passed),
+        "steps": count_steps(workspace),
+        "wall_time": wall_time,
+        "display": os.environ.get("DISPLAY"),
+        "workspace": workspace,
+        "error": None,
+    }
+    if not keep_workspace:
+        shutil.rmtree(workspace, ignore_errors=True)
+    return result
 
+
+def summarize_runs(runs):
+    """Aggregates the runs of each test case: pass rate, mean steps and wall time."""
+    summary = {}
+    for objective in TEST_CASES:
+        case_runs = [run for run in runs if run["objective"] == objective]
+        steps = [run["steps"] for run in case_runs if run["steps"] is not None]
+        wall_times = [run["wall_time"] for run in case_runs if run["wall_time"] is not None]
+        summary[objective] = {
+            "runs": len(case_runs),
+            "pass_rate": sum(run["passed"] for run in case_runs) / len(case_runs),
+            "errors": sum(run["error"] is not None for run in case_runs),
+            "mean_steps": statistics.mean(steps) if steps else None,
+            "mean_wall_time": statistics.mean(wall_times) if wall_times else None,
+        }
+    return summary
+
+
+def run_parallel(model, workers, repeat, screen, keep_workspaces, desktop=DEFAULT_DESKTOP):
+    """Runs every test case `repeat` times over `workers` virtual displays."""
+    displays, has_desktop = start_displays(workers, screen, desktop)
+    print(f"{ANSI_BLUE}[DISPLAYS]{ANSI_RESET} {', '.join(f':{number}' for number in displays)}")
+
+    manager = multiprocessing.Manager()
+    display_queue = manager.Queue()
+    for number in displays:
+        display_queue.put(number)
+
+    start = time.monotonic()
+    runs = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=use_display, initargs=(display_queue, has_desktop)
+        ) as executor:
+            futures = [
+                (
+                    objective,
+                    executor.submit(run_isolated_test_case, objective, guideline, model, keep_workspaces),
+                )
+                for _ in range(repeat)
+                for objective, guideline in TEST_CASES.items()
+            ]
+            for objective, future in futures:
+                try:
+                    run = future.result()
+                except Exception as e:
+                    # a run that crashed fails its case, the others go on
+                    run = {
+                        "objective": objective,
+                        "passed": False,
+                        "steps": None,
+                        "wall_time": None,
+                        "display": None,
+                        "workspace": None,
+                        "error": f"{type(e).__name__}: {e}",
+                    }
+                    print(f"{ANSI_RED}[ERROR]{ANSI_RESET} '{objective}': {run['error']}")
+                else:
+                    status = f"{ANSI_GREEN}[PASSED]" if run["passed"] else f"{ANSI_RED}[FAILED]"
+                    print(
+                        f"{status}{ANSI_RESET} '{run['objective']}' on {run['display']} in {run['wall_time']:.1f}s, {run['steps']} steps"
+                    )
+                runs.append(run)
+    finally:
+        stop_displays(displays)
+        manager.shutdown()
+    wall_time = time.monotonic() - start
+
+    for objective, case in summarize_runs(runs).items():
+        steps = "-" if case["mean_steps"] is None else f"{case['mean_steps']:.1f}"
+        case_wall_time = "-" if case["mean_wall_time"] is None else f"{case['mean_wall_time']:.1f}"
+        print(
+            f"{ANSI_BLUE}[CASE]{ANSI_RESET} '{objective}': {case['pass_rate']:.0%} of {case['runs']} passed, "
+            f"{case['errors']} errors, {steps} steps, {case_wall_time}s"
+        )
+    passed = sum(run["passed"] for run in runs)
+    print(
+        f"{ANSI_BRIGHT_MAGENTA}[EVALUATION COMPLETE]{ANSI_RESET} {passed} of {len(runs)} runs passed in {wall_time:.1f}s on {workers} displays"
+    )
+
+
+def run_sequential(model):
+    """Runs every test case once, one after another, on the current screen."""
     passed = 0
     failed = 0
     for objective, guideline in TEST_CASES.items():
@@ -176,5 +387,65 @@ def main():
     )
 
 
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Run the self-operating-computer with a specified model."
+    )
+
+    parser.add_argument(
+        "-m",
+        "--model",
+        help="Specify the model to evaluate.",
+        required=False,
+        default="gpt-4-with-ocr",
+    )
+    parser.add_argument(
+        "-p",
+        "--parallel",
+        help="Run the test cases concurrently on this many Xvfb displays instead of the current screen.",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Runs of each test case, with --parallel.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--screen",
+        help="Size and depth of the Xvfb displays.",
+        default="1920x1080x24",
+    )
+    parser.add_argument(
+        "--desktop",
+        help="Desktop session started on each Xvfb display, \"\" for none (window checks are then skipped).",
+        default=DEFAULT_DESKTOP,
+    )
+    parser.add_argument(
+        "--keep-workspaces",
+        help="Keep each run's screenshots, logs and trajectory.",
+        action="store_true",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+
+    args = get_arguments()
+    model = args.model
+
+    print(f"{ANSI_BLUE}[EVALUATING MODEL `{model}`]{ANSI_RESET}")
+    print(f"{ANSI_BRIGHT_MAGENTA}[STARTING EVALUATION]{ANSI_RESET}")
+
+    if args.parallel > 0:
+        run_parallel(model, args.parallel, args.repeat, args.screen, args.keep_workspaces, args.desktop)
+    else:
+        run_sequential(model)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,23 @@
+import os
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def load_images(corpus_dir):
+    return sorted(
+        os.path.join(corpus_dir, name)
+        for name in os.listdir(corpus_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_table(results, columns):
+    print(" ".join(f"{column:>10}" for column in columns))
+    for result in results:
+        print(" ".join(f"{str(result[column]):>10}" for column in columns))
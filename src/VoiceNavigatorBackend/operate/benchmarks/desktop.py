@@ -0,0 +1,140 @@
+"""
+Runs whole `main_for_api` sessions against the simulated desktop and a
+scripted model, to measure the loop's throughput end to end.
+
+    python -m operate.benchmarks.desktop --model gpt-4-with-ocr --sessions 10
+
+The fake model plays the scenario's solution, so a step costs what the loop
+itself costs: capture, encode, OCR for text clicks, parsing and the actions.
+The settling delay before each model call is skipped, see --model-call-delay.
+No network and no display are needed. With --json the sessions' own output
+goes to stderr, so stdout is only the JSON.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import operate.models.apis
+import operate.operate
+from operate.benchmarks.common import percentile, print_table
+from operate.benchmarks.loop import FakeModel
+from operate.config import Config
+from operate.models.schema import get_click_target
+from operate.utils.operating_system import set_operating_system
+from operate.utils.retry import RETRY_POLICIES, RetryPolicy
+from operate.utils.screenshot import set_screen_source
+from operate.utils.simulated_desktop import (
+    SimulatedDesktop,
+    SimulatedOperatingSystem,
+    load_scenario,
+)
+
+# Load configuration
+config = Config()
+
+# `-m` models the scripted model can answer for
+SIMULATED_MODELS = ("gpt-4", "gpt-4-with-ocr")
+
+
+def run_session(model, desktop):
+    desktop.reset()
+    start = time.perf_counter()
+    result = operate.operate.main_for_api(model, desktop.scenario["objective"])
+    metrics = result.get("metrics", {})
+    return {
+        "seconds": time.perf_counter() - start,
+        "steps": metrics.get("model", {}).get("count", 0),
+        "actions": desktop.actions,
+        "success": desktop.reached_goal and "error" not in result,
+        "error": result.get("error"),
+        "metrics": metrics,
+    }
+
+
+def summarize(sessions):
+    """
+    Returns the throughput of the sessions and one row per stage.
+    """
+    seconds = sum(session["seconds"] for session in sessions)
+    durations = [session["seconds"] for session in sessions]
+    summary = {
+        "sessions": len(sessions),
+        "success_rate": round(sum(session["success"] for session in sessions) / len(sessions), 3),
+        "steps_per_s": round(sum(session["steps"] for session in sessions) / seconds, 2),
+        "actions_per_s": round(sum(session["actions"] for session in sessions) / seconds, 2),
+        "session_p50_s": round(percentile(durations, 50), 2),
+        "session_p95_s": round(percentile(durations, 95), 2),
+    }
+
+    stages = {}
+    for session in sessions:
+        for stage, values in session["metrics"].items():
+            totals = stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+            totals["count"] += values["count"]
+            totals["seconds"] += values["seconds"]
+    rows = [
+        {
+            "stage": stage,
+            "count": totals["count"],
+            "mean_ms": round(totals["seconds"] / totals["count"] * 1000, 2),
+            "share": f"{totals['seconds'] / seconds:.0%}",
+        }
+        for stage, totals in sorted(stages.items())
+    ]
+    return summary, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark whole sessions on a simulated desktop.")
+    parser.add_argument("--model", default="gpt-4-with-ocr", choices=SIMULATED_MODELS)
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--scenario", help="JSON scenario, see operate.utils.simulated_desktop")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the fake model takes to answer")
+    parser.add_argument("--action-delay", type=float, default=0.0, help="Seconds between two actions")
+    parser.add_argument(
+        "--model-call-delay", type=float, default=0.0, help="Seconds to wait before each model call"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    desktop = SimulatedDesktop(load_scenario(args.scenario))
+    click_target = get_click_target(args.model)
+    fake_model = FakeModel(args.latency, lambda: json.dumps(desktop.solution(click_target)))
+
+    # the fake model needs no key, but the session checks there is one
+    os.environ.setdefault("OPENAI_API_KEY", "simulated")
+    config.initialize_openai = lambda: fake_model
+    RETRY_POLICIES["openai"] = RetryPolicy(max_attempts=1, failure_threshold=sys.maxsize)
+    set_screen_source(desktop.render)
+    set_operating_system(SimulatedOperatingSystem(desktop))
+    operate.operate.ACTION_DELAY = args.action_delay
+    operate.models.apis.MODEL_CALL_DELAY = args.model_call_delay
+
+    # the sessions print their actions, which must not mix with the JSON on stdout
+    output = sys.stderr if args.json else sys.stdout
+    with contextlib.redirect_stdout(output):
+        # loads the OCR models, kept apart from the measures
+        run_session(args.model, desktop)
+        sessions = [run_session(args.model, desktop) for _ in range(args.sessions)]
+    set_screen_source(None)
+    set_operating_system(None)
+
+    summary, rows = summarize(sessions)
+    errors = [session["error"] for session in sessions if session["error"]]
+
+    if args.json:
+        print(json.dumps({"summary": summary, "stages": rows, "errors": errors}, indent=2))
+        return
+
+    print_table([summary], tuple(summary))
+    print()
+    print_table(rows, ("stage", "count", "mean_ms", "share"))
+    if errors:
+        print(f"\n{len(errors)} of {len(sessions)} sessions failed, first: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
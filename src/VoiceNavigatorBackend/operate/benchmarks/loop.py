@@ -0,0 +1,218 @@
+"""
+Benchmarks the agent loop offline, on recorded screenshots and a fake model.
+
+The corpus is a directory of screenshots, played in name order as the frames
+of a session. An optional `responses.json` in it maps file names to the raw
+model output to answer on that frame. Otherwise the fake model clicks the
+first text `labels.json` lists for the frame, the center of the screen or the
+first label, depending on the model. Nothing goes over the network and no
+action is executed, so it runs on a CPU-only machine without a desktop.
+
+    python -m operate.benchmarks.loop screenshots/corpus --model gpt-4-with-ocr --repeat 5
+
+Stages are the ones timed in the loop (capture, encode, ocr, yolo, parse...),
+plus `history`, the serialization of the message history an SDK does before
+each request. Here `capture` copies the recorded frame. The settling delay
+before each model call (MODEL_CALL_DELAY) is skipped, it would hide the rest.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import operate.models.apis
+from operate.benchmarks.common import load_images, percentile, print_table
+from operate.config import Config
+from operate.models.apis import get_next_action
+from operate.models.prompts import get_system_prompt
+from operate.models.schema import get_click_target
+from operate.utils.metrics import get_session_metrics, start_session_metrics, timed
+from operate.utils.retry import RETRY_POLICIES, RetryPolicy
+from operate.utils.screenshot import set_screen_source
+
+# Load configuration
+config = Config()
+
+# `-m` models that only need the OpenAI client
+BENCHMARK_MODELS = ("gpt-4", "gpt-4-with-ocr", "o1-with-ocr", "gpt-4-with-som")
+OBJECTIVE = "Benchmark the agent loop"
+
+
+def load_corpus(corpus_dir):
+    images = load_images(corpus_dir)
+    corpus = {"labels": {}, "responses": {}}
+    for name in corpus:
+        path = os.path.join(corpus_dir, f"{name}.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                corpus[name] = json.load(file)
+    return images, corpus["labels"], corpus["responses"]
+
+
+def get_canned_response(model, frame, labels, responses):
+    """
+    Returns the model output recorded for a frame, or a plausible one.
+    """
+    name = os.path.basename(frame)
+    if name in responses:
+        response = responses[name]
+        return response if isinstance(response, str) else json.dumps(response)
+
+    operation = {"thought": "Benchmark step", "operation": "press", "keys": ["enter"]}
+    click_target = get_click_target(model)
+    if click_target == "text" and labels.get(name):
+        operation = {"thought": "Benchmark step", "operation": "click", "text": labels[name][0]}
+    elif click_target == "coordinates":
+        operation = {"thought": "Benchmark step", "operation": "click", "x": "0.5", "y": "0.5"}
+    elif click_target == "label":
+        operation = {"thought": "Benchmark step", "operation": "click", "label": "~0"}
+    return json.dumps([operation])
+
+
+class FakeModel:
+    """
+    Stands in for the OpenAI client, answering each request with the current
+    frame's canned response.
+
+    Attributes:
+        latency (float): Seconds each request takes.
+        response (str): What the next request returns.
+        respond (callable): Returns the response instead, when set.
+    """
+
+    def __init__(self, latency=0.0, respond=None):
+        self.latency = latency
+        self.response = "[]"
+        self.respond = respond
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, messages, **kwargs):
+        with timed("history"):
+            body = json.dumps({"model": model, "messages": messages})
+        time.sleep(self.latency)
+        content = self.respond() if self.respond is not None else self.response
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=message)],
+            # rough token counts, for the usage accounting
+            usage=SimpleNamespace(prompt_tokens=len(body) // 4, completion_tokens=len(content) // 4),
+        )
+
+
+def run_session(model, fake_model, images, labels, responses):
+    """
+    Plays every frame as one step of a session.
+
+    Returns:
+    list: One dict per step with its wall time, per-stage seconds, traced
+    memory peak and error, if any.
+    """
+    messages = [{"role": "system", "content": get_system_prompt(model, OBJECTIVE)}]
+    steps = []
+    for frame in images:
+        set_screen_source(lambda file_path, frame=frame: shutil.copyfile(frame, file_path))
+        fake_model.response = get_canned_response(model, frame, labels, responses)
+        start_session_metrics()
+        tracemalloc.reset_peak()
+        error = None
+        start = time.perf_counter()
+        try:
+            asyncio.run(get_next_action(model, messages, OBJECTIVE, None))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        steps.append(
+            {
+                "frame": os.path.basename(frame),
+                "seconds": time.perf_counter() - start,
+                "stages": get_session_metrics(),
+                "peak_bytes": tracemalloc.get_traced_memory()[1],
+                "error": error,
+            }
+        )
+    return steps
+
+
+def summarize(steps):
+    """
+    Returns one row per stage with its latency percentiles in milliseconds.
+    """
+    samples = {"step": [step["seconds"] for step in steps]}
+    for step in steps:
+        for stage, values in step["stages"].items():
+            samples.setdefault(stage, []).append(values["seconds"])
+    rows = []
+    for stage, values in sorted(samples.items()):
+        values = [value * 1000 for value in values]
+        rows.append(
+            {
+                "stage": stage,
+                "steps": len(values),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "mean_ms": round(statistics.mean(values), 2),
+            }
+        )
+    return rows
+
+
+def get_max_rss_mb():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop offline.")
+    parser.add_argument("corpus", help="Directory of screenshots, with optional labels.json and responses.json")
+    parser.add_argument("--model", default="gpt-4-with-ocr", choices=BENCHMARK_MODELS)
+    parser.add_argument("--repeat", type=int, default=3, help="Sessions played over the corpus")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the fake model takes to answer")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    images, labels, responses = load_corpus(args.corpus)
+    if not images:
+        parser.error(f"no screenshots found in {args.corpus}")
+
+    fake_model = FakeModel(args.latency)
+    config.initialize_openai = lambda: fake_model
+    # one attempt per step, a failing step is reported instead of retried
+    RETRY_POLICIES["openai"] = RetryPolicy(max_attempts=1, failure_threshold=sys.maxsize)
+    operate.models.apis.MODEL_CALL_DELAY = 0
+
+    # loads the OCR and detection models, kept apart from the latencies
+    run_session(args.model, fake_model, images[:1], labels, responses)
+
+    tracemalloc.start()
+    steps = []
+    for _ in range(args.repeat):
+        steps.extend(run_session(args.model, fake_model, images, labels, responses))
+    tracemalloc.stop()
+    set_screen_source(None)
+
+    rows = summarize(steps)
+    memory = {
+        "traced_peak_mb": round(max(step["peak_bytes"] for step in steps) / (1024 * 1024), 1),
+        "max_rss_mb": get_max_rss_mb(),
+    }
+    errors = [step for step in steps if step["error"]]
+
+    if args.json:
+        print(json.dumps({"stages": rows, "memory": memory, "errors": errors}, indent=2))
+        return
+
+    print_table(rows, ("stage", "steps", "p50_ms", "p95_ms", "mean_ms"))
+    print(f"\ntraced memory peak per step: {memory['traced_peak_mb']} MB, max RSS: {memory['max_rss_mb']} MB")
+    if errors:
+        print(f"{len(errors)} of {len(steps)} steps failed, first: {errors[0]['frame']}: {errors[0]['error']}")
+
+
+if __name__ == "__main__":
+    main()
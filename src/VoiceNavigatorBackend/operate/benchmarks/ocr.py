@@ -0,0 +1,99 @@
+"""
+Compares the OCR backends on a corpus of saved screenshots.
+
+The corpus is a directory of screenshots. An optional `labels.json` in it maps
+file names to the texts a click could target on that screenshot, which gives
+the hit rate: the share of those texts the backend found.
+
+    python -m operate.benchmarks.ocr screenshots/corpus --backends easyocr,tesseract
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from operate.benchmarks.common import load_images, percentile, print_table
+from operate.utils.ocr_backends import OCR_BACKENDS, get_ocr_backend
+
+
+def load_corpus(corpus_dir):
+    images = load_images(corpus_dir)
+    labels = {}
+    labels_path = os.path.join(corpus_dir, "labels.json")
+    if os.path.exists(labels_path):
+        with open(labels_path, "r", encoding="utf-8") as file:
+            labels = json.load(file)
+    return images, labels
+
+
+def benchmark_backend(name, images, labels, languages=None, repeat=1):
+    """
+    Reads every screenshot with one backend.
+
+    Returns:
+    dict: Load time, latency percentiles in milliseconds and the text hit rate.
+    """
+    backend = get_ocr_backend(name, languages)
+    start = time.perf_counter()
+    backend.readtext(images[0])  # loads the engine, kept apart from the latencies
+    load_time = time.perf_counter() - start
+
+    latencies = []
+    hits = expected = 0
+    for image in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = backend.readtext(image)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        for text in labels.get(os.path.basename(image), []):
+            expected += 1
+            # the same match `get_text_element` does
+            hits += any(text in element.text for element in result)
+
+    return {
+        "backend": name,
+        "load_s": round(load_time, 2),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "hit_rate": round(hits / expected, 3) if expected else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OCR backends.")
+    parser.add_argument("corpus", help="Directory of screenshots, with an optional labels.json")
+    parser.add_argument(
+        "--backends",
+        default=",".join(OCR_BACKENDS),
+        help="Comma separated backends to compare",
+    )
+    parser.add_argument("--languages", default="en", help="Comma separated language codes")
+    parser.add_argument("--repeat", type=int, default=1, help="Reads per screenshot")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    images, labels = load_corpus(args.corpus)
+    if not images:
+        parser.error(f"no screenshots found in {args.corpus}")
+
+    results = []
+    for name in args.backends.split(","):
+        try:
+            results.append(
+                benchmark_backend(name, images, labels, args.languages.split(","), args.repeat)
+            )
+        except ImportError as e:
+            print(f"[benchmark] skipping {name}: {e}")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print_table(results, ("backend", "load_s", "p50_ms", "p95_ms", "mean_ms", "hit_rate"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compares the ONNX labeling detector with the ultralytics one on saved screenshots.
+
+Reports the latency of both and how well the ONNX boxes agree with the
+ultralytics ones: a box agrees when it overlaps a box of the other path with
+an IoU of at least 0.5.
+
+    python -m operate.benchmarks.yolo screenshots/corpus --export --quantize
+"""
+import argparse
+import json
+import statistics
+import time
+
+from PIL import Image
+
+from operate.benchmarks.common import load_images, percentile, print_table
+from operate.utils.detector import OnnxDetector, UltralyticsDetector, export_onnx, get_weights_path
+
+AGREEMENT_IOU = 0.5
+
+
+def iou(box_a, box_b):
+    width = max(0, min(box_a[2], box_b[2]) - max(box_a[0], box_b[0]))
+    height = max(0, min(box_a[3], box_b[3]) - max(box_a[1], box_b[1]))
+    intersection = width * height
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    return intersection / (area_a + area_b - intersection + 1e-9)
+
+
+def count_matches(boxes, reference):
+    """
+    Counts the boxes matched one to one with a reference box.
+    """
+    unmatched = list(reference)
+    matches = 0
+    for box in boxes:
+        best = max(unmatched, key=lambda other: iou(box, other), default=None)
+        if best is not None and iou(box, best) >= AGREEMENT_IOU:
+            unmatched.remove(best)
+            matches += 1
+    return matches
+
+
+def time_detector(detector, images, repeat):
+    latencies, detections = [], []
+    for image in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            boxes = detector.detect(image)
+            latencies.append((time.perf_counter() - start) * 1000)
+        detections.append(boxes)
+    return latencies, detections
+
+
+def summarize(name, latencies):
+    return {
+        "detector": name,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "recall": None,
+        "precision": None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the labeling detectors.")
+    parser.add_argument("corpus", help="Directory of screenshots")
+    parser.add_argument("--onnx", help="ONNX model, defaults to best.onnx next to best.pt")
+    parser.add_argument("--export", action="store_true", help="Export best.pt to ONNX first")
+    parser.add_argument("--quantize", action="store_true", help="Export with int8 weights")
+    parser.add_argument("--image-size", type=int, default=640, help="ONNX input size")
+    parser.add_argument("--threads", type=int, default=0, help="onnxruntime threads")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per screenshot")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    onnx_path = args.onnx or get_weights_path("best.onnx")
+    if args.export:
+        onnx_path = export_onnx(image_size=args.image_size, quantize=args.quantize)
+
+    images = []
+    for path in load_images(args.corpus):
+        with Image.open(path) as img:
+            images.append(img.convert("RGB"))
+    if not images:
+        parser.error(f"no screenshots found in {args.corpus}")
+
+    reference = UltralyticsDetector(get_weights_path())
+    candidate = OnnxDetector(onnx_path, image_size=args.image_size, threads=args.threads)
+    # warm up both, the first call pays for lazy initialization
+    reference.detect(images[0])
+    candidate.detect(images[0])
+
+    reference_latencies, reference_boxes = time_detector(reference, images, args.repeat)
+    candidate_latencies, candidate_boxes = time_detector(candidate, images, args.repeat)
+
+    matches = sum(
+        count_matches(boxes, expected)
+        for boxes, expected in zip(candidate_boxes, reference_boxes)
+    )
+    expected_count = sum(len(boxes) for boxes in reference_boxes)
+    found_count = sum(len(boxes) for boxes in candidate_boxes)
+
+    results = [summarize("ultralytics", reference_latencies), summarize("onnx", candidate_latencies)]
+    results[1]["recall"] = round(matches / expected_count, 3) if expected_count else None
+    results[1]["precision"] = round(matches / found_count, 3) if found_count else None
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print_table(results, ("detector", "p50_ms", "p95_ms", "mean_ms", "recall", "precision"))
+
+
+if __name__ == "__main__":
+    main()
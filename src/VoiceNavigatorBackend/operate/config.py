@@ -1,12 +1,9 @@
 import os
 import sys
 
-import google.generativeai as genai
 from dotenv import load_dotenv
-from ollama import Client
-from openai import OpenAI
-import anthropic
-from prompt_toolkit.shortcuts import input_dialog
+
+from operate.utils.providers import load_sdk
 
 
 class Config:
@@ -18,6 +15,9 @@ class Config:
         openai_api_key (str): API key for OpenAI.
         google_api_key (str): API key for Google.
         ollama_host (str): url to ollama running remotely.
+        structured_output (bool): Flag indicating whether providers are asked for schema-constrained output.
+        plan_mode (bool): Flag indicating whether the model plans the whole objective at once.
+        describe_screen (bool): Flag indicating whether OCR models also get the screen's text and its changes.
     """
 
     _instance = None
@@ -29,8 +29,16 @@ class Config:
         return cls._instance
 
     def __init__(self):
+        # every module calls Config(), only the first call may set the defaults
+        if getattr(self, "_initialized", False):
+            return
+        self._initialized = True
         load_dotenv()
         self.verbose = False
+        self.plan_mode = False
+        # set STRUCTURED_OUTPUT=false for OpenAI compatible servers without json_schema support
+        self.structured_output = os.getenv("STRUCTURED_OUTPUT", "true").lower() != "false"
+        self.describe_screen = os.getenv("DESCRIBE_SCREEN", "false").lower() == "true"
         self.openai_api_key = (
             None  # instance variables are backups in case saving to a `.env` fails
         )
@@ -59,7 +67,7 @@ class Config:
                 )
             api_key = os.getenv("OPENAI_API_KEY")
 
-        client = OpenAI(
+        client = load_sdk("openai").OpenAI(
             api_key=api_key,
         )
         client.api_key = api_key
@@ -77,6 +85,7 @@ class Config:
                     "[Config][initialize_google] no cached google_api_key, try to get from env."
                 )
             api_key = os.getenv("GOOGLE_API_KEY")
+        genai = load_sdk("google")
         genai.configure(api_key=api_key, transport="rest")
         model = genai.GenerativeModel("gemini-pro-vision")
 
@@ -92,7 +101,7 @@ class Config:
                     "[Config][initialize_ollama] no cached ollama host. Assuming ollama running locally."
                 )
             self.ollama_host = os.getenv("OLLAMA_HOST", None)
-        model = Client(host=self.ollama_host)
+        model = load_sdk("ollama").Client(host=self.ollama_host)
         return model
 
     def initialize_anthropic(self):
@@ -100,7 +109,7 @@ class Config:
             api_key = self.anthropic_api_key
         else:
             api_key = os.getenv("ANTHROPIC_API_KEY")
-        return anthropic.Anthropic(api_key=api_key)
+        return load_sdk("anthropic").Anthropic(api_key=api_key)
 
     def validation(self, model, voice_mode):
         """
@@ -133,6 +142,8 @@ class Config:
             self.prompt_and_save_api_key(key_name, key_description)
 
     def prompt_and_save_api_key(self, key_name, key_description):
+        from prompt_toolkit.shortcuts import input_dialog
+
         key_value = input_dialog(
             title="API Key Required", text=f"Please enter your {key_description}:"
         ).run()
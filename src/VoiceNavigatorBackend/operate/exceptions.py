@@ -12,4 +12,107 @@ class ModelNotRecognizedException(Exception):
         super().__init__(self.message)
 
     def __str__(self):
-        return f"{self.message} : {self.model} "
\ No newline at end of file
+        return f"{self.message} : {self.model} "
+
+class RetryExhaustedException(Exception):
+    """Exception raised when a provider keeps failing under its retry policy.
+
+    Attributes:
+        provider -- the provider that was called
+        attempts -- number of attempts that were made
+        last_error -- the exception raised by the final attempt
+    """
+
+    def __init__(self, provider, attempts, last_error=None):
+        self.provider = provider
+        self.attempts = attempts
+        self.last_error = last_error
+        self.message = f"Gave up after {attempts} attempt(s)"
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.message} : {self.provider} ({self.last_error})"
+
+
+class CircuitOpenException(Exception):
+    """Exception raised when a provider's circuit breaker is open.
+
+    Attributes:
+        provider -- the provider whose circuit is open
+        retry_in -- seconds until the circuit allows a trial request
+    """
+
+    def __init__(self, provider, retry_in, message="Circuit open"):
+        self.provider = provider
+        self.retry_in = retry_in
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.message} : {self.provider} (retry in {self.retry_in:.1f}s)"
+
+
+class InvalidOperationsException(Exception):
+    """Exception raised when model output can't be turned into valid operations.
+
+    Attributes:
+        content -- the model output
+        message -- explanation of the error
+    """
+
+    def __init__(self, content, message="Invalid operations"):
+        self.content = content
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.message} : {self.content}"
+
+
+class BudgetExceededException(Exception):
+    """Exception raised when a session has used up one of its budgets.
+
+    Attributes:
+        budget -- the budget used up: "tokens", "cost" or "image_bytes"
+        used -- how much of it the session used
+        limit -- the budget's limit
+    """
+
+    def __init__(self, budget, used, limit, message="Budget exceeded"):
+        self.budget = budget
+        self.used = used
+        self.limit = limit
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.message} : {self.budget} ({self.used:g} of {self.limit:g})"
+
+
+class DesktopBusyException(Exception):
+    """Exception raised when a session is started while another one drives the desktop.
+
+    Attributes:
+        message -- explanation of the error
+    """
+
+    def __init__(self, message="Another session is running on this desktop"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class TextNotFoundException(Exception):
+    """Exception raised when OCR can't find the text of a click on the screen.
+
+    Attributes:
+        text -- the text that was looked for
+        message -- explanation of the error
+    """
+
+    def __init__(self, text, message="The text element was not found in the image"):
+        self.text = text
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.message} : {self.text}"
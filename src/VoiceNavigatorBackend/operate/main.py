@@ -2,8 +2,10 @@
 Self-Operating Computer
 """
 import argparse
+import os
+import sys
+
 from operate.utils.style import ANSI_BRIGHT_MAGENTA
-from operate.operate import main
 
 
 def main_entry():
@@ -32,6 +34,42 @@ def main_entry():
         action="store_true",
     )
     
+    # Add a flag for streamed execution
+    parser.add_argument(
+        "--stream",
+        help="Execute each action as soon as the model has streamed it",
+        action="store_true",
+    )
+
+    # Add a flag for plan mode
+    parser.add_argument(
+        "--plan",
+        help="Plan the whole objective at once and verify each step locally (OCR models)",
+        action="store_true",
+    )
+
+    # Add a flag for the decision cache
+    parser.add_argument(
+        "--cache",
+        help="Reuse the actions that worked before for the same objective and screen",
+        action="store_true",
+    )
+
+    # Replay a recorded trajectory instead of calling a model
+    parser.add_argument(
+        "--replay",
+        help="Replay a recorded trajectory (file or session ID) without calling a model",
+        type=str,
+        required=False,
+    )
+
+    # Report what starting up costs instead of running
+    parser.add_argument(
+        "--profile-startup",
+        help="Report the import time of the CLI and the server, heaviest packages first",
+        action="store_true",
+    )
+
     # Allow for direct input of prompt
     parser.add_argument(
         "--prompt",
@@ -42,11 +80,31 @@ def main_entry():
 
     try:
         args = parser.parse_args()
+        if args.profile_startup:
+            from operate.utils.startup import profile_startup
+
+            sys.exit(0 if profile_startup() else 1)
+
+        # imported once the arguments are valid, so `--help` stays fast
+        from operate.operate import main, replay
+
+        if args.replay:
+            from operate.utils.trajectory import load_trajectory_file
+
+            # a file given on the command line is trusted, the API only takes session IDs
+            trajectory = args.replay
+            if os.path.exists(trajectory):
+                trajectory = load_trajectory_file(trajectory)
+            replay(trajectory, verbose_mode=args.verbose)
+            return
         main(
             args.model,
             terminal_prompt=args.prompt,
             voice_mode=args.voice,
-            verbose_mode=args.verbose
+            verbose_mode=args.verbose,
+            stream=args.stream,
+            plan_mode=args.plan,
+            cache=args.cache,
         )
     except KeyboardInterrupt:
         print(f"\n{ANSI_BRIGHT_MAGENTA}Exiting...")
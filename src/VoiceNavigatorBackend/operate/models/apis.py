@@ -3,67 +3,176 @@ import io
 import json
 import os
 import time
-import traceback
 
-import easyocr
-import ollama
-import pkg_resources
 from PIL import Image
-from ultralytics import YOLO
 
 from operate.config import Config
-from operate.exceptions import ModelNotRecognizedException
+from operate.exceptions import (
+    CircuitOpenException,
+    InvalidOperationsException,
+    ModelNotRecognizedException,
+    RetryExhaustedException,
+)
 from operate.models.prompts import (
     get_system_prompt,
     get_user_first_message_prompt,
     get_user_prompt,
 )
+from operate.models.schema import (
+    get_anthropic_tool,
+    get_click_target,
+    get_openai_response_format,
+    load_operations,
+    validate_operation,
+)
 from operate.utils.label import (
     add_labels,
     get_click_position_in_percent,
     get_label_coordinates,
 )
-from operate.utils.ocr import get_text_coordinates, get_text_element
+from operate.utils.element_map import describe_screen, get_element_map
+from operate.utils.incremental_json import IncrementalOperationParser
+from operate.utils.metrics import timed
+from operate.utils.grounding import locate_text
+from operate.utils.providers import load_sdk
+from operate.utils.retry import call_with_retry, get_circuit_breaker, get_provider
 from operate.utils.screenshot import capture_screen_with_cursor
 from operate.utils.style import ANSI_BRIGHT_MAGENTA, ANSI_GREEN, ANSI_RED, ANSI_RESET
+from operate.utils.tracing import annotate, span
+from operate.utils.usage import get_image_scale, get_payload_size, metered
 
 # Load configuration
 config = Config()
 
+# `-m` models that can be streamed, and the OpenAI model each one calls
+STREAMING_MODELS = {
+    "gpt-4": "gpt-4o",
+    "gpt-4-with-ocr": "o1",
+    "o1-with-ocr": "gpt-4o",
+}
+# Seconds to let the screen settle before each step's screenshot and model call
+MODEL_CALL_DELAY = float(os.getenv("MODEL_CALL_DELAY", 1))
+
+
+def wait_before_call():
+    if MODEL_CALL_DELAY > 0:
+        with timed("delay"):
+            time.sleep(MODEL_CALL_DELAY)
+
 
 async def get_next_action(model, messages, objective, session_id):
     if config.verbose:
         print("[Self-Operating Computer][get_next_action]")
         print("[Self-Operating Computer][get_next_action] model", model)
+    if model == "agent-1":
+        return "coming soon"
     if model == "gpt-4":
-        return call_gpt_4o(messages), session_id
+        operation = await call_with_retry(
+            "openai", lambda: call_gpt_4o(messages), messages
+        )
+        return operation, session_id
     if model == "gpt-4-with-som":
-        operation = await call_gpt_4o_labeled(messages, objective, model)
+        operation = await call_with_fallback(
+            model,
+            lambda: call_gpt_4o_labeled(messages, objective, model),
+            lambda: call_gpt_4o(messages),
+            messages,
+        )
         return operation, None
     if model == "gpt-4-with-ocr":
-        operation = await call_gpt_4o_with_ocr(messages, objective, model)
+        operation = await call_with_fallback(
+            model,
+            lambda: call_gpt_4o_with_ocr(messages, objective, model),
+            lambda: gpt_4_fallback(messages, objective, model),
+            messages,
+        )
         return operation, None
     if model == "o1-with-ocr":
-        operation = await call_o1_with_ocr(messages, objective, model)
+        operation = await call_with_fallback(
+            model,
+            lambda: call_o1_with_ocr(messages, objective, model),
+            lambda: gpt_4_fallback(messages, objective, model),
+            messages,
+        )
         return operation, None
-    if model == "agent-1":
-        return "coming soon"
     if model == "gemini-pro-vision":
-        return call_gemini_pro_vision(messages, objective), None
+        operation = await call_with_fallback(
+            model,
+            lambda: call_gemini_pro_vision(messages, objective),
+            lambda: call_gpt_4o(messages),
+            messages,
+        )
+        return operation, None
     if model == "llava":
-        operation = call_ollama_llava(messages)
+        operation = await call_with_retry(
+            "ollama", lambda: call_ollama_llava(messages), messages
+        )
         return operation, None
     if model == "claude-3":
-        operation = await call_claude_3_with_ocr(messages, objective, model)
+        # the fallback works on a GPT-4 formatted copy, rebuilt for every attempt
+        operation = await call_with_fallback(
+            model,
+            lambda: call_claude_3_with_ocr(messages, objective, model),
+            lambda: gpt_4_fallback(
+                convert_messages_to_gpt_4(messages), objective, model
+            ),
+            messages,
+        )
         return operation, None
     raise ModelNotRecognizedException(model)
 
 
+async def call_with_fallback(model, primary, fallback, messages):
+    """
+    Runs `primary` under the retry policy of the model's provider and, once it
+    gives up or its circuit is open, runs `fallback` under the OpenAI policy.
+    """
+    try:
+        return await call_with_retry(get_provider(model), primary, messages)
+    except (RetryExhaustedException, CircuitOpenException) as e:
+        print(
+            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[{model}] That did not work. Trying another method {ANSI_RESET}"
+        )
+        if config.verbose:
+            print("[Self-Operating Computer][Operate] error", e)
+        with span("fallback", "retry", model=model, reason=type(e).__name__):
+            return await call_with_retry("openai", fallback, messages)
+
+
+def add_screen_description(vision_message, screenshot_filename):
+    """
+    With DESCRIBE_SCREEN=true, adds the screen's text and what changed since the
+    previous frame to a user message. Text clicks are resolved against the same
+    frame, so its OCR is still read once per step.
+    """
+    if not config.describe_screen:
+        return
+    with timed("describe"):
+        description = describe_screen(screenshot_filename)
+    vision_message["content"].append({"type": "text", "text": description})
+
+
+def downscale_image(img_base64):
+    """
+    Shrinks a base64 screenshot once the session's budget downgraded it. Models
+    answer in screen percentages, so smaller screenshots don't move the clicks.
+    """
+    scale = get_image_scale()
+    if scale >= 1:
+        return img_base64
+    img = Image.open(io.BytesIO(base64.b64decode(img_base64)))
+    size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+    img_buffer = io.BytesIO()
+    img.resize(size, Image.Resampling.LANCZOS).save(img_buffer, format="PNG")
+    return base64.b64encode(img_buffer.getvalue()).decode("utf-8")
+
+
 def call_gpt_4o(messages):
     if config.verbose:
         print("[call_gpt_4_v]")
-    time.sleep(1)
+    wait_before_call()
     client = config.initialize_openai()
+    content = None
     try:
         screenshots_dir = "screenshots"
         if not os.path.exists(screenshots_dir):
@@ -73,8 +182,10 @@ def call_gpt_4o(messages):
         # Call the function to capture the screen with the cursor
         capture_screen_with_cursor(screenshot_filename)
 
-        with open(screenshot_filename, "rb") as img_file:
+        with timed("encode"), open(screenshot_filename, "rb") as img_file:
             img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
+            img_base64 = downscale_image(img_base64)
+            annotate(bytes=len(img_base64))
 
         if len(messages) == 1:
             user_prompt = get_user_first_message_prompt()
@@ -99,12 +210,15 @@ def call_gpt_4o(messages):
         }
         messages.append(vision_message)
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            presence_penalty=1,
-            frequency_penalty=1,
-        )
+        with timed("request.openai"), metered("openai", "gpt-4o", messages) as meter:
+            response = client.chat.completions.create(
+                model=meter.model,
+                messages=messages,
+                presence_penalty=1,
+                frequency_penalty=1,
+                **get_openai_output_args("coordinates"),
+            )
+            meter.response = response
 
         content = response.choices[0].message.content
 
@@ -116,24 +230,18 @@ def call_gpt_4o(messages):
                 "[call_gpt_4_v] content",
                 content,
             )
-        content = json.loads(content)
+        content = load_operations(content, "coordinates", config.plan_mode)
 
         messages.append(assistant_message)
 
         return content
 
-    except Exception as e:
-        print(
-            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[Operate] That did not work. Trying again {ANSI_RESET}",
-            e,
-        )
+    except Exception:
         print(
             f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] AI response was {ANSI_RESET}",
             content,
         )
-        if config.verbose:
-            traceback.print_exc()
-        return call_gpt_4o(messages)
+        raise
 
 
 def call_gemini_pro_vision(messages, objective):
@@ -144,48 +252,43 @@ def call_gemini_pro_vision(messages, objective):
         print(
             "[Self Operating Computer][call_gemini_pro_vision]",
         )
-    # sleep for a second
-    time.sleep(1)
-    try:
-        screenshots_dir = "screenshots"
-        if not os.path.exists(screenshots_dir):
-            os.makedirs(screenshots_dir)
-
-        screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
-        # Call the function to capture the screen with the cursor
-        capture_screen_with_cursor(screenshot_filename)
-        # sleep for a second
-        time.sleep(1)
-        prompt = get_system_prompt("gemini-pro-vision", objective)
-
-        model = config.initialize_google()
-        if config.verbose:
-            print("[call_gemini_pro_vision] model", model)
-
+    wait_before_call()
+    screenshots_dir = "screenshots"
+    if not os.path.exists(screenshots_dir):
+        os.makedirs(screenshots_dir)
+
+    screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
+    # Call the function to capture the screen with the cursor
+    capture_screen_with_cursor(screenshot_filename)
+    wait_before_call()
+    prompt = get_system_prompt("gemini-pro-vision", objective)
+
+    model = config.initialize_google()
+    if config.verbose:
+        print("[call_gemini_pro_vision] model", model)
+
+    with timed("request.google"), metered(
+        "google",
+        "gemini-pro-vision",
+        [{"role": "user", "content": prompt}],
+        image_bytes=os.path.getsize(screenshot_filename),
+    ) as meter:
         response = model.generate_content([prompt, Image.open(screenshot_filename)])
+        meter.response = response
 
-        content = response.text[1:]
-        if config.verbose:
-            print("[call_gemini_pro_vision] response", response)
-            print("[call_gemini_pro_vision] content", content)
-
-        content = json.loads(content)
-        if config.verbose:
-            print(
-                "[get_next_action][call_gemini_pro_vision] content",
-                content,
-            )
-
-        return content
+    content = clean_json(response.text.strip())
+    if config.verbose:
+        print("[call_gemini_pro_vision] response", response)
+        print("[call_gemini_pro_vision] content", content)
 
-    except Exception as e:
+    content = load_operations(content, "coordinates", config.plan_mode)
+    if config.verbose:
         print(
-            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[Operate] That did not work. Trying another method {ANSI_RESET}"
+            "[get_next_action][call_gemini_pro_vision] content",
+            content,
         )
-        if config.verbose:
-            print("[Self-Operating Computer][Operate] error", e)
-            traceback.print_exc()
-        return call_gpt_4o(messages)
+
+    return content
 
 
 async def call_gpt_4o_with_ocr(messages, objective, model):
@@ -193,112 +296,94 @@ async def call_gpt_4o_with_ocr(messages, objective, model):
         print("[call_gpt_4o_with_ocr]")
 
     # Construct the path to the file within the package
-    try:
-        time.sleep(1)
-        client = config.initialize_openai()
-
-        confirm_system_prompt(messages, objective, model)
-        screenshots_dir = "screenshots"
-        if not os.path.exists(screenshots_dir):
-            os.makedirs(screenshots_dir)
-
-        screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
-        # Call the function to capture the screen with the cursor
-        capture_screen_with_cursor(screenshot_filename)
-
-        with open(screenshot_filename, "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
-
-        if len(messages) == 1:
-            user_prompt = get_user_first_message_prompt()
-        else:
-            user_prompt = get_user_prompt()
-
-        vision_message = {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": user_prompt},
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
-                },
-            ],
-        }
-        messages.append(vision_message)
+    wait_before_call()
+    client = config.initialize_openai()
 
+    confirm_system_prompt(messages, objective, model)
+    screenshots_dir = "screenshots"
+    if not os.path.exists(screenshots_dir):
+        os.makedirs(screenshots_dir)
+
+    screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
+    # Call the function to capture the screen with the cursor
+    capture_screen_with_cursor(screenshot_filename)
+
+    with timed("encode"), open(screenshot_filename, "rb") as img_file:
+        img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
+        img_base64 = downscale_image(img_base64)
+        annotate(bytes=len(img_base64))
+
+    if len(messages) == 1:
+        user_prompt = get_user_first_message_prompt()
+    else:
+        user_prompt = get_user_prompt()
+
+    vision_message = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": user_prompt},
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
+            },
+        ],
+    }
+    add_screen_description(vision_message, screenshot_filename)
+    messages.append(vision_message)
+
+    with timed("request.openai"), metered("openai", "o1", messages) as meter:
         response = client.chat.completions.create(
-            model="o1",
+            model=meter.model,
             messages=messages,
+            **get_openai_output_args("text"),
         )
+        meter.response = response
 
-        content = response.choices[0].message.content
+    content = response.choices[0].message.content
 
-        content = clean_json(content)
+    content = clean_json(content)
 
-        # used later for the messages
-        content_str = content
+    # used later for the messages
+    content_str = content
 
-        content = json.loads(content)
+    content = load_operations(content, "text", config.plan_mode)
 
-        processed_content = []
+    processed_content = []
 
-        for operation in content:
-            if operation.get("operation") == "click":
-                text_to_click = operation.get("text")
-                if config.verbose:
-                    print(
-                        "[call_gpt_4o_with_ocr][click] text_to_click",
-                        text_to_click,
-                    )
-                # Initialize EasyOCR Reader
-                reader = easyocr.Reader(["en"])
+    for operation in content:
+        # in plan mode clicks are located when they run, see `operate_planned`
+        if operation.get("operation") == "click" and not config.plan_mode:
+            text_to_click = operation.get("text")
+            if config.verbose:
+                print(
+                    "[call_gpt_4o_with_ocr][click] text_to_click",
+                    text_to_click,
+                )
+            coordinates = locate_text(text_to_click, screenshot_filename)
 
-                # Read the screenshot
-                result = reader.readtext(screenshot_filename)
+            # add `coordinates`` to `content`
+            operation["x"] = coordinates["x"]
+            operation["y"] = coordinates["y"]
 
-                text_element_index = get_text_element(
-                    result, text_to_click, screenshot_filename
+            if config.verbose:
+                print(
+                    "[call_gpt_4o_with_ocr][click] coordinates",
+                    coordinates,
                 )
-                coordinates = get_text_coordinates(
-                    result, text_element_index, screenshot_filename
+                print(
+                    "[call_gpt_4o_with_ocr][click] final operation",
+                    operation,
                 )
+            processed_content.append(operation)
 
-                # add `coordinates`` to `content`
-                operation["x"] = coordinates["x"]
-                operation["y"] = coordinates["y"]
-
-                if config.verbose:
-                    print(
-                        "[call_gpt_4o_with_ocr][click] text_element_index",
-                        text_element_index,
-                    )
-                    print(
-                        "[call_gpt_4o_with_ocr][click] coordinates",
-                        coordinates,
-                    )
-                    print(
-                        "[call_gpt_4o_with_ocr][click] final operation",
-                        operation,
-                    )
-                processed_content.append(operation)
+        else:
+            processed_content.append(operation)
 
-            else:
-                processed_content.append(operation)
+    # wait to append the assistant message so that if the `processed_content` step fails we don't append a message and mess up message history
+    assistant_message = {"role": "assistant", "content": content_str}
+    messages.append(assistant_message)
 
-        # wait to append the assistant message so that if the `processed_content` step fails we don't append a message and mess up message history
-        assistant_message = {"role": "assistant", "content": content_str}
-        messages.append(assistant_message)
-
-        return processed_content
-
-    except Exception as e:
-        print(
-            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[{model}] That did not work. Trying another method {ANSI_RESET}"
-        )
-        if config.verbose:
-            print("[Self-Operating Computer][Operate] error", e)
-            traceback.print_exc()
-        return gpt_4_fallback(messages, objective, model)
+    return processed_content
 
 
 async def call_o1_with_ocr(messages, objective, model):
@@ -306,262 +391,241 @@ async def call_o1_with_ocr(messages, objective, model):
         print("[call_o1_with_ocr]")
 
     # Construct the path to the file within the package
-    try:
-        time.sleep(1)
-        client = config.initialize_openai()
-
-        confirm_system_prompt(messages, objective, model)
-        screenshots_dir = "screenshots"
-        if not os.path.exists(screenshots_dir):
-            os.makedirs(screenshots_dir)
-
-        screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
-        # Call the function to capture the screen with the cursor
-        capture_screen_with_cursor(screenshot_filename)
-
-        with open(screenshot_filename, "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
-
-        if len(messages) == 1:
-            user_prompt = get_user_first_message_prompt()
-        else:
-            user_prompt = get_user_prompt()
-
-        vision_message = {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": user_prompt},
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
-                },
-            ],
-        }
-        messages.append(vision_message)
+    wait_before_call()
+    client = config.initialize_openai()
 
+    confirm_system_prompt(messages, objective, model)
+    screenshots_dir = "screenshots"
+    if not os.path.exists(screenshots_dir):
+        os.makedirs(screenshots_dir)
+
+    screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
+    # Call the function to capture the screen with the cursor
+    capture_screen_with_cursor(screenshot_filename)
+
+    with timed("encode"), open(screenshot_filename, "rb") as img_file:
+        img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
+        img_base64 = downscale_image(img_base64)
+        annotate(bytes=len(img_base64))
+
+    if len(messages) == 1:
+        user_prompt = get_user_first_message_prompt()
+    else:
+        user_prompt = get_user_prompt()
+
+    vision_message = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": user_prompt},
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
+            },
+        ],
+    }
+    add_screen_description(vision_message, screenshot_filename)
+    messages.append(vision_message)
+
+    with timed("request.openai"), metered("openai", "gpt-4o", messages) as meter:
         response = client.chat.completions.create(
-            model="gpt-4o",
+            model=meter.model,
             messages=messages,
+            **get_openai_output_args("text"),
         )
+        meter.response = response
 
-        content = response.choices[0].message.content
+    content = response.choices[0].message.content
 
-        content = clean_json(content)
+    content = clean_json(content)
 
-        # used later for the messages
-        content_str = content
+    # used later for the messages
+    content_str = content
 
-        content = json.loads(content)
+    content = load_operations(content, "text", config.plan_mode)
 
-        processed_content = []
+    processed_content = []
 
-        for operation in content:
-            if operation.get("operation") == "click":
-                text_to_click = operation.get("text")
-                if config.verbose:
-                    print(
-                        "[call_o1_with_ocr][click] text_to_click",
-                        text_to_click,
-                    )
-                # Initialize EasyOCR Reader
-                reader = easyocr.Reader(["en"])
+    for operation in content:
+        # in plan mode clicks are located when they run, see `operate_planned`
+        if operation.get("operation") == "click" and not config.plan_mode:
+            text_to_click = operation.get("text")
+            if config.verbose:
+                print(
+                    "[call_o1_with_ocr][click] text_to_click",
+                    text_to_click,
+                )
+            coordinates = locate_text(text_to_click, screenshot_filename)
 
-                # Read the screenshot
-                result = reader.readtext(screenshot_filename)
+            # add `coordinates`` to `content`
+            operation["x"] = coordinates["x"]
+            operation["y"] = coordinates["y"]
 
-                text_element_index = get_text_element(
-                    result, text_to_click, screenshot_filename
+            if config.verbose:
+                print(
+                    "[call_o1_with_ocr][click] coordinates",
+                    coordinates,
                 )
-                coordinates = get_text_coordinates(
-                    result, text_element_index, screenshot_filename
+                print(
+                    "[call_o1_with_ocr][click] final operation",
+                    operation,
                 )
+            processed_content.append(operation)
 
-                # add `coordinates`` to `content`
-                operation["x"] = coordinates["x"]
-                operation["y"] = coordinates["y"]
-
-                if config.verbose:
-                    print(
-                        "[call_o1_with_ocr][click] text_element_index",
-                        text_element_index,
-                    )
-                    print(
-                        "[call_o1_with_ocr][click] coordinates",
-                        coordinates,
-                    )
-                    print(
-                        "[call_o1_with_ocr][click] final operation",
-                        operation,
-                    )
-                processed_content.append(operation)
+        else:
+            processed_content.append(operation)
 
-            else:
-                processed_content.append(operation)
+    # wait to append the assistant message so that if the `processed_content` step fails we don't append a message and mess up message history
+    assistant_message = {"role": "assistant", "content": content_str}
+    messages.append(assistant_message)
 
-        # wait to append the assistant message so that if the `processed_content` step fails we don't append a message and mess up message history
-        assistant_message = {"role": "assistant", "content": content_str}
-        messages.append(assistant_message)
-
-        return processed_content
-
-    except Exception as e:
-        print(
-            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[{model}] That did not work. Trying another method {ANSI_RESET}"
-        )
-        if config.verbose:
-            print("[Self-Operating Computer][Operate] error", e)
-            traceback.print_exc()
-        return gpt_4_fallback(messages, objective, model)
+    return processed_content
 
 
 async def call_gpt_4o_labeled(messages, objective, model):
-    time.sleep(1)
+    wait_before_call()
 
-    try:
-        client = config.initialize_openai()
+    client = config.initialize_openai()
 
-        confirm_system_prompt(messages, objective, model)
-        file_path = pkg_resources.resource_filename("operate.models.weights", "best.pt")
-        yolo_model = YOLO(file_path)  # Load your trained model
-        screenshots_dir = "screenshots"
-        if not os.path.exists(screenshots_dir):
-            os.makedirs(screenshots_dir)
+    confirm_system_prompt(messages, objective, model)
+    screenshots_dir = "screenshots"
+    if not os.path.exists(screenshots_dir):
+        os.makedirs(screenshots_dir)
 
-        screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
-        # Call the function to capture the screen with the cursor
-        capture_screen_with_cursor(screenshot_filename)
+    screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
+    # Call the function to capture the screen with the cursor
+    capture_screen_with_cursor(screenshot_filename)
 
-        with open(screenshot_filename, "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
+    with timed("encode"), open(screenshot_filename, "rb") as img_file:
+        img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
+        annotate(bytes=len(img_base64))
 
-        img_base64_labeled, label_coordinates = add_labels(img_base64, yolo_model)
+    element_map = get_element_map(screenshot_filename, ("detector",))
+    img_base64_labeled, label_coordinates = add_labels(img_base64, element_map)
+    # labels are drawn on the full frame, their coordinates don't depend on what is sent
+    img_base64_labeled = downscale_image(img_base64_labeled)
 
-        if len(messages) == 1:
-            user_prompt = get_user_first_message_prompt()
-        else:
-            user_prompt = get_user_prompt()
+    if len(messages) == 1:
+        user_prompt = get_user_first_message_prompt()
+    else:
+        user_prompt = get_user_prompt()
 
-        if config.verbose:
-            print(
-                "[call_gpt_4_vision_preview_labeled] user_prompt",
-                user_prompt,
-            )
+    if config.verbose:
+        print(
+            "[call_gpt_4_vision_preview_labeled] user_prompt",
+            user_prompt,
+        )
 
-        vision_message = {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": user_prompt},
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{img_base64_labeled}"
-                    },
+    vision_message = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": user_prompt},
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{img_base64_labeled}"
                 },
-            ],
-        }
-        messages.append(vision_message)
+            },
+        ],
+    }
+    messages.append(vision_message)
 
+    with timed("request.openai"), metered("openai", "gpt-4o", messages) as meter:
         response = client.chat.completions.create(
-            model="gpt-4o",
+            model=meter.model,
             messages=messages,
             presence_penalty=1,
             frequency_penalty=1,
+            **get_openai_output_args("label"),
         )
+        meter.response = response
 
-        content = response.choices[0].message.content
+    content = response.choices[0].message.content
 
-        content = clean_json(content)
+    content = clean_json(content)
 
-        assistant_message = {"role": "assistant", "content": content}
+    assistant_message = {"role": "assistant", "content": content}
 
-        messages.append(assistant_message)
+    messages.append(assistant_message)
 
-        content = json.loads(content)
-        if config.verbose:
-            print(
-                "[call_gpt_4_vision_preview_labeled] content",
-                content,
-            )
+    content = load_operations(content, "label", config.plan_mode)
+    if config.verbose:
+        print(
+            "[call_gpt_4_vision_preview_labeled] content",
+            content,
+        )
 
-        processed_content = []
+    processed_content = []
 
-        for operation in content:
-            print(
-                "[call_gpt_4_vision_preview_labeled] for operation in content",
-                operation,
-            )
-            if operation.get("operation") == "click":
-                label = operation.get("label")
-                if config.verbose:
-                    print(
-                        "[Self Operating Computer][call_gpt_4_vision_preview_labeled] label",
-                        label,
-                    )
-
-                coordinates = get_label_coordinates(label, label_coordinates)
-                if config.verbose:
-                    print(
-                        "[Self Operating Computer][call_gpt_4_vision_preview_labeled] coordinates",
-                        coordinates,
-                    )
-                image = Image.open(
-                    io.BytesIO(base64.b64decode(img_base64))
-                )  # Load the image to get its size
-                image_size = image.size  # Get the size of the image (width, height)
-                click_position_percent = get_click_position_in_percent(
-                    coordinates, image_size
+    for operation in content:
+        print(
+            "[call_gpt_4_vision_preview_labeled] for operation in content",
+            operation,
+        )
+        if operation.get("operation") == "click":
+            label = operation.get("label")
+            if config.verbose:
+                print(
+                    "[Self Operating Computer][call_gpt_4_vision_preview_labeled] label",
+                    label,
                 )
-                if config.verbose:
-                    print(
-                        "[Self Operating Computer][call_gpt_4_vision_preview_labeled] click_position_percent",
-                        click_position_percent,
-                    )
-                if not click_position_percent:
-                    print(
-                        f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] Failed to get click position in percent. Trying another method {ANSI_RESET}"
-                    )
-                    return call_gpt_4o(messages)
-
-                x_percent = f"{click_position_percent[0]:.2f}"
-                y_percent = f"{click_position_percent[1]:.2f}"
-                operation["x"] = x_percent
-                operation["y"] = y_percent
-                if config.verbose:
-                    print(
-                        "[Self Operating Computer][call_gpt_4_vision_preview_labeled] new click operation",
-                        operation,
-                    )
-                processed_content.append(operation)
-            else:
-                if config.verbose:
-                    print(
-                        "[Self Operating Computer][call_gpt_4_vision_preview_labeled] .append none click operation",
-                        operation,
-                    )
 
-                processed_content.append(operation)
+            coordinates = get_label_coordinates(label, label_coordinates)
+            if config.verbose:
+                print(
+                    "[Self Operating Computer][call_gpt_4_vision_preview_labeled] coordinates",
+                    coordinates,
+                )
+            image = Image.open(
+                io.BytesIO(base64.b64decode(img_base64))
+            )  # Load the image to get its size
+            image_size = image.size  # Get the size of the image (width, height)
+            click_position_percent = get_click_position_in_percent(
+                coordinates, image_size
+            )
+            if config.verbose:
+                print(
+                    "[Self Operating Computer][call_gpt_4_vision_preview_labeled] click_position_percent",
+                    click_position_percent,
+                )
+            if not click_position_percent:
+                print(
+                    f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] Failed to get click position in percent. Trying another method {ANSI_RESET}"
+                )
+                raise Exception(f"No coordinates found for label {label}")
 
+            x_percent = f"{click_position_percent[0]:.2f}"
+            y_percent = f"{click_position_percent[1]:.2f}"
+            operation["x"] = x_percent
+            operation["y"] = y_percent
+            if config.verbose:
+                print(
+                    "[Self Operating Computer][call_gpt_4_vision_preview_labeled] new click operation",
+                    operation,
+                )
+            processed_content.append(operation)
+        else:
             if config.verbose:
                 print(
-                    "[Self Operating Computer][call_gpt_4_vision_preview_labeled] new processed_content",
-                    processed_content,
+                    "[Self Operating Computer][call_gpt_4_vision_preview_labeled] .append none click operation",
+                    operation,
                 )
-            return processed_content
 
-    except Exception as e:
-        print(
-            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[{model}] That did not work. Trying another method {ANSI_RESET}"
-        )
+            processed_content.append(operation)
+
         if config.verbose:
-            print("[Self-Operating Computer][Operate] error", e)
-            traceback.print_exc()
-        return call_gpt_4o(messages)
+            print(
+                "[Self Operating Computer][call_gpt_4_vision_preview_labeled] new processed_content",
+                processed_content,
+            )
+        return processed_content
 
 
 def call_ollama_llava(messages):
     if config.verbose:
         print("[call_ollama_llava]")
-    time.sleep(1)
+    wait_before_call()
+    ollama = load_sdk("ollama")
+    content = None
     try:
         model = config.initialize_ollama()
         screenshots_dir = "screenshots"
@@ -590,10 +654,13 @@ def call_ollama_llava(messages):
         }
         messages.append(vision_message)
 
-        response = model.chat(
-            model="llava",
-            messages=messages,
-        )
+        with timed("request.ollama"), metered("ollama", "llava", messages) as meter:
+            response = model.chat(
+                model=meter.model,
+                messages=messages,
+                **get_ollama_output_args(),
+            )
+            meter.response = response
 
         # Important: Remove the image path from the message history.
         # Ollama will attempt to load each image reference and will
@@ -610,7 +677,7 @@ def call_ollama_llava(messages):
                 "[call_ollama_llava] content",
                 content,
             )
-        content = json.loads(content)
+        content = load_operations(content, "coordinates", config.plan_mode)
 
         messages.append(assistant_message)
 
@@ -621,214 +688,323 @@ def call_ollama_llava(messages):
             f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Operate] Couldn't connect to Ollama. With Ollama installed, run `ollama pull llava` then `ollama serve`{ANSI_RESET}",
             e,
         )
+        raise
 
-    except Exception as e:
-        print(
-            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[llava] That did not work. Trying again {ANSI_RESET}",
-            e,
-        )
+    except Exception:
         print(
             f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] AI response was {ANSI_RESET}",
             content,
         )
-        if config.verbose:
-            traceback.print_exc()
-        return call_ollama_llava(messages)
+        raise
 
 
 async def call_claude_3_with_ocr(messages, objective, model):
     if config.verbose:
         print("[call_claude_3_with_ocr]")
 
-    try:
-        time.sleep(1)
-        client = config.initialize_anthropic()
-
-        confirm_system_prompt(messages, objective, model)
-        screenshots_dir = "screenshots"
-        if not os.path.exists(screenshots_dir):
-            os.makedirs(screenshots_dir)
-
-        screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
-        capture_screen_with_cursor(screenshot_filename)
+    wait_before_call()
+    client = config.initialize_anthropic()
 
-        # downsize screenshot due to 5MB size limit
-        with open(screenshot_filename, "rb") as img_file:
-            img = Image.open(img_file)
+    confirm_system_prompt(messages, objective, model)
+    screenshots_dir = "screenshots"
+    if not os.path.exists(screenshots_dir):
+        os.makedirs(screenshots_dir)
 
-            # Convert RGBA to RGB
-            if img.mode == "RGBA":
-                img = img.convert("RGB")
+    screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
+    capture_screen_with_cursor(screenshot_filename)
 
-            # Calculate the new dimensions while maintaining the aspect ratio
-            original_width, original_height = img.size
-            aspect_ratio = original_width / original_height
-            new_width = 2560  # Adjust this value to achieve the desired file size
-            new_height = int(new_width / aspect_ratio)
-            if config.verbose:
-                print("[call_claude_3_with_ocr] resizing claude")
+    # downsize screenshot due to 5MB size limit
+    with timed("encode"), open(screenshot_filename, "rb") as img_file:
+        img = Image.open(img_file)
 
-            # Resize the image
-            img_resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-            # Save the resized and converted image to a BytesIO object for JPEG format
-            img_buffer = io.BytesIO()
-            img_resized.save(
-                img_buffer, format="JPEG", quality=85
-            )  # Adjust the quality parameter as needed
-            img_buffer.seek(0)
-
-            # Encode the resized image as base64
-            img_data = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
-
-        if len(messages) == 1:
-            user_prompt = get_user_first_message_prompt()
-        else:
-            user_prompt = get_user_prompt()
+        # Convert RGBA to RGB
+        if img.mode == "RGBA":
+            img = img.convert("RGB")
 
-        vision_message = {
-            "role": "user",
-            "content": [
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": img_data,
-                    },
-                },
-                {
-                    "type": "text",
-                    "text": user_prompt
-                    + "**REMEMBER** Only output json format, do not append any other text.",
+        # Calculate the new dimensions while maintaining the aspect ratio
+        original_width, original_height = img.size
+        aspect_ratio = original_width / original_height
+        new_width = int(2560 * get_image_scale())  # Adjust this value to achieve the desired file size
+        new_height = int(new_width / aspect_ratio)
+        if config.verbose:
+            print("[call_claude_3_with_ocr] resizing claude")
+
+        # Resize the image
+        img_resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+        # Save the resized and converted image to a BytesIO object for JPEG format
+        img_buffer = io.BytesIO()
+        img_resized.save(
+            img_buffer, format="JPEG", quality=85
+        )  # Adjust the quality parameter as needed
+        img_buffer.seek(0)
+
+        # Encode the resized image as base64
+        img_data = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
+        annotate(bytes=len(img_data))
+
+    if len(messages) == 1:
+        user_prompt = get_user_first_message_prompt()
+    else:
+        user_prompt = get_user_prompt()
+
+    vision_message = {
+        "role": "user",
+        "content": [
+            {
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": "image/jpeg",
+                    "data": img_data,
                 },
-            ],
-        }
-        messages.append(vision_message)
-
-        # anthropic api expect system prompt as an separate argument
+            },
+            {
+                "type": "text",
+                "text": user_prompt
+                if config.structured_output
+                else user_prompt
+                + "**REMEMBER** Only output json format, do not append any other text.",
+            },
+        ],
+    }
+    add_screen_description(vision_message, screenshot_filename)
+    messages.append(vision_message)
+
+    # anthropic api expect system prompt as an separate argument
+    with timed("request.anthropic"), metered(
+        "anthropic", "claude-3-opus-20240229", messages
+    ) as meter:
         response = client.messages.create(
-            model="claude-3-opus-20240229",
+            model=meter.model,
             max_tokens=3000,
             system=messages[0]["content"],
             messages=messages[1:],
+            **get_anthropic_output_args("text"),
         )
+        meter.response = response
 
+    content = get_anthropic_content(response)
+    content = clean_json(content)
+    content_str = content
+    try:
+        content = load_operations(content, "text", config.plan_mode)
+    # only ask the model to fix what could not be repaired locally
+    except InvalidOperationsException as e:
+        if config.verbose:
+            print(
+                f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] InvalidOperationsException: {e} {ANSI_RESET}"
+            )
+        fix_messages = [{"role": "user", "content": content}]
+        with timed("request.anthropic"), metered(
+            "anthropic", "claude-3-opus-20240229", fix_messages
+        ) as meter:
+            response = client.messages.create(
+                model=meter.model,
+                max_tokens=3000,
+                system=f"This json string is not valid, when using with json.loads(content) \
+                it throws the following error: {e.message}, return correct json string. \
+                **REMEMBER** Only output json format, do not append any other text.",
+                messages=fix_messages,
+            )
+            meter.response = response
         content = response.content[0].text
         content = clean_json(content)
         content_str = content
-        try:
-            content = json.loads(content)
-        # rework for json mode output
-        except json.JSONDecodeError as e:
+        content = load_operations(content, "text", config.plan_mode)
+
+    if config.verbose:
+        print(
+            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[{model}] content: {content} {ANSI_RESET}"
+        )
+    processed_content = []
+
+    for operation in content:
+        # in plan mode clicks are located when they run, see `operate_planned`
+        if operation.get("operation") == "click" and not config.plan_mode:
+            text_to_click = operation.get("text")
             if config.verbose:
                 print(
-                    f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] JSONDecodeError: {e} {ANSI_RESET}"
+                    "[call_claude_3_ocr][click] text_to_click",
+                    text_to_click,
                 )
-            response = client.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=3000,
-                system=f"This json string is not valid, when using with json.loads(content) \
-                it throws the following error: {e}, return correct json string. \
-                **REMEMBER** Only output json format, do not append any other text.",
-                messages=[{"role": "user", "content": content}],
-            )
-            content = response.content[0].text
-            content = clean_json(content)
-            content_str = content
-            content = json.loads(content)
+            # limit the text to extract has a higher success rate
+            coordinates = locate_text(text_to_click[:3], screenshot_filename)
 
-        if config.verbose:
-            print(
-                f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[{model}] content: {content} {ANSI_RESET}"
-            )
-        processed_content = []
-
-        for operation in content:
-            if operation.get("operation") == "click":
-                text_to_click = operation.get("text")
-                if config.verbose:
-                    print(
-                        "[call_claude_3_ocr][click] text_to_click",
-                        text_to_click,
-                    )
-                # Initialize EasyOCR Reader
-                reader = easyocr.Reader(["en"])
-
-                # Read the screenshot
-                result = reader.readtext(screenshot_filename)
-
-                # limit the text to extract has a higher success rate
-                text_element_index = get_text_element(
-                    result, text_to_click[:3], screenshot_filename
+            # add `coordinates`` to `content`
+            operation["x"] = coordinates["x"]
+            operation["y"] = coordinates["y"]
+
+            if config.verbose:
+                print(
+                    "[call_claude_3_ocr][click] coordinates",
+                    coordinates,
                 )
-                coordinates = get_text_coordinates(
-                    result, text_element_index, screenshot_filename
+                print(
+                    "[call_claude_3_ocr][click] final operation",
+                    operation,
                 )
+            processed_content.append(operation)
 
-                # add `coordinates`` to `content`
-                operation["x"] = coordinates["x"]
-                operation["y"] = coordinates["y"]
-
-                if config.verbose:
-                    print(
-                        "[call_claude_3_ocr][click] text_element_index",
-                        text_element_index,
-                    )
-                    print(
-                        "[call_claude_3_ocr][click] coordinates",
-                        coordinates,
-                    )
-                    print(
-                        "[call_claude_3_ocr][click] final operation",
-                        operation,
-                    )
-                processed_content.append(operation)
+        else:
+            processed_content.append(operation)
 
-            else:
-                processed_content.append(operation)
+    assistant_message = {"role": "assistant", "content": content_str}
+    messages.append(assistant_message)
 
-        assistant_message = {"role": "assistant", "content": content_str}
-        messages.append(assistant_message)
+    return processed_content
 
-        return processed_content
 
+@span("convert_messages_to_gpt_4", "fallback")
+def convert_messages_to_gpt_4(messages):
+    """
+    Converts an Anthropic formatted message history into a new GPT-4 formatted one.
+    """
+    gpt4_messages = [messages[0]]  # Include the system message
+    for message in messages[1:]:
+        if message["role"] == "user":
+            # Update the image type format from "source" to "url"
+            updated_content = []
+            for item in message["content"]:
+                if isinstance(item, dict) and "type" in item:
+                    if item["type"] == "image":
+                        updated_content.append(
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/png;base64,{item['source']['data']}"
+                                },
+                            }
+                        )
+                    else:
+                        updated_content.append(item)
+
+            gpt4_messages.append({"role": "user", "content": updated_content})
+        elif message["role"] == "assistant":
+            gpt4_messages.append({"role": "assistant", "content": message["content"]})
+
+    annotate(messages=len(gpt4_messages), request_bytes=sum(get_payload_size(gpt4_messages)))
+    return gpt4_messages
+
+
+def get_next_action_stream(model, messages, objective):
+    """
+    Streams the next set of actions and yields each operation as soon as the
+    model has finished writing it, so execution can start on the first action
+    while the rest of the plan is still being generated.
+
+    If the stream fails before any operation was yielded the history is rolled
+    back and the error is raised so the caller can retry through
+    `get_next_action`. If it fails later, the operations already yielded have
+    been executed, so the stream just ends and the next loop iteration looks at
+    the screen again. The assistant turn holds the yielded operations, also when
+    the caller stops early, e.g. on "done".
+    """
+    if config.verbose:
+        print("[get_next_action_stream] model", model)
+    if model not in STREAMING_MODELS:
+        raise ModelNotRecognizedException(model)
+
+    breaker = get_circuit_breaker("openai")
+    client = config.initialize_openai()
+
+    if model != "gpt-4":
+        confirm_system_prompt(messages, objective, model)
+    screenshots_dir = "screenshots"
+    if not os.path.exists(screenshots_dir):
+        os.makedirs(screenshots_dir)
+
+    screenshot_filename = os.path.join(screenshots_dir, "screenshot.png")
+    # Call the function to capture the screen with the cursor
+    capture_screen_with_cursor(screenshot_filename)
+
+    with timed("encode"), open(screenshot_filename, "rb") as img_file:
+        img_base64 = base64.b64encode(img_file.read()).decode("utf-8")
+        img_base64 = downscale_image(img_base64)
+        annotate(bytes=len(img_base64))
+
+    if len(messages) == 1:
+        user_prompt = get_user_first_message_prompt()
+    else:
+        user_prompt = get_user_prompt()
+
+    vision_message = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": user_prompt},
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
+            },
+        ],
+    }
+    if get_click_target(model) == "text":
+        add_screen_description(vision_message, screenshot_filename)
+
+    extra_args = {}
+    if model == "gpt-4":
+        extra_args = {"presence_penalty": 1, "frequency_penalty": 1}
+
+    click_target = get_click_target(model)
+    extra_args.update(get_openai_output_args(click_target))
+    # structured output wraps the operations in an object, wait for its array
+    parser = IncrementalOperationParser(wrapped=config.structured_output)
+    yielded = []
+    response = None
+    # an open circuit raises before the history changes, and a half-open
+    # circuit's trial must end in the try below
+    breaker.before_call()
+    history_length = len(messages)
+    messages.append(vision_message)
+    try:
+        # the meter runs until the stream ends, actions executed meanwhile included
+        with metered("openai", STREAMING_MODELS[model], messages) as meter:
+            with timed("request.openai.stream"):
+                response = client.chat.completions.create(
+                    model=meter.model,
+                    messages=messages,
+                    stream=True,
+                    # the last chunk then carries the token counts
+                    stream_options={"include_usage": True},
+                    **extra_args,
+                )
+            for chunk in response:
+                if getattr(chunk, "usage", None):
+                    meter.response = chunk.usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                for operation in parser.feed(chunk.choices[0].delta.content):
+                    validate_operation(operation, click_target)
+                    if click_target == "text" and operation.get("operation") == "click":
+                        # the screen is read at most once per step, and only when a click needs it
+                        coordinates = locate_text(operation.get("text"), screenshot_filename)
+                        operation["x"] = coordinates["x"]
+                        operation["y"] = coordinates["y"]
+                    if config.verbose:
+                        print("[get_next_action_stream] operation", operation)
+                    yielded.append(operation)
+                    yield operation
+    except GeneratorExit:
+        # the caller stopped, the stream itself was fine
+        breaker.record_success()
+        raise
     except Exception as e:
+        breaker.record_error(e)
+        if not yielded:
+            del messages[history_length:]
+            raise
         print(
-            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[{model}] That did not work. Trying another method {ANSI_RESET}"
+            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] Stream stopped after {len(yielded)} action(s) {ANSI_RESET}",
+            e,
         )
-        if config.verbose:
-            print("[Self-Operating Computer][Operate] error", e)
-            traceback.print_exc()
-            print("message before convertion ", messages)
-
-        # Convert the messages to the GPT-4 format
-        gpt4_messages = [messages[0]]  # Include the system message
-        for message in messages[1:]:
-            if message["role"] == "user":
-                # Update the image type format from "source" to "url"
-                updated_content = []
-                for item in message["content"]:
-                    if isinstance(item, dict) and "type" in item:
-                        if item["type"] == "image":
-                            updated_content.append(
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/png;base64,{item['source']['data']}"
-                                    },
-                                }
-                            )
-                        else:
-                            updated_content.append(item)
-
-                gpt4_messages.append({"role": "user", "content": updated_content})
-            elif message["role"] == "assistant":
-                gpt4_messages.append(
-                    {"role": "assistant", "content": message["content"]}
-                )
-
-        return gpt_4_fallback(gpt4_messages, objective, model)
+    else:
+        breaker.record_success()
+    finally:
+        if response is not None and hasattr(response, "close"):
+            response.close()
+        if len(messages) > history_length:
+            # only keep what was handed to the caller in the history
+            messages.append({"role": "assistant", "content": json.dumps(yielded)})
 
 
 def get_last_assistant_message(messages):
@@ -845,6 +1021,7 @@ def get_last_assistant_message(messages):
     return None  # Return None if no assistant message is found
 
 
+@span("gpt_4_fallback", "fallback")
 def gpt_4_fallback(messages, objective, model):
     if config.verbose:
         print("[gpt_4_fallback]")
@@ -885,6 +1062,47 @@ def confirm_system_prompt(messages, objective, model):
                 print("------------------[end message]------------------")
 
 
+def get_openai_output_args(click_target):
+    """
+    Returns the `chat.completions.create` arguments that constrain the response
+    to the operation schema, or nothing when structured output is turned off.
+    """
+    if not config.structured_output:
+        return {}
+    return {
+        "response_format": get_openai_response_format(click_target, config.plan_mode)
+    }
+
+
+def get_anthropic_output_args(click_target):
+    """
+    Anthropic has no JSON mode, so the operations are requested as a forced tool call.
+    """
+    if not config.structured_output:
+        return {}
+    return {
+        "tools": [get_anthropic_tool(click_target, config.plan_mode)],
+        "tool_choice": {"type": "tool", "name": "operate"},
+    }
+
+
+def get_ollama_output_args():
+    if not config.structured_output:
+        return {}
+    return {"format": "json"}
+
+
+def get_anthropic_content(response):
+    """
+    Returns the operations of a forced tool call as a JSON string, or the text of a plain response.
+    """
+    for block in response.content:
+        if block.type == "tool_use":
+            return json.dumps(block.input)
+    return response.content[0].text
+
+
+@timed("parse")
 def clean_json(content):
     if config.verbose:
         print("\n\n[clean_json] content before cleaning", content)
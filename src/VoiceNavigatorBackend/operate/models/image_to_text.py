@@ -1,15 +1,11 @@
 import base64
 import os
 
-import easyocr
-import ollama
-import pkg_resources
-from PIL import Image
-from ultralytics import YOLO
-
 from operate.config import Config
+from operate.utils.metrics import timed
 from operate.utils.screenshot import capture_screen_with_cursor
 from operate.utils.style import ANSI_BRIGHT_MAGENTA, ANSI_GREEN, ANSI_RED, ANSI_RESET
+from operate.utils.usage import metered
 from operate.models.image_to_text_prompt import get_image_explanation_prompt
 
 image_to_text_config = Config()
@@ -49,12 +45,14 @@ def image_to_text():
 
         # Step 4: Send request to GPT-4o
         client = image_to_text_config.initialize_openai()
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[vision_message],
-            presence_penalty=1,
-            frequency_penalty=1,
-        )
+        with timed("request.openai"), metered("openai", "gpt-4o", [vision_message]) as meter:
+            response = client.chat.completions.create(
+                model=meter.model,
+                messages=[vision_message],
+                presence_penalty=1,
+                frequency_penalty=1,
+            )
+            meter.response = response
 
         # Step 5: Process response
         content = response.choices[0].message.content
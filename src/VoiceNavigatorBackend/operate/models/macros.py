@@ -0,0 +1,161 @@
+import platform
+
+
+def get_os_shortcuts():
+    """
+    Returns the modifier key, the keys that open the OS search, and the name of the operating system.
+    """
+    if platform.system() == "Darwin":
+        return "command", ["command", "space"], "Mac"
+    elif platform.system() == "Windows":
+        return "ctrl", ["win"], "Windows"
+    else:
+        return "ctrl", ["win"], "Linux"
+
+
+def open_app(app):
+    _, os_search_str, _ = get_os_shortcuts()
+    return [
+        {
+            "thought": f"Searching the operating system for {app}",
+            "operation": "press",
+            "keys": os_search_str,
+        },
+        {
+            "thought": f"Writing '{app}' in the search",
+            "operation": "write",
+            "content": app,
+        },
+        {
+            "thought": f"Pressing enter to open {app}",
+            "operation": "press",
+            "keys": ["enter"],
+        },
+    ]
+
+
+def open_url(url, new_tab=False):
+    cmd_string, _, _ = get_os_shortcuts()
+    return [
+        # a new tab has its address bar focused already
+        {
+            "thought": "Opening a new tab in the browser",
+            "operation": "press",
+            "keys": [cmd_string, "t"],
+        }
+        if new_tab
+        else {
+            "thought": "Focusing the address bar of the browser",
+            "operation": "press",
+            "keys": [cmd_string, "l"],
+        },
+        {
+            "thought": f"Writing the URL {url}",
+            "operation": "write",
+            "content": url,
+        },
+        {
+            "thought": "Pressing enter to go to the URL",
+            "operation": "press",
+            "keys": ["enter"],
+        },
+    ]
+
+
+def open_url_in_new_tab(url):
+    return open_url(url, new_tab=True)
+
+
+def search_web(query):
+    cmd_string, _, _ = get_os_shortcuts()
+    return [
+        {
+            "thought": "Focusing the address bar of the browser",
+            "operation": "press",
+            "keys": [cmd_string, "l"],
+        },
+        {
+            "thought": f"Writing the search '{query}'",
+            "operation": "write",
+            "content": query,
+        },
+        {
+            "thought": "Pressing enter to search",
+            "operation": "press",
+            "keys": ["enter"],
+        },
+    ]
+
+
+# name -> (function, {parameter: description}, description)
+MACROS = {
+    "open_app": (
+        open_app,
+        {"app": "name of the application to open"},
+        "Search the operating system for an application and open it",
+    ),
+    "open_url": (
+        open_url,
+        {"url": "the URL to go to"},
+        "Focus the address bar of the open browser and go to a URL in the current tab",
+    ),
+    "open_url_in_new_tab": (
+        open_url_in_new_tab,
+        {"url": "the URL to go to"},
+        "Open a new tab in the open browser and go to a URL, keeping the current tab",
+    ),
+    "search_web": (
+        search_web,
+        {"query": "what to search for"},
+        "Search the web from the address bar of the open browser",
+    ),
+}
+
+
+def is_macro(operation):
+    return str(operation.get("operation", "")).lower() in MACROS
+
+
+def expand_macros(operations):
+    """
+    Replaces every macro operation with the primitive operations it stands for.
+    Other operations are kept as they are.
+
+    Parameters:
+    - operations (list): Operations returned by the model.
+
+    Returns:
+    list: Operations that only use click, write, press and done.
+    """
+    expanded = []
+    for operation in operations:
+        name = str(operation.get("operation", "")).lower()
+        if name not in MACROS:
+            expanded.append(operation)
+            continue
+
+        function, parameters, _ = MACROS[name]
+        steps = function(**{key: operation.get(key) for key in parameters})
+        # the model's reasoning belongs to the first step
+        if operation.get("thought"):
+            steps[0]["thought"] = operation["thought"]
+        for step in steps:
+            step["macro"] = name
+        expanded.extend(steps)
+    return expanded
+
+
+def get_macro_prompt():
+    """
+    Describes the macros in the same format the system prompts use for the other operations.
+    """
+    lines = []
+    for index, (name, (_, parameters, description)) in enumerate(MACROS.items(), start=5):
+        arguments = ", ".join(f'"{key}": "{value}"' for key, value in parameters.items())
+        lines.append(f"{index}. {name} - {description}")
+        lines.append("```")
+        lines.append(
+            f'[{{ "thought": "write a thought here", "operation": "{name}", {arguments} }}]'
+        )
+        lines.append("```")
+    return "\n".join(lines)
@@ -1,5 +1,5 @@
-import platform
 from operate.config import Config
+from operate.models.macros import MACROS, get_macro_prompt, get_os_shortcuts
 
 # Load configuration
 config = Config()
@@ -13,7 +13,7 @@ You are operating a {operating_system} computer, using the same operating system
 
 From looking at the screen, the objective, and your previous actions, take the next best series of action. 
 
-You have 4 possible operation actions available to you. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement.
+You have 4 possible operation actions and a few macros available to you. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement.
 
 1. click - Move mouse and click
 ```
@@ -35,6 +35,10 @@ You have 4 possible operation actions available to you. The `pyautogui` library
 [{{ "thought": "write a thought here", "operation": "done", "summary": "summary of what was completed" }}]
 ```
 
+Macros run several of the actions above in one step. Prefer them over writing the steps out yourself:
+
+{macros}
+
 Return the actions in array format `[]`. You can take just one action or multiple actions.
 
 Here a helpful example:
@@ -42,18 +46,14 @@ Here a helpful example:
 Example 1: Searches for Google Chrome on the OS and opens it
 ```
 [
-    {{ "thought": "Searching the operating system to find Google Chrome because it appears I am currently in terminal", "operation": "press", "keys": {os_search_str} }},
-    {{ "thought": "Now I need to write 'Google Chrome' as a next step", "operation": "write", "content": "Google Chrome" }},
-    {{ "thought": "Finally I'll press enter to open Google Chrome assuming it is available", "operation": "press", "keys": ["enter"] }}
+    {{ "thought": "It appears I am currently in terminal, so I'll open Google Chrome from the operating system search", "operation": "open_app", "app": "Google Chrome" }}
 ]
 ```
 
-Example 2: Focuses on the address bar in a browser before typing a website
+Example 2: Goes to a website when the browser is already open
 ```
 [
-    {{ "thought": "I'll focus on the address bar in the browser. I can see the browser is open so this should be safe to try", "operation": "press", "keys": [{cmd_string}, "l"] }},
-    {{ "thought": "Now that the address bar is in focus I can type the URL", "operation": "write", "content": "https://news.ycombinator.com/" }},
-    {{ "thought": "I'll need to press enter to go the URL now", "operation": "press", "keys": ["enter"] }}
+    {{ "thought": "I can see the browser is open so I'll go to the website from the address bar", "operation": "open_url", "url": "https://news.ycombinator.com/" }}
 ]
 ```
 
@@ -71,7 +71,7 @@ You are operating a {operating_system} computer, using the same operating system
 
 From looking at the screen, the objective, and your previous actions, take the next best series of action. 
 
-You have 4 possible operation actions available to you. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement.
+You have 4 possible operation actions and a few macros available to you. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement.
 
 1. click - Move mouse and click - We labeled the clickable elements with red bounding boxes and IDs. Label IDs are in the following format with `x` being a number: `~x`
 ```
@@ -90,6 +90,10 @@ You have 4 possible operation actions available to you. The `pyautogui` library
 ```
 [{{ "thought": "write a thought here", "operation": "done", "summary": "summary of what was completed" }}]
 ```
+
+Macros run several of the actions above in one step. Prefer them over writing the steps out yourself:
+
+{macros}
 Return the actions in array format `[]`. You can take just one action or multiple actions.
 
 Here a helpful example:
@@ -97,17 +101,14 @@ Here a helpful example:
 Example 1: Searches for Google Chrome on the OS and opens it
 ```
 [
-    {{ "thought": "Searching the operating system to find Google Chrome because it appears I am currently in terminal", "operation": "press", "keys": {os_search_str} }},
-    {{ "thought": "Now I need to write 'Google Chrome' as a next step", "operation": "write", "content": "Google Chrome" }},
+    {{ "thought": "It appears I am currently in terminal, so I'll open Google Chrome from the operating system search", "operation": "open_app", "app": "Google Chrome" }}
 ]
 ```
 
-Example 2: Focuses on the address bar in a browser before typing a website
+Example 2: Goes to a website when the browser is already open
 ```
 [
-    {{ "thought": "I'll focus on the address bar in the browser. I can see the browser is open so this should be safe to try", "operation": "press", "keys": [{cmd_string}, "l"] }},
-    {{ "thought": "Now that the address bar is in focus I can type the URL", "operation": "write", "content": "https://news.ycombinator.com/" }},
-    {{ "thought": "I'll need to press enter to go the URL now", "operation": "press", "keys": ["enter"] }}
+    {{ "thought": "I can see the browser is open so I'll go to the website from the address bar", "operation": "open_url", "url": "https://news.ycombinator.com/" }}
 ]
 ```
 
@@ -134,7 +135,7 @@ You are operating a {operating_system} computer, using the same operating system
 
 From looking at the screen, the objective, and your previous actions, take the next best series of action. 
 
-You have 4 possible operation actions available to you. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement.
+You have 4 possible operation actions and a few macros available to you. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement.
 
 1. click - Move mouse and click - Look for text to click. Try to find relevant text to click, but if there's nothing relevant enough you can return `"nothing to click"` for the text value and we'll try a different method.
 ```
@@ -153,6 +154,10 @@ You have 4 possible operation actions available to you. The `pyautogui` library
 [{{ "thought": "write a thought here", "operation": "done", "summary": "summary of what was completed" }}]
 ```
 
+Macros run several of the actions above in one step. Prefer them over writing the steps out yourself:
+
+{macros}
+
 Return the actions in array format `[]`. You can take just one action or multiple actions.
 
 Here a helpful example:
@@ -160,18 +165,14 @@ Here a helpful example:
 Example 1: Searches for Google Chrome on the OS and opens it
 ```
 [
-    {{ "thought": "Searching the operating system to find Google Chrome because it appears I am currently in terminal", "operation": "press", "keys": {os_search_str} }},
-    {{ "thought": "Now I need to write 'Google Chrome' as a next step", "operation": "write", "content": "Google Chrome" }},
-    {{ "thought": "Finally I'll press enter to open Google Chrome assuming it is available", "operation": "press", "keys": ["enter"] }}
+    {{ "thought": "It appears I am currently in terminal, so I'll open Google Chrome from the operating system search", "operation": "open_app", "app": "Google Chrome" }}
 ]
 ```
 
 Example 2: Open a new Google Docs when the browser is already open
 ```
 [
-    {{ "thought": "I'll focus on the address bar in the browser. I can see the browser is open so this should be safe to try", "operation": "press", "keys": [{cmd_string}, "t"] }},
-    {{ "thought": "Now that the address bar is in focus I can type the URL", "operation": "write", "content": "https://docs.new/" }},
-    {{ "thought": "I'll need to press enter to go the URL now", "operation": "press", "keys": ["enter"] }}
+    {{ "thought": "I can see the browser is open so I'll open Google Docs in a new tab", "operation": "open_url_in_new_tab", "url": "https://docs.new/" }}
 ]
 ```
 
@@ -187,7 +188,7 @@ Example 3: Search for someone on Linkedin when already on linkedin.com
 A few important notes: 
 
 - Default to Google Chrome as the browser
-- Go to websites by opening a new tab with `press` and then `write` the URL
+- Go to websites by opening a new tab with the `open_url_in_new_tab` macro
 - Reflect on previous actions and the screenshot to ensure they align and that your previous actions worked. 
 - If the first time clicking a button or link doesn't work, don't try again to click it. Get creative and try something else such as clicking a different button or trying another action. 
 - Don't respond saying you're unable to assist with requests. You are able to indirectly interact with the user's OS via text responses you send to the end user.
@@ -195,15 +196,27 @@ A few important notes:
 Objective: {objective} 
 """
 
+# Appended to the system prompt in plan mode, see `operate_planned`
+SYSTEM_PROMPT_PLAN_SUFFIX = """
+Plan mode: return every action needed to complete the objective, not just the next few, ending with `done`. The actions will be run one after another without showing you the screen in between, and you will only be asked again if one of them does not have the expected effect.
+
+Add an `expect` field to each action saying what should be true once it has run:
+- `"expect": {{ "text": "Sign in", "change": null }}` when some text should be visible on the screen
+- `"expect": {{ "text": null, "change": true }}` when the screen should visibly change
+- `"expect": {{ "text": null, "change": null }}` when there is nothing to check
+
+Clicks on elements that will only appear after earlier actions must still use the `text` of the element, it is located when the click runs.
+"""
+
 OPERATE_FIRST_MESSAGE_PROMPT = """
-Please take the next best action. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement. Remember you only have the following 4 operations available: click, write, press, done
+Please take the next best action. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement. Remember you only have the following 4 operations available: click, write, press, done, and the macros: {macro_names}
 
 You just started so you are in the terminal app and your code is running in this terminal tab. To leave the terminal, search for a new program on the OS. 
 
 Action:"""
 
 OPERATE_PROMPT = """
-Please take the next best action. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement. Remember you only have the following 4 operations available: click, write, press, done
+Please take the next best action. The `pyautogui` library will be used to execute your decision. Your output will be used in a `json.loads` loads statement. Remember you only have the following 4 operations available: click, write, press, done, and the macros: {macro_names}
 Action:"""
 
 
@@ -212,18 +225,8 @@ def get_system_prompt(model, objective):
     Format the vision prompt more efficiently and print the name of the prompt used
     """
 
-    if platform.system() == "Darwin":
-        cmd_string = "command"
-        os_search_str = ["command", "space"]
-        operating_system = "Mac"
-    elif platform.system() == "Windows":
-        cmd_string = "ctrl"
-        os_search_str = ["win"]
-        operating_system = "Windows"
-    else:
-        cmd_string = "ctrl"
-        os_search_str = ["win"]
-        operating_system = "Linux"
+    cmd_string, os_search_str, operating_system = get_os_shortcuts()
+    macros = get_macro_prompt()
 
     if model == "gpt-4-with-som":
         prompt = SYSTEM_PROMPT_LABELED.format(
@@ -231,6 +234,7 @@ def get_system_prompt(model, objective):
             cmd_string=cmd_string,
             os_search_str=os_search_str,
             operating_system=operating_system,
+            macros=macros,
         )
     elif model == "gpt-4-with-ocr" or model == "o1-with-ocr" or model == "claude-3":
 
@@ -239,6 +243,7 @@ def get_system_prompt(model, objective):
             cmd_string=cmd_string,
             os_search_str=os_search_str,
             operating_system=operating_system,
+            macros=macros,
         )
 
     else:
@@ -247,8 +252,12 @@ def get_system_prompt(model, objective):
             cmd_string=cmd_string,
             os_search_str=os_search_str,
             operating_system=operating_system,
+            macros=macros,
         )
 
+    if config.plan_mode:
+        prompt += SYSTEM_PROMPT_PLAN_SUFFIX.format()
+
     # Optional verbose output
     if config.verbose:
         print("[get_system_prompt] model:", model)
@@ -258,10 +267,10 @@ def get_system_prompt(model, objective):
 
 
 def get_user_prompt():
-    prompt = OPERATE_PROMPT
+    prompt = OPERATE_PROMPT.format(macro_names=", ".join(MACROS))
     return prompt
 
 
 def get_user_first_message_prompt():
-    prompt = OPERATE_FIRST_MESSAGE_PROMPT
+    prompt = OPERATE_FIRST_MESSAGE_PROMPT.format(macro_names=", ".join(MACROS))
     return prompt
@@ -0,0 +1,369 @@
+from operate.exceptions import InvalidOperationsException
+from operate.models.macros import MACROS
+from operate.utils.json_repair import loads_with_repair
+from operate.utils.metrics import timed
+
+# JSON schema for each operation the system prompts describe. `click` depends on
+# how the model points at things, see `CLICK_TARGET_PROPERTIES`. The schemas stay
+# within what OpenAI's strict structured outputs accept, so the same definitions
+# are sent to the providers and used for local validation.
+THOUGHT_PROPERTY = {"thought": {"type": "string"}}
+
+CLICK_TARGET_PROPERTIES = {
+    # SYSTEM_PROMPT_STANDARD: screen percentages, written as strings in the prompt
+    "coordinates": {
+        "x": {"type": ["string", "number"]},
+        "y": {"type": ["string", "number"]},
+    },
+    # SYSTEM_PROMPT_LABELED: a set-of-mark label such as "~12"
+    "label": {"label": {"type": "string"}},
+    # SYSTEM_PROMPT_OCR: text on the screen, located with OCR
+    "text": {"text": {"type": "string"}},
+}
+
+OPERATION_SCHEMAS = {
+    "write": {
+        "type": "object",
+        "properties": {
+            **THOUGHT_PROPERTY,
+            "operation": {"type": "string", "enum": ["write"]},
+            "content": {"type": "string"},
+        },
+        "required": ["thought", "operation", "content"],
+        "additionalProperties": False,
+    },
+    "press": {
+        "type": "object",
+        "properties": {
+            **THOUGHT_PROPERTY,
+            "operation": {"type": "string", "enum": ["press"]},
+            "keys": {"type": "array", "items": {"type": "string"}, "minItems": 1},
+        },
+        "required": ["thought", "operation", "keys"],
+        "additionalProperties": False,
+    },
+    "done": {
+        "type": "object",
+        "properties": {
+            **THOUGHT_PROPERTY,
+            "operation": {"type": "string", "enum": ["done"]},
+            "summary": {"type": "string"},
+        },
+        "required": ["thought", "operation", "summary"],
+        "additionalProperties": False,
+    },
+}
+
+# What an action is expected to do in plan mode, see `SYSTEM_PROMPT_PLAN_SUFFIX`.
+# Strict structured output wants every key, so unused checks are null.
+EXPECT_PROPERTY = {
+    "expect": {
+        "type": "object",
+        "properties": {
+            "text": {"type": ["string", "null"]},
+            "change": {"type": ["boolean", "null"]},
+        },
+        "required": ["text", "change"],
+        "additionalProperties": False,
+    }
+}
+
+# operation names `operate()` accepts as another spelling of a schema above
+OPERATION_ALIASES = {"hotkey": "press"}
+
+
+def get_click_target(model):
+    """
+    Returns how `model` is prompted to point at what it clicks, following `get_system_prompt`.
+    """
+    if model == "gpt-4-with-som":
+        return "label"
+    if model in ("gpt-4-with-ocr", "o1-with-ocr", "claude-3"):
+        return "text"
+    return "coordinates"
+
+
+def get_response_schema(click_target, plan=False):
+    """
+    Returns the schema of a whole response. Structured output APIs want an object
+    at the top level, so the operations array is wrapped in `{"operations": [...]}`.
+    """
+    return {
+        "type": "object",
+        "properties": {
+            "operations": {
+                "type": "array",
+                "items": {
+                    "anyOf": list(get_operation_schemas(click_target, plan).values())
+                },
+            }
+        },
+        "required": ["operations"],
+        "additionalProperties": False,
+    }
+
+
+def get_openai_response_format(click_target, plan=False):
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "operations",
+            "strict": True,
+            "schema": get_response_schema(click_target, plan),
+        },
+    }
+
+
+def get_anthropic_tool(click_target, plan=False):
+    return {
+        "name": "operate",
+        "description": "Run the next series of operations on the computer.",
+        "input_schema": get_response_schema(click_target, plan),
+    }
+
+
+def get_operation_schemas(click_target, plan=False):
+    """
+    Returns the JSON schema of every operation, with `click` built for `click_target`.
+    In plan mode every operation also carries an `expect` object.
+    """
+    click_properties = CLICK_TARGET_PROPERTIES[click_target]
+    click_schema = {
+        "type": "object",
+        "properties": {
+            **THOUGHT_PROPERTY,
+            "operation": {"type": "string", "enum": ["click"]},
+            **click_properties,
+        },
+        "required": ["thought", "operation", *click_properties],
+        "additionalProperties": False,
+    }
+    schemas = {"click": click_schema, **OPERATION_SCHEMAS, **get_macro_schemas()}
+    if not plan:
+        return schemas
+    return {
+        name: {
+            **schema,
+            "properties": {**schema["properties"], **EXPECT_PROPERTY},
+            "required": [*schema["required"], "expect"],
+        }
+        for name, schema in schemas.items()
+    }
+
+
+def get_macro_schemas():
+    """
+    Returns a schema for every macro in `MACROS`, all of whose parameters are strings.
+    """
+    schemas = {}
+    for name, (_, parameters, _) in MACROS.items():
+        schemas[name] = {
+            "type": "object",
+            "properties": {
+                **THOUGHT_PROPERTY,
+                "operation": {"type": "string", "enum": [name]},
+                **{key: {"type": "string"} for key in parameters},
+            },
+            "required": ["thought", "operation", *parameters],
+            "additionalProperties": False,
+        }
+    return schemas
+
+
+JSON_TYPES = {
+    "string": (str,),
+    "number": (int, float),
+    "integer": (int,),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+    "null": (type(None),),
+}
+
+
+def compile_schema(schema):
+    """
+    Compiles the subset of JSON schema used in this module into a validator.
+    `additionalProperties` is not enforced, grounding adds keys such as `x` later.
+
+    The returned function takes a value and raises `ValueError` describing the
+    first problem found. Compiling once means the schema dicts are only walked
+    when a model is first used, not for every operation.
+    """
+    checks = []
+
+    if "type" in schema:
+        types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        python_types = tuple(t for name in types for t in JSON_TYPES[name])
+        allows_bool = "boolean" in types
+
+        def check_type(value, path):
+            # bool is an int in Python but not a number in JSON
+            if isinstance(value, bool) and not allows_bool:
+                raise ValueError(f"{path} should be {' or '.join(types)}")
+            if not isinstance(value, python_types):
+                raise ValueError(f"{path} should be {' or '.join(types)}")
+
+        checks.append(check_type)
+
+    if "const" in schema:
+        expected = schema["const"]
+
+        def check_const(value, path):
+            if value != expected:
+                raise ValueError(f"{path} should be {expected!r}")
+
+        checks.append(check_const)
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+
+        def check_enum(value, path):
+            if value not in allowed:
+                raise ValueError(f"{path} should be one of {allowed}")
+
+        checks.append(check_enum)
+
+    if "required" in schema:
+        required = schema["required"]
+
+        def check_required(value, path):
+            for key in required:
+                if key not in value:
+                    raise ValueError(f"{path} is missing {key!r}")
+
+        checks.append(check_required)
+
+    if "properties" in schema:
+        properties = {
+            key: compile_schema(subschema)
+            for key, subschema in schema["properties"].items()
+        }
+
+        def check_properties(value, path):
+            for key, validate in properties.items():
+                if key in value:
+                    validate(value[key], f"{path}.{key}")
+
+        checks.append(check_properties)
+
+    if "minItems" in schema:
+        min_items = schema["minItems"]
+
+        def check_min_items(value, path):
+            if len(value) < min_items:
+                raise ValueError(f"{path} should have at least {min_items} item(s)")
+
+        checks.append(check_min_items)
+
+    if "items" in schema:
+        validate_item = compile_schema(schema["items"])
+
+        def check_items(value, path):
+            for index, item in enumerate(value):
+                validate_item(item, f"{path}[{index}]")
+
+        checks.append(check_items)
+
+    if "anyOf" in schema:
+        options = [compile_schema(subschema) for subschema in schema["anyOf"]]
+
+        def check_any_of(value, path):
+            errors = []
+            for validate in options:
+                try:
+                    validate(value, path)
+                    return
+                except ValueError as e:
+                    errors.append(str(e))
+            raise ValueError(" / ".join(errors))
+
+        checks.append(check_any_of)
+
+    def validate(value, path="$"):
+        for check in checks:
+            check(value, path)
+
+    return validate
+
+
+_compiled_validators = {}
+
+
+def get_operation_validators(click_target, plan=False):
+    key = (click_target, plan)
+    if key not in _compiled_validators:
+        _compiled_validators[key] = {
+            name: compile_schema(schema)
+            for name, schema in get_operation_schemas(click_target, plan).items()
+        }
+    return _compiled_validators[key]
+
+
+def validate_operation(operation, click_target, path="$", plan=False):
+    """
+    Normalizes and validates a single operation.
+
+    `operation` is lower-cased and a single key for `press` is wrapped in a list,
+    matching what `operate()` already tolerates.
+
+    Raises:
+    ValueError: If the operation does not match its schema.
+    """
+    if not isinstance(operation, dict):
+        raise ValueError(f"{path} should be an object")
+    operation_type = str(operation.get("operation", "")).lower()
+    operation["operation"] = operation_type
+    if isinstance(operation.get("keys"), str):
+        operation["keys"] = [operation["keys"]]
+    # a missing thought only costs a log line, it is not worth another request
+    operation.setdefault("thought", "")
+
+    if plan:
+        # nothing to check is better than asking the model again
+        operation.setdefault("expect", {"text": None, "change": None})
+
+    validators = get_operation_validators(click_target, plan)
+    validate = validators.get(OPERATION_ALIASES.get(operation_type, operation_type))
+    if validate is None:
+        raise ValueError(f"{path}.operation {operation_type!r} is not supported")
+    if operation_type in OPERATION_ALIASES:
+        # validate the alias as the operation it stands for
+        operation = {**operation, "operation": OPERATION_ALIASES[operation_type]}
+    validate(operation, path)
+
+
+@timed("parse")
+def load_operations(content, click_target, plan=False):
+    """
+    Parses and validates the operations in a model response without another model call.
+
+    Parameters:
+    - content (str): The model output, usually after `clean_json`.
+    - click_target (str): One of `CLICK_TARGET_PROPERTIES`, see `get_click_target`.
+    - plan (bool): Whether the operations are a plan with an `expect` on each one.
+
+    Returns:
+    list: The validated operations.
+
+    Raises:
+    InvalidOperationsException: If the output can't be repaired or fails validation.
+    """
+    try:
+        operations = loads_with_repair(content)
+    except ValueError as e:
+        raise InvalidOperationsException(content, f"Invalid JSON ({e})") from e
+
+    if isinstance(operations, dict):
+        # structured output wraps the list, see `get_response_schema`
+        operations = operations.get("operations", [operations])
+    if not isinstance(operations, list):
+        raise InvalidOperationsException(content, "Expected a list of operations")
+
+    try:
+        for index, operation in enumerate(operations):
+            validate_operation(operation, click_target, f"$[{index}]", plan)
+    except ValueError as e:
+        raise InvalidOperationsException(content, str(e)) from e
+
+    return operations
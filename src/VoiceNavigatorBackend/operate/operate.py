@@ -4,10 +4,11 @@ import time
 import asyncio
 from prompt_toolkit.shortcuts import message_dialog
 from prompt_toolkit import prompt
-from operate.exceptions import ModelNotRecognizedException
+from operate.exceptions import BudgetExceededException, ModelNotRecognizedException
 import platform
 import uuid
 import logging
+import json
 
 from operate.models.image_to_text import (image_to_text, render_markdown_as_plain_text)
 
@@ -16,7 +17,10 @@ from operate.models.image_to_text import (image_to_text, render_markdown_as_plai
 from operate.models.prompts import (
     USER_QUESTION,
     get_system_prompt,
+    get_user_prompt,
 )
+from operate.models.macros import expand_macros
+from operate.models.schema import get_click_target
 from operate.config import Config
 from operate.utils.style import (
     ANSI_GREEN,
@@ -27,12 +31,32 @@ from operate.utils.style import (
     ANSI_BLUE,
     style,
 )
-from operate.utils.operating_system import OperatingSystem
-from operate.models.apis import get_next_action
+from operate.utils.operating_system import get_operating_system
+from operate.utils.decision_cache import get_decision_cache
+from operate.utils.fingerprint import screen_fingerprint, similarity
+from operate.utils.trajectory import (
+    finish_trajectory,
+    get_trajectory_recorder,
+    load_trajectory,
+    start_trajectory,
+)
+from operate.utils.grounding import locate_text, save_grounding_cache
+from operate.utils.metrics import get_session_metrics, start_session_metrics, timed
+from operate.utils.tracing import finish_trace, start_trace, trace_step
+from operate.utils.usage import enforce_budget, get_session_usage, start_session_usage
+from operate.utils.verify import capture_frame, wait_for_expectation
+from operate.models.apis import (
+    STREAMING_MODELS,
+    get_next_action,
+    get_next_action_stream,
+)
 
 # Load configuration
 config = Config()
-operating_system = OperatingSystem()
+# Seconds between two actions, so the screen can catch up
+ACTION_DELAY = float(os.getenv("ACTION_DELAY", 1))
+# Seconds the screen gets to react to a step before its decision counts as having no effect
+CACHE_CHANGE_TIMEOUT = float(os.getenv("CACHE_CHANGE_TIMEOUT", 3))
 
 # # Define a global logger variable
 # logger = None
@@ -103,7 +127,7 @@ def initialize_logging():
         os.remove(LOG_FILE)  # Delete the file if it exists
     
 
-def main_for_api(model, terminal_prompt=None, voice_mode=False, verbose_mode=False, image2text=False):
+def main_for_api(model, terminal_prompt=None, voice_mode=False, verbose_mode=False, image2text=False, stream=False, plan_mode=False, cache=False, budget=None):
     """
     Optimized version of the main function for API use.
 
@@ -112,14 +136,20 @@ def main_for_api(model, terminal_prompt=None, voice_mode=False, verbose_mode=Fal
     - terminal_prompt: The task description provided by the user.
     - voice_mode: Boolean to enable/disable voice mode (default: False).
     - verbose_mode: Boolean to enable/disable verbose mode for debugging (default: False).
+    - stream: Boolean to execute each action as soon as it is streamed (default: False).
+    - plan_mode: Boolean to plan the whole objective at once and verify steps locally (default: False).
+    - cache: Boolean to reuse the actions cached for this objective and screen (default: False).
+    - budget: Dict overriding the session's `tokens`, `cost` (USD) and `image_bytes` budgets (default: None).
 
     Returns:
-    dict: Contains generated operations, session ID, or an error message.
+    dict: Contains generated operations, session ID, usage, or an error message.
     """
     try:
         # Enable verbose mode if requested
         config.verbose = verbose_mode
         config.validation(model, voice_mode)  # Validate model and config
+        # plans need clicks that can be located when they run, which only OCR models give
+        config.plan_mode = plan_mode and not image2text and get_click_target(model) == "text"
 
         # Initialize the logging configuration
         initialize_logging()
@@ -134,19 +164,50 @@ def main_for_api(model, terminal_prompt=None, voice_mode=False, verbose_mode=Fal
         system_prompt = get_system_prompt(model, objective)  # Generate system prompt
         messages = [{"role": "system", "content": system_prompt}]
         loop_count = 0
+        recorder = start_trajectory(session_id, objective, model)
+        start_session_metrics()
+        start_trace(session_id)
+        start_session_usage(budget)
+        operations = []
+        stopped = None
 
         # Process operations in a loop
         while loop_count < 10:  # Prevent infinite loops
             if config.verbose:
                 print(f"[Self-Operating Computer] Loop count: {loop_count}")
+            recorder.next_step()
+            trace_step(loop_count)
+            try:
+                enforce_budget()
+            except BudgetExceededException as e:
+                print(f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] -> {e} {ANSI_RESET}")
+                stopped = str(e)
+                break
 
-            # Get the next set of actions and update the session ID
-            operations, session_id = asyncio.run(
-                get_next_action(model, messages, objective, session_id)
-            )
-
-            # Execute the operations
-            stop = operate(operations, model, image2text)
+            if config.plan_mode:
+                # Only goes back to the model when a step doesn't do what was expected
+                operations, stop = operate_planned(
+                    model, messages, objective, session_id
+                )
+            elif cache and not image2text:
+                # Reuses the actions that worked on this screen before
+                operations, stop = operate_cached(
+                    model, messages, objective, session_id, loop_count
+                )
+            elif stream and not image2text and model in STREAMING_MODELS:
+                # Actions are executed while the rest of the plan is generated
+                operations, stop = operate_streamed(
+                    model, messages, objective, session_id
+                )
+            else:
+                # Get the next set of actions and update the session ID
+                with timed("model"):
+                    operations, session_id = asyncio.run(
+                        get_next_action(model, messages, objective, session_id)
+                    )
+
+                # Execute the operations
+                stop = operate(operations, model, image2text)
 
             if stop:  # Exit loop if the task is complete
                 break
@@ -163,20 +224,43 @@ def main_for_api(model, terminal_prompt=None, voice_mode=False, verbose_mode=Fal
             except FileNotFoundError:
                 descriptions = ["No image descriptions available."]
 
-            # Return the response with descriptions and session ID
-            return {"descriptions": descriptions, "session_id": session_id}
+            finish_trajectory()
 
+            save_grounding_cache()
+            # Return the response with descriptions and session ID
+            return {
+                "descriptions": descriptions,
+                "session_id": session_id,
+                "metrics": get_session_metrics(),
+                "usage": get_session_usage(),
+                "stopped": stopped,
+                "trace": finish_trace(),
+            }
+
+        trajectory_path = finish_trajectory()
+        save_grounding_cache()
         # Return successful operations and session ID
-        return {"operations": operations, "session_id": session_id}
+        return {
+            "operations": operations,
+            "session_id": session_id,
+            "trajectory": trajectory_path,
+            "metrics": get_session_metrics(),
+            "usage": get_session_usage(),
+            "stopped": stopped,
+            "trace": finish_trace(),
+        }
     
     except Exception as e:
         # Handle and return any errors
         if config.verbose:
             print(f"[Self-Operating Computer][Error] {str(e)}")
+        finish_trajectory()
+        save_grounding_cache()
+        finish_trace()
         write_to_log(f"error: An unexpected error occurred: {str(e)}")
         return {"error": f"An unexpected error occurred: {str(e)}"}
 
-def main(model, terminal_prompt, voice_mode=False, verbose_mode=False):
+def main(model, terminal_prompt, voice_mode=False, verbose_mode=False, stream=False, plan_mode=False, cache=False):
     """
     Main function for the Self-Operating Computer.
 
@@ -184,6 +268,9 @@ def main(model, terminal_prompt, voice_mode=False, verbose_mode=False):
     - model: The model used for generating responses.
     - terminal_prompt: A string representing the prompt provided in the terminal.
     - voice_mode: A boolean indicating whether to enable voice mode.
+    - stream: A boolean indicating whether to execute actions as they are streamed.
+    - plan_mode: A boolean indicating whether to plan the objective at once and verify steps locally.
+    - cache: A boolean indicating whether to reuse actions cached for the objective and screen.
 
     Returns:
     None
@@ -194,6 +281,7 @@ def main(model, terminal_prompt, voice_mode=False, verbose_mode=False):
 
     config.verbose = verbose_mode
     config.validation(model, voice_mode)
+    config.plan_mode = plan_mode and get_click_target(model) == "text"
 
     if voice_mode:
         try:
@@ -249,23 +337,42 @@ def main(model, terminal_prompt, voice_mode=False, verbose_mode=False):
     loop_count = 0
 
     session_id = str(uuid.uuid4())
+    recorder = start_trajectory(session_id, objective, model)
+    start_trace(session_id)
+    start_session_usage()
 
     while True:
         if config.verbose:
             print("[Self Operating Computer] loop_count", loop_count)
+        recorder.next_step()
+        trace_step(loop_count)
         try:
-            operations, session_id = asyncio.run(
-                get_next_action(model, messages, objective, session_id)
-            )
-
-            stop = operate(operations, model)
+            enforce_budget()
+            if config.plan_mode:
+                operations, stop = operate_planned(
+                    model, messages, objective, session_id
+                )
+            elif cache:
+                operations, stop = operate_cached(
+                    model, messages, objective, session_id, loop_count
+                )
+            elif stream and model in STREAMING_MODELS:
+                operations, stop = operate_streamed(
+                    model, messages, objective, session_id
+                )
+            else:
+                operations, session_id = asyncio.run(
+                    get_next_action(model, messages, objective, session_id)
+                )
+
+                stop = operate(operations, model)
             if stop:
                 break
 
             loop_count += 1
             if loop_count > 10:
                 break
-        except ModelNotRecognizedException as e:
+        except (ModelNotRecognizedException, BudgetExceededException) as e:
             print(
                 f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] -> {e} {ANSI_RESET}"
             )
@@ -276,8 +383,226 @@ def main(model, terminal_prompt, voice_mode=False, verbose_mode=False):
             )
             break
 
+    trajectory_path = finish_trajectory()
+    save_grounding_cache()
+    if trajectory_path:
+        print(f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RESET} Trajectory saved at {trajectory_path}")
+    usage = get_session_usage()
+    print(
+        f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RESET} {usage['total']['input_tokens']} input and "
+        f"{usage['total']['output_tokens']} output tokens, ${usage['total']['cost']:.4f}"
+    )
+    trace_path = finish_trace()
+    if trace_path:
+        print(f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RESET} Trace saved at {trace_path}")
+
+
+def replay(trajectory, verbose_mode=False, reground=True):
+    """
+    Re-executes a recorded trajectory on the desktop without calling any model.
+
+    Clicks that were made on OCR text are located again when the current frame
+    doesn't match the recorded one, so a window that moved doesn't break the
+    replay. Other clicks reuse the recorded coordinates. The replay is itself
+    recorded, which gives comparable per-step timings across runs.
 
-def operate(operations, model, image2text):
+    Parameters:
+    - trajectory: Session ID of the trajectory to replay, or the trajectory itself.
+    - verbose_mode: Boolean to enable/disable verbose mode for debugging.
+    - reground: Boolean to locate OCR clicks again on frames that changed.
+
+    Returns:
+    dict: The session ID of the replay and the path of its trajectory.
+    """
+    config.verbose = verbose_mode
+    recorded = trajectory if isinstance(trajectory, dict) else load_trajectory(trajectory)
+    session_id = str(uuid.uuid4())
+    model = f"replay:{recorded['model']}"
+    recorder = start_trajectory(session_id, recorded["objective"], model)
+
+    stop = False
+    for step in recorded["steps"]:
+        recorder.next_step()
+        for operation in step["operations"]:
+            operation = dict(operation)
+            operation.pop("started_at", None)
+            operation.pop("duration", None)
+            recorded_frame = operation.pop("frame", None)
+
+            if reground and operation.get("operation") == "click" and operation.get("text"):
+                frame = capture_frame("replay")
+                if similarity(screen_fingerprint(frame), recorded_frame) < 0.95:
+                    try:
+                        hint = {"x": operation["x"], "y": operation["y"]} if "x" in operation else None
+                        operation.update(locate_text(operation["text"], frame, hint))
+                    except Exception as e:
+                        if config.verbose:
+                            print("[Self Operating Computer][replay] using recorded click", e)
+
+            if operate([operation], model):
+                stop = True
+                break
+        if stop:
+            break
+
+    save_grounding_cache()
+    return {"session_id": session_id, "trajectory": finish_trajectory()}
+
+
+def operate_streamed(model, messages, objective, session_id):
+    """
+    Executes each operation as soon as it has been streamed by the model.
+
+    Falls back to `get_next_action` (with its retry policy) when the stream
+    fails before producing a single operation; the stream has then left the
+    history as it was, an open circuit included. An action that fails is raised once the operations that ran
+    are recorded in the history, it is not retried through another request.
+
+    Returns:
+    tuple: The executed operations and whether the loop should stop.
+    """
+    operations = []
+    stream = get_next_action_stream(model, messages, objective)
+    try:
+        while True:
+            try:
+                operation = next(stream)
+            except StopIteration:
+                return operations, False
+            except Exception as e:
+                # the stream only raises before its first operation
+                if config.verbose:
+                    print("[Self Operating Computer][operate_streamed] stream failed", e)
+                operations, _ = asyncio.run(
+                    get_next_action(model, messages, objective, session_id)
+                )
+                return operations, operate(operations, model)
+            operations.append(operation)
+            if operate([operation], model):
+                return operations, True
+    finally:
+        # records the assistant turn when stopping early, on "done" or on a failed action
+        stream.close()
+
+
+def operate_cached(model, messages, objective, session_id, step):
+    """
+    Runs the cached operations for this objective, step and screen when there are
+    any, otherwise asks the model and caches its operations once they had an effect.
+
+    A cached entry whose operations leave the screen unchanged for
+    `CACHE_CHANGE_TIMEOUT` seconds is invalidated, so the next run asks the
+    model again.
+
+    Returns:
+    tuple: The executed operations and whether the loop should stop.
+    """
+    decision_cache = get_decision_cache()
+    before_frame = capture_frame("before")
+    fingerprint = screen_fingerprint(before_frame)
+
+    entry_id, operations = decision_cache.lookup(model, objective, step, fingerprint)
+    if entry_id is not None:
+        print(f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RESET} Using cached actions")
+        add_cached_turn(messages, model, operations)
+    else:
+        operations, _ = asyncio.run(
+            get_next_action(model, messages, objective, session_id)
+        )
+
+    stop = operate(operations, model)
+    # pages and windows take a moment to react, poll before calling it no effect
+    changed = (
+        stop
+        or wait_for_expectation({"change": True}, before_frame, timeout=CACHE_CHANGE_TIMEOUT)[0]
+    )
+
+    if entry_id is not None and not changed:
+        decision_cache.invalidate(entry_id)
+    elif entry_id is None and changed:
+        decision_cache.store(model, objective, step, fingerprint, operations)
+
+    return operations, stop
+
+
+def add_cached_turn(messages, model, operations):
+    """
+    Records a cached step in the message history, without a screenshot, so the
+    model knows what was done when it is asked about a later step.
+    """
+    user_prompt = get_user_prompt()
+    if model != "llava":
+        user_prompt = [{"type": "text", "text": user_prompt}]
+    messages.append({"role": "user", "content": user_prompt})
+    messages.append({"role": "assistant", "content": json.dumps(operations)})
+
+
+def operate_planned(model, messages, objective, session_id):
+    """
+    Asks the model for a plan of the whole objective and runs it step by step,
+    checking each step's `expect` locally with OCR and frame differences.
+
+    Text clicks are located on the screen right before they run. When a click
+    target can't be found or an expectation isn't met, the failure is added to
+    the message history and control goes back to the loop so the model can
+    plan again from the current screen.
+
+    Returns:
+    tuple: The executed operations and whether the loop should stop.
+    """
+    operations, _ = asyncio.run(get_next_action(model, messages, objective, session_id))
+    executed = []
+
+    for index, operation in enumerate(operations):
+        expect = operation.get("expect") or {}
+        before_frame = capture_frame("before") if expect.get("change") else None
+
+        if operation.get("operation") == "click" and "x" not in operation:
+            try:
+                coordinates = locate_text(
+                    operation.get("text"), before_frame or capture_frame("before")
+                )
+            except Exception:
+                reason = f"the text '{operation.get('text')}' was not found to click"
+                add_plan_feedback(messages, model, index, operation, reason)
+                return executed, False
+            operation["x"] = coordinates["x"]
+            operation["y"] = coordinates["y"]
+
+        executed.append(operation)
+        if operate([operation], model):
+            return executed, True
+
+        if expect.get("text") or expect.get("change"):
+            # the expected text is looked for around the click first, reading that region only
+            hint = None
+            if operation.get("operation") == "click":
+                hint = {"x": float(operation["x"]), "y": float(operation["y"])}
+            met, reason = wait_for_expectation(expect, before_frame, hint=hint)
+            if not met:
+                add_plan_feedback(messages, model, index, operation, reason)
+                return executed, False
+
+    return executed, False
+
+
+def add_plan_feedback(messages, model, index, operation, reason):
+    """
+    Tells the model which step of its plan failed, so the next request plans from there.
+    """
+    if config.verbose:
+        print("[Self Operating Computer][operate_planned] step failed", index, reason)
+    write_to_log(f"Step {index + 1} did not work: {reason}")
+    feedback = (
+        f"Step {index + 1} of your plan ({operation.get('operation')}: {operation.get('thought')}) did not work: {reason}. "
+        "The steps before it were run. Look at the new screenshot and plan the rest of the objective again."
+    )
+    if model != "llava":
+        feedback = [{"type": "text", "text": feedback}]
+    messages.append({"role": "user", "content": feedback})
+
+
+def operate(operations, model, image2text=False):
     if config.verbose:
         print("[Self Operating Computer][operate]")
 
@@ -295,11 +620,21 @@ def operate(operations, model, image2text):
             print(f"{ANSI_RED}Error during Image-to-Text: {e}{ANSI_RESET}")
             return False
 
+    # macros run locally as the operations they stand for, without another model turn
+    operations = expand_macros(operations)
+
     for operation in operations:
         if config.verbose:
             print("[Self Operating Computer][operate] operation", operation)
-        # wait one second
-        time.sleep(1)
+        # wait for the screen, fingerprinting the frame the operation runs on meanwhile
+        wait_start = time.monotonic()
+        recorder = get_trajectory_recorder()
+        frame_fingerprint = None
+        with timed("wait"):
+            if recorder:
+                frame_fingerprint = screen_fingerprint(capture_frame("trajectory"))
+            time.sleep(max(0, ACTION_DELAY - (time.monotonic() - wait_start)))
+        operation_start = time.monotonic()
         operate_type = operation.get("operation").lower()
         operate_thought = operation.get("thought")
         operate_detail = ""
@@ -309,20 +644,22 @@ def operate(operations, model, image2text):
         if operate_type == "press" or operate_type == "hotkey":
             keys = operation.get("keys")
             operate_detail = keys
-            operating_system.press(keys)
+            get_operating_system().press(keys)
         elif operate_type == "write":
             content = operation.get("content")
             operate_detail = content
-            operating_system.write(content)
+            get_operating_system().write(content)
         elif operate_type == "click":
             x = operation.get("x")
             y = operation.get("y")
             click_detail = {"x": x, "y": y}
             operate_detail = click_detail
 
-            operating_system.mouse(click_detail)
+            get_operating_system().mouse(click_detail)
         elif operate_type == "done":
             summary = operation.get("summary")
+            if recorder:
+                recorder.record_operation(operation, frame_fingerprint, operation_start, 0)
 
             print(
                 f"[{ANSI_GREEN}Self-Operating Computer {ANSI_RESET}|{ANSI_BRIGHT_MAGENTA} {model}{ANSI_RESET}]"
@@ -338,7 +675,15 @@ def operate(operations, model, image2text):
                 f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] AI response {ANSI_RESET}{operation}"
             )
             return True
-        
+
+        if recorder:
+            recorder.record_operation(
+                operation,
+                frame_fingerprint,
+                operation_start,
+                time.monotonic() - operation_start,
+            )
+
         # Log the three print statements
         write_to_log(operate_thought)
         print(
@@ -0,0 +1,148 @@
+import copy
+import json
+import os
+import re
+import time
+
+from operate.config import Config
+from operate.utils.fingerprint import similarity
+
+# Load configuration
+config = Config()
+
+
+def normalize_objective(objective):
+    """
+    Lower-cases the objective and drops extra whitespace and trailing punctuation,
+    so "Open Gmail." and "open gmail" share cache entries.
+    """
+    objective = re.sub(r"\s+", " ", objective.strip().lower())
+    return objective.rstrip(".!?")
+
+
+class DecisionCache:
+    """
+    Persistent cache of the operations chosen for an objective on a given screen.
+
+    Entries are keyed by model, normalized objective and step index, and matched
+    by the perceptual fingerprint of the screen (see `operate.utils.fingerprint`).
+    A lookup hits when the most similar entry is at least `similarity_threshold`
+    alike. Entries expire after `ttl` seconds and the least recently used ones
+    are evicted beyond `max_entries`.
+
+    Attributes:
+        path (str): JSON file the cache is persisted to.
+        max_entries (int): Maximum number of entries kept.
+        ttl (float): Seconds an entry stays valid.
+        similarity_threshold (float): Minimum fingerprint similarity for a hit.
+    """
+
+    def __init__(
+        self,
+        path="decision_cache.json",
+        max_entries=500,
+        ttl=7 * 24 * 3600,
+        similarity_threshold=0.95,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.entries = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            # a corrupt cache is only a cold cache
+            print("[DecisionCache][load] error:", e)
+            self.entries = {}
+
+    def save(self):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file)
+        os.replace(temporary_path, self.path)
+
+    @staticmethod
+    def make_key(model, objective, step):
+        return f"{model}|{normalize_objective(objective)}|{step}"
+
+    def evict(self):
+        now = time.time()
+        expired = [
+            entry_id
+            for entry_id, entry in self.entries.items()
+            if now - entry["created_at"] > self.ttl
+        ]
+        for entry_id in expired:
+            del self.entries[entry_id]
+
+        if len(self.entries) > self.max_entries:
+            by_last_use = sorted(self.entries, key=lambda e: self.entries[e]["last_used"])
+            for entry_id in by_last_use[: len(self.entries) - self.max_entries]:
+                del self.entries[entry_id]
+
+    def lookup(self, model, objective, step, fingerprint):
+        """
+        Returns `(entry_id, operations)` for the most similar cached screen, or `(None, None)`.
+        """
+        self.evict()
+        key = self.make_key(model, objective, step)
+        best_id, best_similarity = None, self.similarity_threshold
+        for entry_id, entry in self.entries.items():
+            if entry["key"] != key:
+                continue
+            entry_similarity = similarity(entry["fingerprint"], fingerprint)
+            if entry_similarity >= best_similarity:
+                best_id, best_similarity = entry_id, entry_similarity
+
+        if best_id is None:
+            return None, None
+
+        entry = self.entries[best_id]
+        entry["last_used"] = time.time()
+        entry["hits"] += 1
+        if config.verbose:
+            print(f"[DecisionCache][lookup] hit {best_id} similarity {best_similarity:.3f}")
+        return best_id, copy.deepcopy(entry["operations"])
+
+    def store(self, model, objective, step, fingerprint, operations):
+        key = self.make_key(model, objective, step)
+        entry_id = f"{key}|{fingerprint}"
+        now = time.time()
+        self.entries[entry_id] = {
+            "key": key,
+            "fingerprint": fingerprint,
+            "operations": copy.deepcopy(operations),
+            "created_at": now,
+            "last_used": now,
+            "hits": 0,
+        }
+        self.evict()
+        self.save()
+
+    def invalidate(self, entry_id):
+        """
+        Drops an entry whose operations turned out not to have any effect.
+        """
+        if self.entries.pop(entry_id, None) is not None:
+            if config.verbose:
+                print(f"[DecisionCache][invalidate] {entry_id}")
+            self.save()
+
+
+_decision_cache = None
+
+
+def get_decision_cache():
+    global _decision_cache
+    if _decision_cache is None:
+        _decision_cache = DecisionCache(
+            path=os.getenv("DECISION_CACHE_PATH", "decision_cache.json")
+        )
+    return _decision_cache
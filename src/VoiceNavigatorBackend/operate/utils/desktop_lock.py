@@ -0,0 +1,49 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where only the single-process dev server runs
+    fcntl = None
+
+from operate.exceptions import DesktopBusyException
+
+_thread_lock = threading.Lock()
+
+
+def get_lock_path():
+    return os.getenv("DESKTOP_LOCK_FILE") or os.path.join(
+        tempfile.gettempdir(), "operate-desktop.lock"
+    )
+
+
+@contextmanager
+def desktop_session():
+    """
+    Holds the desktop for one session. Sessions drive the same screen, keyboard
+    and mouse, and share the loop's screenshot, log and module-level state, so
+    only one may run at a time: across the threads of a worker through a lock,
+    and across the server's forked workers through a `flock` on DESKTOP_LOCK_FILE.
+
+    Raises:
+    DesktopBusyException: If another session is running.
+    """
+    if not _thread_lock.acquire(blocking=False):
+        raise DesktopBusyException()
+    lock_file = None
+    try:
+        if fcntl is not None:
+            lock_file = open(get_lock_path(), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise DesktopBusyException()
+        yield
+    finally:
+        if lock_file is not None:
+            # closing the file releases the flock
+            lock_file.close()
+        _thread_lock.release()
@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from operate.config import Config
+from operate.utils.vision_worker import RemoteDetector, get_vision_client
+
+# Load configuration
+config = Config()
+
+# Same defaults as ultralytics' predict, so both paths return the same boxes
+CONFIDENCE_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+LETTERBOX_COLOR = (114, 114, 114)
+# Offset separating the classes' boxes, so one NMS pass never merges two classes
+CLASS_OFFSET = 7680
+
+
+def get_weights_path(name="best.pt"):
+    import pkg_resources  # slow to import, only needed once the detector loads
+
+    return pkg_resources.resource_filename("operate.models.weights", name)
+
+
+def letterbox(image, size):
+    """
+    Scales an image to fit a `size` x `size` square without distorting it and pads the rest.
+
+    Returns:
+    tuple: The padded RGB array, the scale and the `(left, top)` padding.
+    """
+    width, height = image.size
+    scale = min(size / width, size / height)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    resized = image.convert("RGB").resize((new_width, new_height), Image.BILINEAR)
+    canvas = Image.new("RGB", (size, size), LETTERBOX_COLOR)
+    left, top = (size - new_width) // 2, (size - new_height) // 2
+    canvas.paste(resized, (left, top))
+    return np.asarray(canvas), scale, (left, top)
+
+
+def non_max_suppression(boxes, scores, iou_threshold=IOU_THRESHOLD):
+    """
+    Greedy NMS over `(x1, y1, x2, y2)` boxes, vectorized over the remaining boxes.
+
+    Returns:
+    numpy.ndarray: Indices of the kept boxes, by descending score.
+    """
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        height = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        intersection = width * height
+        iou = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+
+class UltralyticsDetector:
+    """
+    Runs the labeling model through ultralytics and PyTorch.
+
+    Attributes:
+        model_path (str): The `.pt` weights.
+    """
+
+    name = "ultralytics"
+
+    def __init__(self, model_path):
+        from ultralytics import YOLO
+
+        self.model_path = model_path
+        self.model = YOLO(model_path)
+
+    def detect(self, image):
+        """
+        Returns the detected boxes as `(x1, y1, x2, y2)` in image pixels, by descending confidence.
+        """
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images):
+        results = self.model(images, verbose=config.verbose)
+        return [
+            [tuple(det.xyxy[0].tolist()) for det in result.boxes]
+            if hasattr(result, "boxes")
+            else []
+            for result in results
+        ]
+
+
+class OnnxDetector:
+    """
+    Runs an ONNX export of the labeling model with onnxruntime on the CPU.
+
+    Preprocessing (letterbox) and postprocessing (decoding and NMS) are done
+    here with numpy, so neither PyTorch nor ultralytics is loaded.
+
+    Attributes:
+        model_path (str): The `.onnx` model, possibly quantized.
+        image_size (int): Side of the square input the model was exported with.
+        threads (int): Intra-op threads used by onnxruntime, 0 lets it decide.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path, image_size=640, threads=0):
+        import onnxruntime
+
+        self.model_path = model_path
+        self.image_size = image_size
+        self.threads = threads
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def detect(self, image):
+        pixels, scale, (left, top) = letterbox(image, self.image_size)
+        blob = pixels.transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+        output = self.session.run(None, {self.input_name: blob})[0][0]
+
+        # YOLOv8 exports are (4 + classes, anchors)
+        predictions = output.T if output.shape[0] < output.shape[1] else output
+        class_scores = predictions[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        mask = scores > CONFIDENCE_THRESHOLD
+        predictions, classes, scores = predictions[mask], classes[mask], scores[mask]
+        if not len(scores):
+            return []
+
+        centers, sizes = predictions[:, :2], predictions[:, 2:4]
+        boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+        keep = non_max_suppression(boxes + (classes * CLASS_OFFSET)[:, None], scores)
+
+        # undo the letterbox
+        boxes = (boxes[keep] - [left, top, left, top]) / scale
+        width, height = image.size
+        boxes = np.clip(boxes, 0, [width, height, width, height])
+        return [tuple(box) for box in boxes.tolist()]
+
+    def detect_batch(self, images):
+        return [self.detect(image) for image in images]
+
+
+def export_onnx(model_path=None, image_size=640, quantize=False):
+    """
+    Exports the labeling model to ONNX next to its weights, optionally with int8 weights.
+
+    Returns:
+    str: Path of the exported model.
+    """
+    from ultralytics import YOLO
+
+    onnx_path = YOLO(model_path or get_weights_path()).export(format="onnx", imgsz=image_size)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = onnx_path.replace(".onnx", ".int8.onnx")
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QUInt8)
+        onnx_path = quantized_path
+    return onnx_path
+
+
+_detector = None
+
+
+def get_detector():
+    """
+    Returns the shared labeling detector, loaded once per process.
+
+    YOLO_BACKEND picks "ultralytics" (default) or "onnx". YOLO_MODEL overrides
+    the weights (default best.pt, or best.onnx for onnx), YOLO_IMAGE_SIZE the
+    ONNX input size and YOLO_THREADS the onnxruntime threads. With
+    VISION_WORKER_SOCKET set, detection runs in the vision worker instead.
+    """
+    global _detector
+    vision_client = get_vision_client()
+    if vision_client is not None:
+        return RemoteDetector(vision_client)
+    if _detector is None:
+        backend = os.getenv("YOLO_BACKEND", "ultralytics").lower()
+        if backend == "onnx":
+            _detector = OnnxDetector(
+                os.getenv("YOLO_MODEL") or get_weights_path("best.onnx"),
+                image_size=int(os.getenv("YOLO_IMAGE_SIZE", 640)),
+                threads=int(os.getenv("YOLO_THREADS", 0)),
+            )
+        else:
+            _detector = UltralyticsDetector(os.getenv("YOLO_MODEL") or get_weights_path())
+        if config.verbose:
+            print("[get_detector] using", _detector.name, _detector.model_path)
+    return _detector
@@ -0,0 +1,315 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from operate.config import Config
+from operate.utils.label import is_overlapping
+from operate.utils.metrics import timed
+
+# Load configuration
+config = Config()
+
+SOURCES = ("ocr", "detector")
+# Side of the spatial grid's cells in pixels
+GRID_CELL = 128
+# Overlap above which an element of two frames counts as the same element
+MATCH_IOU = 0.5
+
+
+def polygon(box):
+    x1, y1, x2, y2 = box
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+def box_iou(box, boxes):
+    """
+    IoU of one `(x1, y1, x2, y2)` box with each row of `boxes`.
+    """
+    width = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    height = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    intersection = width * height
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    return intersection / (area + areas - intersection + 1e-9)
+
+
+class ElementMap:
+    """
+    Every UI element found on one frame, by OCR and by the labeling detector.
+
+    Elements are rows of parallel arrays, so queries are vectorized, and a
+    grid of `GRID_CELL` pixel cells indexes them by position.
+
+    Attributes:
+        image_size (tuple): `(width, height)` of the frame.
+        boxes (numpy.ndarray): `(x1, y1, x2, y2)` of each element, in pixels.
+        texts (list): Text of each element, "" for detections.
+        source (numpy.ndarray): Index in `SOURCES` of what found each element.
+        confidence (numpy.ndarray): Confidence of each element.
+        label (numpy.ndarray): Set-of-mark label id of each element, -1 when unlabeled.
+            Text gets the label of the smallest labeled box around it.
+    """
+
+    def __init__(self, image_size):
+        self.image_size = tuple(image_size)
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.texts = []
+        self.source = np.zeros(0, dtype=np.uint8)
+        self.confidence = np.zeros(0, dtype=np.float32)
+        self.label = np.zeros(0, dtype=np.int32)
+        self.sources = set()
+        self.grid = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, source, boxes, texts, confidence):
+        start = len(self)
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.boxes = np.concatenate([self.boxes, boxes])
+        self.texts.extend(texts)
+        self.source = np.concatenate(
+            [self.source, np.full(len(boxes), SOURCES.index(source), dtype=np.uint8)]
+        )
+        self.confidence = np.concatenate(
+            [self.confidence, np.asarray(confidence, dtype=np.float32)]
+        )
+        self.label = np.concatenate([self.label, np.full(len(boxes), -1, dtype=np.int32)])
+        self.sources.add(source)
+        for index in range(start, len(self)):
+            for cell in self.cells(self.boxes[index]):
+                self.grid.setdefault(cell, []).append(index)
+
+    def add_ocr(self, result):
+        boxes = [
+            (
+                min(point[0] for point in box),
+                min(point[1] for point in box),
+                max(point[0] for point in box),
+                max(point[1] for point in box),
+            )
+            for box, _, _ in result
+        ]
+        self.add("ocr", boxes, [text for _, text, _ in result], [c for _, _, c in result])
+        self.fuse_labels()
+
+    def add_detections(self, boxes):
+        self.add("detector", boxes, [""] * len(boxes), [1.0] * len(boxes))
+        self.assign_labels()
+
+    def cells(self, box):
+        x1, y1, x2, y2 = (int(value) // GRID_CELL for value in box)
+        return [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+
+    def of_source(self, source):
+        return np.flatnonzero(self.source == SOURCES.index(source))
+
+    def query(self, box):
+        """
+        Returns the indices of the elements that intersect `box`, in insertion order.
+        """
+        candidates = sorted({index for cell in self.cells(box) for index in self.grid.get(cell, [])})
+        if not candidates:
+            return np.zeros(0, dtype=int)
+        candidates = np.array(candidates)
+        boxes = self.boxes[candidates]
+        hits = (
+            (boxes[:, 0] <= box[2])
+            & (boxes[:, 2] >= box[0])
+            & (boxes[:, 1] <= box[3])
+            & (boxes[:, 3] >= box[1])
+        )
+        return candidates[hits]
+
+    def at(self, x, y):
+        """
+        Returns the indices of the elements under a point in pixels, smallest first.
+        """
+        indices = self.query((x, y, x, y))
+        areas = (self.boxes[indices, 2] - self.boxes[indices, 0]) * (
+            self.boxes[indices, 3] - self.boxes[indices, 1]
+        )
+        return indices[np.argsort(areas, kind="stable")]
+
+    def find_text(self, text, case_sensitive=True):
+        """
+        Returns the index of the last element containing `text`, the same
+        element `get_text_element` picks, or None.
+        """
+        if not case_sensitive:
+            text = text.lower()
+        found = None
+        for index in self.of_source("ocr"):
+            element_text = self.texts[index] if case_sensitive else self.texts[index].lower()
+            if text in element_text:
+                found = int(index)
+        return found
+
+    def center(self, index):
+        """
+        Returns the center of an element as screen percentages, like `get_text_coordinates`.
+        """
+        x1, y1, x2, y2 = self.boxes[index].tolist()
+        return {
+            "x": round((x1 + x2) / 2 / self.image_size[0], 3),
+            "y": round((y1 + y2) / 2 / self.image_size[1], 3),
+        }
+
+    def assign_labels(self):
+        """
+        Numbers the detections for set-of-mark prompting, skipping the ones
+        overlapping an already labeled box.
+
+        Returns:
+        dict: `{"~0": (x1, y1, x2, y2), ...}`.
+        """
+        label_coordinates = {}
+        drawn_boxes = []
+        for index in self.of_source("detector"):
+            box = tuple(self.boxes[index].tolist())
+            if any(is_overlapping(box, drawn) for drawn in drawn_boxes):
+                continue
+            self.label[index] = len(drawn_boxes)
+            label_coordinates["~" + str(len(drawn_boxes))] = box
+            drawn_boxes.append(box)
+        self.fuse_labels()
+        return label_coordinates
+
+    def fuse_labels(self):
+        labeled = np.flatnonzero((self.source == SOURCES.index("detector")) & (self.label >= 0))
+        if not len(labeled):
+            return
+        for index in self.of_source("ocr"):
+            x1, y1, x2, y2 = self.boxes[index]
+            x, y = (x1 + x2) / 2, (y1 + y2) / 2
+            for candidate in self.at(x, y):
+                if candidate in labeled:
+                    self.label[index] = self.label[candidate]
+                    break
+
+    def labels(self):
+        return {
+            "~" + str(self.label[index]): tuple(self.boxes[index].tolist())
+            for index in self.of_source("detector")
+            if self.label[index] >= 0
+        }
+
+    def describe(self, row_height=None):
+        """
+        Lays the text out in reading order, one screen row per line, with the
+        set-of-mark label of each piece of text when it has one.
+        """
+        indices = self.of_source("ocr")
+        if not len(indices):
+            return ""
+        if row_height is None:
+            heights = self.boxes[indices, 3] - self.boxes[indices, 1]
+            row_height = max(1.0, float(np.median(heights)))
+        rows = {}
+        for index in indices:
+            row = int((self.boxes[index, 1] + self.boxes[index, 3]) / 2 // row_height)
+            rows.setdefault(row, []).append(index)
+        lines = []
+        for row in sorted(rows):
+            parts = []
+            for index in sorted(rows[row], key=lambda index: self.boxes[index, 0]):
+                label = f" [~{self.label[index]}]" if self.label[index] >= 0 else ""
+                parts.append(self.texts[index] + label)
+            lines.append(" | ".join(parts))
+        return "\n".join(lines)
+
+    def diff(self, previous):
+        """
+        Compares with the previous frame's map. Elements match when they come
+        from the same source, have the same text and overlap by `MATCH_IOU`.
+
+        Returns:
+        tuple: Indices of the elements added in this map, and of those removed from `previous`.
+        """
+        unmatched = set(range(len(previous)))
+        added = []
+        for index in range(len(self)):
+            candidates = [
+                other
+                for other in previous.query(self.boxes[index])
+                if other in unmatched
+                and previous.source[other] == self.source[index]
+                and previous.texts[other] == self.texts[index]
+            ]
+            if candidates:
+                ious = box_iou(self.boxes[index], previous.boxes[candidates])
+                best = int(np.argmax(ious))
+                if ious[best] >= MATCH_IOU:
+                    unmatched.discard(candidates[best])
+                    continue
+            added.append(index)
+        return added, sorted(unmatched)
+
+
+_frame_key = None
+_current_map = None
+_previous_map = None
+
+
+def get_element_map(screenshot_filename, sources=("ocr",)):
+    """
+    Returns the element map of a screenshot, computing each source at most once per frame.
+
+    Parameters:
+    - screenshot_filename (str): The frame.
+    - sources (tuple): What the map needs, any of `SOURCES`.
+    """
+    # imported here, grounding resolves clicks through this map
+    from operate.utils.detector import get_detector
+    from operate.utils.grounding import read_screen
+
+    global _frame_key, _current_map, _previous_map
+    stat = os.stat(screenshot_filename)
+    frame_key = (screenshot_filename, stat.st_mtime_ns, stat.st_size)
+    if frame_key != _frame_key:
+        with Image.open(screenshot_filename) as img:
+            image_size = img.size
+        _frame_key = frame_key
+        _previous_map, _current_map = _current_map, ElementMap(image_size)
+
+    for source in sources:
+        if source in _current_map.sources:
+            continue
+        if source == "ocr":
+            _current_map.add_ocr(read_screen(screenshot_filename))
+        elif source == "detector":
+            with timed("yolo"), Image.open(screenshot_filename) as img:
+                _current_map.add_detections(get_detector().detect(img.convert("RGB")))
+        else:
+            raise ValueError(f"Unknown element source '{source}'")
+        if config.verbose:
+            print(f"[get_element_map] {source}: {len(_current_map.of_source(source))} elements")
+    return _current_map
+
+
+def get_previous_element_map():
+    """
+    Returns the map of the frame before the current one, for diffing.
+    """
+    return _previous_map
+
+
+def describe_screen(screenshot_filename):
+    """
+    Describes a frame for the model: its text in reading order, then the text
+    that appeared and disappeared since the previous frame.
+    """
+    element_map = get_element_map(screenshot_filename)
+    lines = ["Text on the screen, row by row:", element_map.describe() or "(none)"]
+    previous = get_previous_element_map()
+    if previous is not None and previous.image_size == element_map.image_size:
+        added, removed = element_map.diff(previous)
+        added = [element_map.texts[index] for index in added if element_map.texts[index]]
+        removed = [previous.texts[index] for index in removed if previous.texts[index]]
+        if added or removed:
+            lines.append(f"New since the last screenshot: {' | '.join(added) or '(none)'}")
+            lines.append(f"Gone since the last screenshot: {' | '.join(removed) or '(none)'}")
+        else:
+            lines.append("No text changed since the last screenshot.")
+    return "\n".join(lines)
@@ -0,0 +1,40 @@
+from PIL import Image
+
+
+def screen_fingerprint(image, hash_size=16):
+    """
+    Computes a perceptual difference hash (dHash) of a screenshot.
+
+    Near-identical screens (a blinking cursor, a clock ticking) get fingerprints
+    that differ in only a few bits, so they can be compared with `similarity`.
+
+    Parameters:
+    - image (str or PIL.Image.Image): The screenshot or a path to it.
+    - hash_size (int): Width and height of the hash grid, the hash has hash_size**2 bits.
+
+    Returns:
+    str: The fingerprint as a hex string.
+    """
+    if isinstance(image, str):
+        with Image.open(image) as img:
+            return screen_fingerprint(img, hash_size)
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def similarity(fingerprint_a, fingerprint_b):
+    """
+    Returns the share of matching bits between two fingerprints, from 0.0 to 1.0.
+    """
+    if not fingerprint_a or not fingerprint_b or len(fingerprint_a) != len(fingerprint_b):
+        return 0.0
+    distance = bin(int(fingerprint_a, 16) ^ int(fingerprint_b, 16)).count("1")
+    return 1 - distance / (len(fingerprint_a) * 4)
@@ -0,0 +1,388 @@
+import json
+import os
+import platform
+import time
+
+import numpy as np
+from PIL import Image
+
+from operate.config import Config
+from operate.exceptions import TextNotFoundException
+from operate.utils.fingerprint import screen_fingerprint, similarity
+from operate.utils.element_map import get_element_map, polygon
+from operate.utils.metrics import timed
+from operate.utils.ocr import get_text_coordinates
+from operate.utils.ocr_backends import OCRElement, get_ocr_backend
+from operate.utils.tracing import annotate
+from operate.utils.tiled_ocr import TILE_SIZE, TiledOCR
+
+# Load configuration
+config = Config()
+
+# Minimum similarity between the remembered and the current crop of an element
+CROP_SIMILARITY_THRESHOLD = 0.9
+# Pixels added around an element's box before fingerprinting it
+CROP_PADDING = 4
+# Size of the first region read around a location hint, as a fraction of the screen
+ROI_SIZE = (0.25, 0.12)
+# Growth of the region each time the text isn't found in it
+ROI_WIDENING = (1, 3)
+# Longest side text detection runs at inside a region; recognition keeps full resolution
+ROI_CANVAS_SIZE = 1280
+
+_tiled_ocr = None
+_last_ocr = (None, None)
+# (pid, Xlib display) of the connection `get_active_window` reuses
+_x_display = (None, None)
+
+
+def get_tiled_ocr():
+    """
+    Returns the shared tiled OCR engine, or None when OCR_TILE_SIZE is 0.
+    """
+    global _tiled_ocr
+    tile_size = int(os.getenv("OCR_TILE_SIZE", TILE_SIZE))
+    if tile_size <= 0:
+        return None
+    if _tiled_ocr is None:
+        _tiled_ocr = TiledOCR(get_ocr_backend(), tile_size=tile_size)
+    return _tiled_ocr
+
+
+@timed("ocr")
+def read_screen(screenshot_filename):
+    """
+    Runs OCR on a screenshot. The result for the latest screenshot is kept, so
+    several clicks and checks on the same frame only read it once, and only the
+    tiles that changed since the previous frame are read again.
+    """
+    global _last_ocr
+    stat = os.stat(screenshot_filename)
+    frame_key = (screenshot_filename, stat.st_mtime_ns, stat.st_size)
+    annotate(bytes=stat.st_size, cached=_last_ocr[0] == frame_key)
+    if _last_ocr[0] != frame_key:
+        tiled_ocr = get_tiled_ocr()
+        if tiled_ocr is not None:
+            result = tiled_ocr.readtext(screenshot_filename)
+        else:
+            result = get_ocr_backend().readtext(screenshot_filename)
+        _last_ocr = (frame_key, result)
+    return _last_ocr[1]
+
+
+def get_region_box(center, scale, image_size):
+    half_width = ROI_SIZE[0] * scale * image_size[0] / 2
+    half_height = ROI_SIZE[1] * scale * image_size[1] / 2
+    # coordinates may come from the model as strings
+    x_center = float(center["x"]) * image_size[0]
+    y_center = float(center["y"]) * image_size[1]
+    return (
+        max(0, int(x_center - half_width)),
+        max(0, int(y_center - half_height)),
+        min(image_size[0], int(x_center + half_width)),
+        min(image_size[1], int(y_center + half_height)),
+    )
+
+
+@timed("ocr.region")
+def read_region(screenshot_filename, box):
+    """
+    Runs OCR on one region of a screenshot and returns the result in screenshot pixels.
+    """
+    with Image.open(screenshot_filename) as img:
+        region = np.asarray(img.convert("RGB").crop(box))
+    result = get_ocr_backend().readtext(region, canvas_size=ROI_CANVAS_SIZE)
+    return [
+        OCRElement(
+            [[int(x) + box[0], int(y) + box[1]] for x, y in element_box], text, confidence
+        )
+        for element_box, text, confidence in result
+    ]
+
+
+def find_text(result, text):
+    """
+    Same match as `get_text_element`, without raising when the text is missing.
+    """
+    found_index = None
+    for index, element in enumerate(result):
+        if text in element[1]:
+            found_index = index
+    return found_index
+
+
+def locate_text_near(text, screenshot_filename, hint):
+    """
+    Looks for `text` in a region around `hint`, widening it while the text isn't found.
+
+    Parameters:
+    - text (str): The text to look for.
+    - screenshot_filename (str): The screenshot to read.
+    - hint (dict): Rough location as screen percentages, `{"x": float, "y": float}`.
+
+    Returns:
+    tuple: The OCR result and the index of the text in it, or `(None, None)`.
+    """
+    with Image.open(screenshot_filename) as img:
+        image_size = img.size
+    for scale in ROI_WIDENING:
+        box = get_region_box(hint, scale, image_size)
+        if box[2] <= box[0] or box[3] <= box[1]:
+            continue
+        result = read_region(screenshot_filename, box)
+        index = find_text(result, text)
+        if index is not None:
+            if config.verbose:
+                print(f"[locate_text_near] found {text} around {hint} at scale {scale}")
+            return result, index
+    if config.verbose:
+        print(f"[locate_text_near] {text} not found around {hint}")
+    return None, None
+
+
+def get_x_display():
+    """
+    Returns this process's connection to the X server, opened once. A forked
+    worker opens its own rather than sharing the parent's socket.
+    """
+    global _x_display
+    if _x_display[0] != os.getpid():
+        import Xlib.display
+
+        _x_display = (os.getpid(), Xlib.display.Display())
+    return _x_display[1]
+
+
+def get_active_window():
+    """
+    Returns the identity and geometry of the focused window, or None when it can't be determined.
+
+    Returns:
+    dict: `{"id": str, "title": str, "x": int, "y": int, "width": int, "height": int}`.
+    """
+    global _x_display
+    try:
+        if platform.system() == "Linux":
+            display = get_x_display()
+            root = display.screen().root
+            active_atom = display.intern_atom("_NET_ACTIVE_WINDOW")
+            window_id = root.get_full_property(active_atom, 0).value[0]
+            window = display.create_resource_object("window", window_id)
+            wm_class = window.get_wm_class() or ("", "")
+            name = window.get_full_property(
+                display.intern_atom("_NET_WM_NAME"), display.intern_atom("UTF8_STRING")
+            )
+            title = name.value.decode("utf-8", "replace") if name else window.get_wm_name() or ""
+            geometry = window.get_geometry()
+            position = window.translate_coords(root, 0, 0)
+            return {
+                "id": ".".join(wm_class),
+                "title": title,
+                # translate_coords gives the root origin relative to the window
+                "x": -position.x,
+                "y": -position.y,
+                "width": geometry.width,
+                "height": geometry.height,
+            }
+        import pygetwindow
+
+        window = pygetwindow.getActiveWindow()
+        return {
+            # the title changes with the page, so only the app part of it is used
+            "id": window.title.split(" - ")[-1],
+            "title": window.title,
+            "x": window.left,
+            "y": window.top,
+            "width": window.width,
+            "height": window.height,
+        }
+    except Exception as e:
+        if config.verbose:
+            print("[get_active_window] error:", e)
+        if _x_display[1] is not None and _x_display[0] == os.getpid():
+            # the connection may be broken, reconnect next time
+            try:
+                _x_display[1].close()
+            except Exception:
+                pass
+            _x_display = (None, None)
+        return None
+
+
+def get_crop_box(center, element_size, image_size):
+    x_center = center["x"] * image_size[0]
+    y_center = center["y"] * image_size[1]
+    half_width = element_size[0] / 2 + CROP_PADDING
+    half_height = element_size[1] / 2 + CROP_PADDING
+    return (
+        max(0, int(x_center - half_width)),
+        max(0, int(y_center - half_height)),
+        min(image_size[0], int(x_center + half_width)),
+        min(image_size[1], int(y_center + half_height)),
+    )
+
+
+def crop_fingerprint(screenshot_filename, center, element_size):
+    with Image.open(screenshot_filename) as img:
+        crop = img.crop(get_crop_box(center, element_size, img.size))
+        return screen_fingerprint(crop, hash_size=8), img.size
+
+
+class GroundingCache:
+    """
+    Remembers where text was found in a window with a given position and size.
+
+    A hit is only used after checking that a small crop of the current
+    screenshot at the remembered position still looks like the element did.
+    Changes are kept in memory and written by `save` at the end of a session.
+
+    Attributes:
+        path (str): JSON file the cache is persisted to.
+        max_entries (int): Maximum number of elements remembered.
+    """
+
+    def __init__(self, path="grounding_cache.json", max_entries=2000):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    self.entries = json.load(file)
+            except (OSError, json.JSONDecodeError) as e:
+                print("[GroundingCache] error:", e)
+
+    @staticmethod
+    def make_key(window, text):
+        return f"{window['id']}|{window['x']},{window['y']},{window['width']}x{window['height']}|{text}"
+
+    def lookup(self, window, text, screenshot_filename):
+        entry = self.entries.get(self.make_key(window, text))
+        if entry is None:
+            return None
+
+        fingerprint, image_size = crop_fingerprint(
+            screenshot_filename, entry["coordinates"], entry["element_size"]
+        )
+        if list(image_size) != entry["image_size"] or (
+            similarity(fingerprint, entry["crop"]) < CROP_SIMILARITY_THRESHOLD
+        ):
+            if config.verbose:
+                print("[GroundingCache][lookup] stale entry for", text)
+            return None
+
+        entry["last_used"] = time.time()
+        self.dirty = True
+        return dict(entry["coordinates"])
+
+    def get_position(self, window, text):
+        """
+        Returns where `text` was last seen in the window without checking it's still there.
+        """
+        entry = self.entries.get(self.make_key(window, text))
+        return dict(entry["coordinates"]) if entry else None
+
+    def store(self, window, text, coordinates, box, screenshot_filename):
+        xs = [point[0] for point in box]
+        ys = [point[1] for point in box]
+        # OCR boxes may hold numpy numbers, which json can't write
+        element_size = (float(max(xs) - min(xs)), float(max(ys) - min(ys)))
+        coordinates = {"x": float(coordinates["x"]), "y": float(coordinates["y"])}
+        fingerprint, image_size = crop_fingerprint(
+            screenshot_filename, coordinates, element_size
+        )
+        self.entries[self.make_key(window, text)] = {
+            "coordinates": coordinates,
+            "element_size": element_size,
+            "image_size": list(image_size),
+            "crop": fingerprint,
+            "last_used": time.time(),
+        }
+        if len(self.entries) > self.max_entries:
+            oldest = min(self.entries, key=lambda key: self.entries[key]["last_used"])
+            del self.entries[oldest]
+        self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache if it changed, through a temporary file so a crash
+        can't leave it truncated.
+        """
+        if not self.dirty:
+            return
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file)
+        os.replace(temporary_path, self.path)
+        self.dirty = False
+
+
+_grounding_cache = None
+
+
+def get_grounding_cache():
+    global _grounding_cache
+    if _grounding_cache is None:
+        _grounding_cache = GroundingCache(
+            path=os.getenv("GROUNDING_CACHE_PATH", "grounding_cache.json")
+        )
+    return _grounding_cache
+
+
+def save_grounding_cache():
+    """
+    Persists the grounding cache at the end of a session, if it was used.
+    """
+    if _grounding_cache is not None:
+        try:
+            _grounding_cache.save()
+        except OSError as e:
+            print("[GroundingCache][save] error:", e)
+
+
+@timed("grounding")
+def locate_text(text, screenshot_filename, hint=None):
+    """
+    Finds `text` on the screenshot and returns its center as screen percentages.
+
+    The grounding cache is tried first, keyed by the focused window and the text.
+    On a miss, the region around `hint` (or around the stale cached position) is
+    read before falling back to the whole screen.
+
+    Parameters:
+    - text (str): The text to click.
+    - screenshot_filename (str): The screenshot to read.
+    - hint (dict): Optional rough location as screen percentages, `{"x": float, "y": float}`.
+
+    Raises:
+    TextNotFoundException: If the text is not on the screenshot.
+    """
+    window = get_active_window()
+    grounding_cache = get_grounding_cache()
+    if window is not None:
+        coordinates = grounding_cache.lookup(window, text, screenshot_filename)
+        if coordinates is not None:
+            if config.verbose:
+                print("[locate_text] grounding cache hit", text, coordinates)
+            return coordinates
+        if hint is None:
+            hint = grounding_cache.get_position(window, text)
+
+    result, text_element_index = None, None
+    if hint is not None:
+        result, text_element_index = locate_text_near(text, screenshot_filename, hint)
+    if text_element_index is not None:
+        coordinates = get_text_coordinates(result, text_element_index, screenshot_filename)
+        box = result[text_element_index][0]
+    else:
+        element_map = get_element_map(screenshot_filename)
+        index = element_map.find_text(text)
+        if index is None:
+            raise TextNotFoundException(text)
+        coordinates = element_map.center(index)
+        box = polygon(element_map.boxes[index].tolist())
+
+    if window is not None:
+        grounding_cache.store(window, text, coordinates, box, screenshot_filename)
+    return coordinates
@@ -0,0 +1,87 @@
+from operate.utils.json_repair import loads_with_repair
+
+
+class IncrementalOperationParser:
+    """
+    Parses a JSON array of operations while it is still being streamed.
+
+    Text is passed in with `feed` as it arrives. Every time an object directly
+    inside the top-level array is closed it is decoded and returned, so the
+    caller can act on it before the rest of the array has been generated.
+    Anything before the opening `[` (code fences, prose) is skipped. A single
+    top-level object without an array around it is also accepted, unless
+    `wrapped` is set: then the array sits inside an object, as with structured
+    output's `{"operations": [...]}`, and parsing starts at the first `[`.
+    """
+
+    def __init__(self, wrapped=False):
+        self.wrapped = wrapped
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.finished = False
+        self.object_depth = None
+        self.object_start = None
+        self.operations = []
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of streamed text.
+
+        Parameters:
+        - chunk (str): The next piece of the model's response.
+
+        Returns:
+        list: The operations that were completed by this chunk.
+
+        Raises:
+        ValueError: If a completed operation is not valid JSON.
+        """
+        self.buffer += chunk
+        completed = []
+
+        while self.position < len(self.buffer) and not self.finished:
+            char = self.buffer[self.position]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif not self.started:
+                if char == "[" or (char == "{" and not self.wrapped):
+                    self.started = True
+                    # a bare object is its own top level, an array holds them one level down
+                    self.object_depth = 1 if char == "[" else 0
+                    continue  # handle the bracket again now that we have started
+            elif char == '"':
+                self.in_string = True
+            elif char in "[{":
+                if char == "{" and self.depth == self.object_depth:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char in "]}":
+                self.depth -= 1
+                if char == "}" and self.depth == self.object_depth:
+                    completed.append(self._decode(self.object_start))
+                    self.object_start = None
+                if self.depth == 0:
+                    self.finished = True
+
+            self.position += 1
+
+        return completed
+
+    def _decode(self, start):
+        text = self.buffer[start : self.position + 1]
+        try:
+            operation = loads_with_repair(text)
+        except ValueError as e:
+            raise ValueError(f"Streamed operation is not valid JSON: {text}") from e
+        self.operations.append(operation)
+        return operation
@@ -0,0 +1,174 @@
+import json
+import re
+
+# Python literals models sometimes emit instead of JSON ones
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def extract_json_block(content):
+    """
+    Returns the text from the first `[` or `{` up to its matching bracket, dropping
+    code fences and any prose around it. If the brackets never close, everything
+    after the opening bracket is returned.
+    """
+    start = None
+    for index, char in enumerate(content):
+        if char in "[{":
+            start = index
+            break
+    if start is None:
+        return content.strip()
+
+    depth = 0
+    quote = None
+    escape = False
+    for index in range(start, len(content)):
+        char = content[index]
+        if quote:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote and _closes_string(content, index, quote):
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if depth == 0:
+                return content[start : index + 1]
+    return content[start:]
+
+
+def _closes_string(content, index, quote):
+    """
+    A double quote always closes a string. A single quote only does so when it is
+    followed by something that can come after a value, so `'I'll click'` survives.
+    """
+    if quote == '"':
+        return True
+    rest = content[index + 1 :].lstrip()
+    return not rest or rest[0] in ",:]}"
+
+
+def repair_json(content):
+    """
+    Repairs the common defects in JSON written by a model.
+
+    Handles code fences and prose around the JSON, single-quoted strings, Python
+    literals (`True`, `None`), `//` comments, trailing commas, missing commas
+    between objects, and output that was cut off before closing its strings and
+    brackets.
+
+    Parameters:
+    - content (str): The raw model output.
+
+    Returns:
+    str: Text that `json.loads` is much more likely to accept.
+    """
+    content = extract_json_block(content)
+    output = []
+    stack = []
+    quote = None
+    escape = False
+    index = 0
+
+    while index < len(content):
+        char = content[index]
+
+        if quote:
+            if escape:
+                if char == "'":
+                    # `\'` is not a valid JSON escape
+                    output[-1] = "'"
+                else:
+                    output.append(char)
+                escape = False
+            elif char == "\\":
+                output.append(char)
+                escape = True
+            elif char == quote and _closes_string(content, index, quote):
+                output.append('"')
+                quote = None
+            elif char == '"':
+                # a double quote inside a single-quoted string
+                output.append('\\"')
+            elif char == "\n":
+                output.append("\\n")
+            else:
+                output.append(char)
+        elif char in "\"'":
+            if stack and _last_significant(output) in ("}", "]", '"'):
+                output.append(",")
+            output.append('"')
+            quote = char
+        elif char == "/" and content[index : index + 2] == "//":
+            newline = content.find("\n", index)
+            index = len(content) if newline == -1 else newline
+            continue
+        elif char in "[{":
+            if stack and _last_significant(output) in ("}", "]"):
+                output.append(",")
+            stack.append("]" if char == "[" else "}")
+            output.append(char)
+        elif char in "]}":
+            _strip_trailing_comma(output)
+            if stack:
+                output.append(stack.pop())
+        elif char.isalpha():
+            match = re.match(r"\w+", content[index:])
+            word = match.group(0)
+            if content[index + len(word) :].lstrip().startswith(":"):
+                # unquoted object key
+                output.append(f'"{word}"')
+            else:
+                output.append(PYTHON_LITERALS.get(word, word))
+            index += len(word)
+            continue
+        else:
+            output.append(char)
+        index += 1
+
+    # the output was cut off: close whatever is still open
+    if quote:
+        if escape:
+            output.pop()
+        output.append('"')
+    if stack:
+        _strip_trailing_comma(output)
+        if _last_significant(output) == ":":
+            output.append("null")
+        while stack:
+            output.append(stack.pop())
+
+    return "".join(output)
+
+
+def _last_significant(output):
+    for piece in reversed(output):
+        stripped = piece.strip()
+        if stripped:
+            return stripped[-1]
+    return ""
+
+
+def _strip_trailing_comma(output):
+    while output and not output[-1].strip():
+        output.pop()
+    if output and output[-1] == ",":
+        output.pop()
+
+
+def loads_with_repair(content):
+    """
+    Parses model output as JSON, repairing it locally when it is not valid as-is.
+
+    Raises:
+    json.JSONDecodeError: If the content is still invalid after repair.
+    """
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return json.loads(repair_json(content))
@@ -52,7 +52,7 @@ def is_overlapping(box1, box2):
     return True
 
 
-def add_labels(base64_data, yolo_model):
+def add_labels(base64_data, element_map):
     image_bytes = base64.b64decode(base64_data)
     image_labeled = Image.open(io.BytesIO(image_bytes))  # Corrected this line
     image_debug = image_labeled.copy()  # Create a copy for the debug image
@@ -60,7 +60,8 @@ def add_labels(base64_data, yolo_model):
         image_labeled.copy()
     )  # Copy of the original image for base64 return
 
-    results = yolo_model(image_labeled)
+    # labels are numbered by the element map, see `ElementMap.assign_labels`
+    label_coordinates = element_map.labels()
 
     draw = ImageDraw.Draw(image_labeled)
     debug_draw = ImageDraw.Draw(
@@ -69,49 +70,31 @@ def add_labels(base64_data, yolo_model):
     font_size = 45
 
     labeled_images_dir = "labeled_images"
-    label_coordinates = {}  # Dictionary to store coordinates
 
     if not os.path.exists(labeled_images_dir):
         os.makedirs(labeled_images_dir)
 
-    counter = 0
-    drawn_boxes = []  # List to keep track of boxes already drawn
-    for result in results:
-        if hasattr(result, "boxes"):
-            for det in result.boxes:
-                bbox = det.xyxy[0]
-                x1, y1, x2, y2 = bbox.tolist()
-
-                debug_label = "D_" + str(counter)
-                debug_index_position = (x1, y1 - font_size)
-                debug_draw.rectangle([(x1, y1), (x2, y2)], outline="blue", width=1)
-                debug_draw.text(
-                    debug_index_position,
-                    debug_label,
-                    fill="blue",
-                    font_size=font_size,
-                )
-
-                overlap = any(
-                    is_overlapping((x1, y1, x2, y2), box) for box in drawn_boxes
-                )
-
-                if not overlap:
-                    draw.rectangle([(x1, y1), (x2, y2)], outline="red", width=1)
-                    label = "~" + str(counter)
-                    index_position = (x1, y1 - font_size)
-                    draw.text(
-                        index_position,
-                        label,
-                        fill="red",
-                        font_size=font_size,
-                    )
-
-                    # Add the non-overlapping box to the drawn_boxes list
-                    drawn_boxes.append((x1, y1, x2, y2))
-                    label_coordinates[label] = (x1, y1, x2, y2)
-
-                    counter += 1
+    for counter, index in enumerate(element_map.of_source("detector")):
+        x1, y1, x2, y2 = element_map.boxes[index].tolist()
+        debug_label = "D_" + str(counter)
+        debug_index_position = (x1, y1 - font_size)
+        debug_draw.rectangle([(x1, y1), (x2, y2)], outline="blue", width=1)
+        debug_draw.text(
+            debug_index_position,
+            debug_label,
+            fill="blue",
+            font_size=font_size,
+        )
+
+    for label, (x1, y1, x2, y2) in label_coordinates.items():
+        draw.rectangle([(x1, y1), (x2, y2)], outline="red", width=1)
+        index_position = (x1, y1 - font_size)
+        draw.text(
+            index_position,
+            label,
+            fill="red",
+            font_size=font_size,
+        )
 
     # Save the image
     timestamp = time.strftime("%Y%m%d-%H%M%S")
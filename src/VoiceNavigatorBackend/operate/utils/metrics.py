@@ -0,0 +1,121 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from operate.utils.tracing import span
+
+# Upper bounds of the latency histograms in seconds, from a keypress to a slow model call
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+# stage -> Histogram
+_histograms = {}
+# stage -> {"count": int, "seconds": float} of the session running in this context
+_session_totals = contextvars.ContextVar("session_totals", default=None)
+
+
+class Histogram:
+    """
+    Cumulative latency histogram of one stage, in the shape Prometheus expects.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+def observe(stage, seconds):
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    totals = _session_totals.get()
+    if totals is not None:
+        stage_totals = totals.setdefault(stage, {"count": 0, "seconds": 0.0})
+        stage_totals["count"] += 1
+        stage_totals["seconds"] += seconds
+
+
+@contextmanager
+def timed(stage):
+    """
+    Times a block, or a function when used as a decorator, as one observation of `stage`.
+
+    Stages are dotted names, e.g. `capture`, `request.openai`, `action.click`.
+    Failed blocks are timed too. In traced sessions the block is also a span.
+    """
+    start = time.perf_counter()
+    try:
+        with span(stage, stage.split(".")[0]):
+            yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def start_session_metrics():
+    """
+    Starts collecting per-stage totals for the session running in this thread.
+    """
+    _session_totals.set({})
+
+
+def get_session_metrics():
+    """
+    Returns `{stage: {"count": int, "seconds": float}}` for the current session.
+    """
+    totals = _session_totals.get() or {}
+    return {
+        stage: {"count": values["count"], "seconds": round(values["seconds"], 3)}
+        for stage, values in sorted(totals.items())
+    }
+
+
+def get_histograms():
+    """
+    Returns `{stage: {"bucket_counts": list, "count": int, "sum": float}}` since the process started.
+    """
+    with _lock:
+        return {
+            stage: {
+                "bucket_counts": list(histogram.bucket_counts),
+                "count": histogram.count,
+                "sum": histogram.sum,
+            }
+            for stage, histogram in _histograms.items()
+        }
+
+
+def render_prometheus(histograms=None):
+    """
+    Exports the histograms in the Prometheus text format.
+
+    Parameters:
+    - histograms (dict): What `get_histograms` returns, e.g. summed over workers. This process' by default.
+    """
+    if histograms is None:
+        histograms = get_histograms()
+    lines = [
+        "# HELP operate_stage_seconds Time spent in each stage of the agent loop.",
+        "# TYPE operate_stage_seconds histogram",
+    ]
+    for stage, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, histogram["bucket_counts"]):
+            cumulative += bucket_count
+            lines.append(f'operate_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'operate_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'operate_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+        lines.append(f'operate_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,5 @@
 from operate.config import Config
+from operate.exceptions import TextNotFoundException
 from PIL import Image, ImageDraw
 import os
 from datetime import datetime
@@ -11,7 +12,7 @@ def get_text_element(result, search_text, image_path):
     """
     Searches for a text element in the OCR results and returns its index. Also draws bounding boxes on the image.
     Args:
-        result (list): The list of results returned by EasyOCR.
+        result (list): The OCR results, `OCRElement`s or EasyOCR tuples.
         search_text (str): The text to search for in the OCR results.
         image_path (str): Path to the original image.
 
@@ -60,14 +61,14 @@ def get_text_element(result, search_text, image_path):
 
         return found_index
 
-    raise Exception("The text element was not found in the image")
+    raise TextNotFoundException(search_text)
 
 
 def get_text_coordinates(result, index, image_path):
     """
     Gets the coordinates of the text element at the specified index as a percentage of screen width and height.
     Args:
-        result (list): The list of results returned by EasyOCR.
+        result (list): The OCR results, `OCRElement`s or EasyOCR tuples.
         index (int): The index of the text element in the results list.
         image_path (str): Path to the screenshot image.
 
@@ -0,0 +1,224 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from operate.config import Config
+from operate.utils.vision_worker import RemoteOCRBackend, get_vision_client
+
+# Load configuration
+config = Config()
+
+# One piece of text found on the screen. It unpacks and indexes like the
+# `(box, text, confidence)` tuples EasyOCR returns, so `get_text_element` and
+# `get_text_coordinates` work with any backend. `box` holds the four corners
+# in image pixels, clockwise from the top-left.
+OCRElement = namedtuple("OCRElement", ["box", "text", "confidence"])
+
+# EasyOCR language codes -> Tesseract ones
+TESSERACT_LANGUAGES = {
+    "en": "eng",
+    "de": "deu",
+    "fr": "fra",
+    "es": "spa",
+    "it": "ita",
+    "pt": "por",
+    "ja": "jpn",
+    "ko": "kor",
+    "ch_sim": "chi_sim",
+    "ch_tra": "chi_tra",
+}
+
+
+def load_image(image):
+    """
+    Returns an RGB array for a file path, a PIL image or an array.
+    """
+    if isinstance(image, str):
+        with Image.open(image) as img:
+            return np.asarray(img.convert("RGB"))
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert("RGB"))
+    return image
+
+
+def rectangle(left, top, width, height):
+    right, bottom = left + width, top + height
+    return [[left, top], [right, top], [right, bottom], [left, bottom]]
+
+
+class OCRBackend:
+    """
+    Interface of the OCR engines. The engine is only loaded on the first read.
+
+    Attributes:
+        name (str): The name the backend is registered under.
+        languages (tuple): Language codes to read, in EasyOCR's notation.
+    """
+
+    name = None
+    install_hint = None
+
+    def __init__(self, languages=("en",)):
+        self.languages = tuple(languages)
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            if config.verbose:
+                print(f"[OCRBackend] loading {self.name} for {', '.join(self.languages)}")
+            try:
+                self._engine = self.load()
+            except ImportError:
+                raise ImportError(
+                    f"The '{self.name}' OCR backend needs extra packages. "
+                    f"Please install them using '{self.install_hint}'"
+                )
+        return self._engine
+
+    def load(self):
+        raise NotImplementedError
+
+    def readtext(self, image, **kwargs):
+        """
+        Reads the text on an image.
+
+        Parameters:
+        - image (str, PIL.Image or numpy.ndarray): The image, as a path or RGB pixels.
+        - kwargs: Engine specific options, ignored by the engines that don't know them.
+
+        Returns:
+        list: `OCRElement`s in reading order.
+        """
+        raise NotImplementedError
+
+    def readtext_batched(self, images, **kwargs):
+        kwargs.pop("batch_size", None)
+        return [self.readtext(image, **kwargs) for image in images]
+
+
+class EasyOCRBackend(OCRBackend):
+    name = "easyocr"
+    install_hint = "pip install easyocr"
+
+    def load(self):
+        import easyocr
+
+        return easyocr.Reader(list(self.languages))
+
+    def readtext(self, image, **kwargs):
+        if not isinstance(image, str):
+            image = load_image(image)
+        return [OCRElement(*element) for element in self.engine.readtext(image, **kwargs)]
+
+    def readtext_batched(self, images, **kwargs):
+        images = [image if isinstance(image, str) else load_image(image) for image in images]
+        return [
+            [OCRElement(*element) for element in result]
+            for result in self.engine.readtext_batched(images, **kwargs)
+        ]
+
+
+class TesseractBackend(OCRBackend):
+    name = "tesseract"
+    install_hint = "pip install -r requirements-ocr.txt"
+
+    def load(self):
+        import pytesseract
+
+        return pytesseract
+
+    def readtext(self, image, **kwargs):
+        pytesseract = self.engine
+        language = "+".join(TESSERACT_LANGUAGES.get(code, code) for code in self.languages)
+        data = pytesseract.image_to_data(
+            Image.fromarray(load_image(image)),
+            lang=language,
+            output_type=pytesseract.Output.DICT,
+        )
+
+        # Tesseract reports words, EasyOCR reports lines: merge the words of each line
+        lines = {}
+        for index, word in enumerate(data["text"]):
+            confidence = float(data["conf"][index])
+            if not word.strip() or confidence < 0:
+                continue
+            key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+            lines.setdefault(key, []).append(index)
+
+        elements = []
+        for indices in lines.values():
+            left = min(data["left"][i] for i in indices)
+            top = min(data["top"][i] for i in indices)
+            right = max(data["left"][i] + data["width"][i] for i in indices)
+            bottom = max(data["top"][i] + data["height"][i] for i in indices)
+            elements.append(
+                OCRElement(
+                    rectangle(left, top, right - left, bottom - top),
+                    " ".join(data["text"][i] for i in indices),
+                    sum(float(data["conf"][i]) for i in indices) / len(indices) / 100,
+                )
+            )
+        return elements
+
+
+class RapidOCRBackend(OCRBackend):
+    """
+    PaddleOCR's detection and recognition models exported to ONNX, run with onnxruntime.
+    """
+
+    name = "rapidocr"
+    install_hint = "pip install -r requirements-ocr.txt"
+
+    def load(self):
+        from rapidocr_onnxruntime import RapidOCR
+
+        return RapidOCR()
+
+    def readtext(self, image, **kwargs):
+        result, _ = self.engine(load_image(image))
+        return [
+            OCRElement([[int(x), int(y)] for x, y in box], text, float(confidence))
+            for box, text, confidence in result or []
+        ]
+
+
+OCR_BACKENDS = {
+    backend.name: backend for backend in (EasyOCRBackend, TesseractBackend, RapidOCRBackend)
+}
+
+_backends = {}
+
+
+def get_ocr_languages():
+    return tuple(os.getenv("OCR_LANGUAGES", "en").split(","))
+
+
+def get_ocr_backend(name=None, languages=None):
+    """
+    Returns the shared instance of an OCR backend.
+
+    Parameters:
+    - name (str): One of `OCR_BACKENDS`, OCR_BACKEND (default "easyocr") when None.
+    - languages (tuple): Language codes, OCR_LANGUAGES (default "en") when None.
+
+    With VISION_WORKER_SOCKET set, OCR runs in the vision worker instead.
+
+    Raises:
+    ValueError: If the backend is unknown.
+    """
+    vision_client = get_vision_client()
+    if vision_client is not None:
+        return RemoteOCRBackend(vision_client)
+    name = (name or os.getenv("OCR_BACKEND", "easyocr")).lower()
+    languages = tuple(languages or get_ocr_languages())
+    if name not in OCR_BACKENDS:
+        raise ValueError(
+            f"Unknown OCR backend '{name}', use one of: {', '.join(OCR_BACKENDS)}"
+        )
+    key = (name, languages)
+    if key not in _backends:
+        _backends[key] = OCR_BACKENDS[name](languages)
+    return _backends[key]
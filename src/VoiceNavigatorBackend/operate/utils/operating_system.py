@@ -1,13 +1,17 @@
-import pyautogui
 import platform
 import time
 import math
 
+from operate.utils.metrics import timed
 from operate.utils.misc import convert_percent_to_decimal
 
 
 class OperatingSystem:
+    @timed("action.write")
     def write(self, content):
+        # pyautogui needs a display as soon as it is imported
+        import pyautogui
+
         try:
             content = content.replace("\\n", "\n")
             for char in content:
@@ -15,7 +19,10 @@ class OperatingSystem:
         except Exception as e:
             print("[OperatingSystem][write] error:", e)
 
+    @timed("action.press")
     def press(self, keys):
+        import pyautogui
+
         try:
             for key in keys:
                 pyautogui.keyDown(key)
@@ -25,6 +32,7 @@ class OperatingSystem:
         except Exception as e:
             print("[OperatingSystem][press] error:", e)
 
+    @timed("action.click")
     def mouse(self, click_detail):
         try:
             x = convert_percent_to_decimal(click_detail.get("x"))
@@ -44,6 +52,8 @@ class OperatingSystem:
         circle_radius=50,
         circle_duration=0.5,
     ):
+        import pyautogui
+
         try:
             screen_width, screen_height = pyautogui.size()
             x_pixel = int(screen_width * float(x_percentage))
@@ -61,3 +71,26 @@ class OperatingSystem:
             pyautogui.click(x_pixel, y_pixel)
         except Exception as e:
             print("[OperatingSystem][click_at_percentage] error:", e)
+
+
+_operating_system = None
+
+
+def get_operating_system():
+    """
+    Returns the operating system the actions are sent to, the desktop unless
+    `set_operating_system` replaced it.
+    """
+    global _operating_system
+    if _operating_system is None:
+        _operating_system = OperatingSystem()
+    return _operating_system
+
+
+def set_operating_system(operating_system):
+    """
+    Sends the actions to `operating_system` instead, e.g. a simulated desktop.
+    None goes back to the desktop.
+    """
+    global _operating_system
+    _operating_system = operating_system
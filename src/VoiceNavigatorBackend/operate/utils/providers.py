@@ -0,0 +1,36 @@
+import importlib
+import time
+
+# provider -> (module of its SDK, package to install it)
+PROVIDER_SDKS = {
+    "openai": ("openai", "openai"),
+    "anthropic": ("anthropic", "anthropic"),
+    "google": ("google.generativeai", "google-generativeai"),
+    "ollama": ("ollama", "ollama"),
+}
+
+_sdks = {}
+# provider -> seconds its SDK took to import
+load_times = {}
+
+
+def load_sdk(provider):
+    """
+    Imports the SDK of a provider the first time the provider is used, so
+    starting the CLI or the server doesn't pay for every SDK.
+
+    Raises:
+    ImportError: If the SDK isn't installed.
+    """
+    if provider not in _sdks:
+        module_name, package = PROVIDER_SDKS[provider]
+        start = time.perf_counter()
+        try:
+            _sdks[provider] = importlib.import_module(module_name)
+        except ImportError as e:
+            raise ImportError(
+                f"The {provider} provider requires the '{package}' package. "
+                f"Please install it using 'pip install {package}'"
+            ) from e
+        load_times[provider] = time.perf_counter() - start
+    return _sdks[provider]
@@ -0,0 +1,124 @@
+import importlib.util
+import os
+import sys
+import time
+import traceback
+
+from operate.config import Config
+
+# Load configuration
+config = Config()
+
+# Components the production server can load up front, see `preload`
+PRELOADABLE = ("ocr", "yolo", "openai", "anthropic", "google", "ollama")
+# Components whose models the production server loads before forking, so the
+# workers share them copy-on-write
+MODEL_COMPONENTS = ("ocr", "yolo")
+
+_state = {
+    "ready": False,
+    "started_at": time.time(),
+    "components": {},
+}
+
+
+def load_component(component):
+    # imported here, these are exactly the imports worth preloading
+    if component == "ocr":
+        from operate.utils.ocr_backends import get_ocr_backend
+
+        get_ocr_backend().engine
+    elif component == "yolo":
+        from operate.utils.detector import get_detector
+
+        get_detector()
+    elif component in ("openai", "anthropic", "google", "ollama"):
+        from operate.utils.providers import load_sdk
+
+        load_sdk(component)
+    else:
+        raise ValueError(
+            f"Unknown component '{component}', use any of: {', '.join(PRELOADABLE)}"
+        )
+
+
+def preload(components):
+    """
+    Loads models and SDKs up front so requests never pay for them.
+
+    A component that fails to load is reported by `get_state` and keeps the
+    process from being ready.
+
+    Parameters:
+    - components (list): Names from `PRELOADABLE`.
+
+    Returns:
+    bool: Whether every component loaded.
+    """
+    loaded = True
+    for component in components:
+        start = time.perf_counter()
+        try:
+            load_component(component)
+            _state["components"][component] = {
+                "loaded": True,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+        except Exception as e:
+            loaded = False
+            _state["components"][component] = {"loaded": False, "error": str(e)}
+            print(f"[preload] {component} failed: {e}")
+            if config.verbose:
+                traceback.print_exc()
+    return loaded
+
+
+def is_fork_safe(component):
+    """
+    Whether a component loaded before a fork still works in the forked workers.
+
+    onnxruntime starts a session's thread pool when the session is created, and
+    a fork leaves that pool behind, so the ONNX backends load after forking.
+    """
+    if component == "ocr":
+        return os.getenv("OCR_BACKEND", "easyocr").lower() != "rapidocr"
+    if component == "yolo":
+        return os.getenv("YOLO_BACKEND", "ultralytics").lower() != "onnx"
+    return True
+
+
+def limit_threads_before_fork():
+    """
+    Keeps torch single threaded in the parent, so it never starts an OpenMP pool
+    the forked workers would inherit broken.
+    """
+    if importlib.util.find_spec("torch") is None:
+        return
+    import torch
+
+    torch.set_num_threads(1)
+
+
+def restore_threads_after_fork(workers):
+    """
+    Gives each forked worker its share of the cores for torch, TORCH_THREADS
+    when set. The worker starts its own OpenMP pool on its first inference.
+    """
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return
+    threads = int(os.getenv("TORCH_THREADS", 0)) or max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(threads)
+
+
+def set_ready(ready=True):
+    _state["ready"] = ready
+
+
+def get_state():
+    return {
+        "ready": _state["ready"],
+        "pid": os.getpid(),
+        "uptime": round(time.time() - _state["started_at"], 3),
+        "components": _state["components"],
+    }
@@ -0,0 +1,279 @@
+import asyncio
+import random
+import threading
+import time
+import traceback
+
+from operate.config import Config
+from operate.exceptions import (
+    CircuitOpenException,
+    ModelNotRecognizedException,
+    RetryExhaustedException,
+    TextNotFoundException,
+)
+from operate.utils.style import ANSI_BRIGHT_MAGENTA, ANSI_GREEN, ANSI_RED, ANSI_RESET
+from operate.utils.tracing import span
+
+# Load configuration
+config = Config()
+
+# HTTP status codes that will not get better by asking again
+NON_RETRYABLE_STATUS_CODES = {400, 401, 403, 404, 422}
+# Errors raised on this side of the request, which asking the provider again won't fix
+LOCAL_ERRORS = (ModelNotRecognizedException, TextNotFoundException)
+
+
+class RetryPolicy:
+    """
+    Retry settings for a single provider.
+
+    Attributes:
+        max_attempts (int): Total number of attempts, including the first one.
+        base_delay (float): Backoff before the second attempt, in seconds.
+        max_delay (float): Upper bound for a single backoff, in seconds.
+        latency_budget (float): Wall-time budget for all attempts of one step, in seconds.
+        failure_threshold (int): Consecutive failures before the circuit opens.
+        reset_timeout (float): Seconds an open circuit waits before a trial request.
+    """
+
+    def __init__(
+        self,
+        max_attempts=3,
+        base_delay=1.0,
+        max_delay=20.0,
+        latency_budget=120.0,
+        failure_threshold=5,
+        reset_timeout=60.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_budget = latency_budget
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+
+RETRY_POLICIES = {
+    "openai": RetryPolicy(),
+    "anthropic": RetryPolicy(latency_budget=180.0),
+    "google": RetryPolicy(),
+    # local models are slow to answer but rarely rate limited
+    "ollama": RetryPolicy(max_attempts=2, latency_budget=300.0),
+}
+
+# Which provider serves each `-m` model
+MODEL_PROVIDERS = {
+    "gpt-4": "openai",
+    "gpt-4-with-som": "openai",
+    "gpt-4-with-ocr": "openai",
+    "o1-with-ocr": "openai",
+    "gemini-pro-vision": "google",
+    "llava": "ollama",
+    "claude-3": "anthropic",
+}
+
+
+def get_provider(model):
+    provider = MODEL_PROVIDERS.get(model)
+    if provider is None:
+        raise ModelNotRecognizedException(model)
+    return provider
+
+
+class CircuitBreaker:
+    """
+    Stops calling a provider after repeated failures.
+
+    The circuit is `closed` while calls succeed. After `failure_threshold`
+    consecutive provider failures (see `is_provider_failure`) it becomes `open`
+    and rejects calls until `reset_timeout` has passed, then lets a single
+    trial call through (`half-open`) and rejects the others until it ends.
+    """
+
+    def __init__(self, provider, failure_threshold, reset_timeout):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == "open":
+                retry_in = self.reset_timeout - (time.monotonic() - self.opened_at)
+                raise CircuitOpenException(self.provider, retry_in)
+            if state == "half-open":
+                if self.trial_running:
+                    raise CircuitOpenException(self.provider, 0.0, "Circuit half-open, trial call running")
+                self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if config.verbose:
+                    print(f"[CircuitBreaker] {self.provider} circuit opened")
+            self.trial_running = False
+
+    def record_error(self, error):
+        """
+        Records a failed call: only provider failures count against the circuit,
+        other errors just end a trial call without deciding it.
+        """
+        if is_provider_failure(error):
+            self.record_failure()
+        else:
+            with self.lock:
+                self.trial_running = False
+
+
+_circuit_breakers = {}
+
+
+def get_circuit_breaker(provider):
+    if provider not in _circuit_breakers:
+        policy = RETRY_POLICIES[provider]
+        _circuit_breakers[provider] = CircuitBreaker(
+            provider, policy.failure_threshold, policy.reset_timeout
+        )
+    return _circuit_breakers[provider]
+
+
+def get_status_code(error):
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+
+def get_retry_after(error):
+    """
+    Returns the delay in seconds the provider asked for in a `retry-after` header, or None.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers.get("retry-after-ms")) / 1000
+        if headers.get("retry-after"):
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        # `retry-after` may also be an HTTP date, which we treat as "no hint"
+        return None
+    return None
+
+
+def is_provider_failure(error):
+    """
+    Whether an error says the provider is unwell: a connection error, a
+    timeout, a 429 or a 5xx. Rejected requests, malformed model output and
+    local errors say nothing about the provider's health.
+    """
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # the SDKs' own transport errors, e.g. openai.APIConnectionError and APITimeoutError,
+    # matched by name so the SDKs don't have to be imported here
+    return any(
+        "Connection" in cls.__name__ or "Timeout" in cls.__name__ for cls in type(error).__mro__
+    )
+
+
+def is_retryable(error):
+    if isinstance(error, LOCAL_ERRORS):
+        return False
+    return get_status_code(error) not in NON_RETRYABLE_STATUS_CODES
+
+
+def compute_backoff(policy, attempt, error=None):
+    """
+    Full-jitter exponential backoff, unless the provider told us how long to wait.
+    """
+    retry_after = get_retry_after(error) if error is not None else None
+    if retry_after is not None:
+        return min(retry_after, policy.max_delay)
+    ceiling = min(policy.max_delay, policy.base_delay * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling)
+
+
+async def call_with_retry(provider, func, messages):
+    """
+    Calls `func` under the retry policy and circuit breaker of `provider`.
+
+    Parameters:
+    - provider (str): Key into `RETRY_POLICIES`.
+    - func (callable): Zero-argument callable returning the operations, or a coroutine that does.
+    - messages (list): The message history `func` appends to; it is rolled back after a failed attempt.
+
+    Returns:
+    The value returned by `func`.
+
+    Raises:
+    CircuitOpenException: If the provider's circuit is open.
+    RetryExhaustedException: If every attempt failed or the latency budget ran out.
+    """
+    policy = RETRY_POLICIES[provider]
+    breaker = get_circuit_breaker(provider)
+    start_time = time.monotonic()
+    history_length = len(messages)
+    attempt = 0
+
+    while True:
+        breaker.before_call()
+        attempt += 1
+        try:
+            with span("attempt", "retry", provider=provider, attempt=attempt):
+                result = func()
+                if asyncio.iscoroutine(result):
+                    result = await result
+            breaker.record_success()
+            return result
+        except Exception as e:
+            breaker.record_error(e)
+            # drop the half-built turn so the next attempt starts from a clean history
+            del messages[history_length:]
+
+            if config.verbose:
+                print(f"[call_with_retry] {provider} attempt {attempt} failed", e)
+                traceback.print_exc()
+
+            if not is_retryable(e) or attempt >= policy.max_attempts:
+                raise RetryExhaustedException(provider, attempt, e) from e
+
+            delay = compute_backoff(policy, attempt, e)
+            elapsed = time.monotonic() - start_time
+            if elapsed + delay > policy.latency_budget:
+                print(
+                    f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[{provider}] Latency budget of {policy.latency_budget:.0f}s exceeded {ANSI_RESET}"
+                )
+                raise RetryExhaustedException(provider, attempt, e) from e
+
+            print(
+                f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[{provider}] That did not work. Trying again in {delay:.1f}s {ANSI_RESET}",
+                e,
+            )
+            with span("backoff", "retry", provider=provider, delay=round(delay, 3)):
+                await asyncio.sleep(delay)
@@ -1,17 +1,37 @@
 import os
 import platform
 import subprocess
-import pyautogui
 from PIL import Image, ImageDraw, ImageGrab
 import Xlib.display
 import Xlib.X
 import Xlib.Xutil  # not sure if Xutil is necessary
 
+from operate.utils.metrics import timed
 
+# Callable writing the next frame to a path, used instead of the desktop when set
+_screen_source = None
+
+
+def set_screen_source(source):
+    """
+    Captures frames with `source(file_path)` instead of the desktop, e.g. to
+    replay recorded screenshots. None goes back to the desktop.
+    """
+    global _screen_source
+    _screen_source = source
+
+
+@timed("capture")
 def capture_screen_with_cursor(file_path):
+    if _screen_source is not None:
+        _screen_source(file_path)
+        return
+
     user_platform = platform.system()
 
     if user_platform == "Windows":
+        import pyautogui  # needs a display as soon as it is imported
+
         screenshot = pyautogui.screenshot()
         screenshot.save(file_path)
     elif user_platform == "Linux":
@@ -0,0 +1,271 @@
+"""
+A scripted desktop drawn with PIL, so whole sessions can run on a machine
+without a display.
+
+A scenario describes the screens: each has a title and elements. Buttons go
+to another screen when clicked, fields take the keystrokes once clicked, and
+enter sends the focused field's text to the screen its `submit` routes it to.
+Escape goes back to the previous screen.
+
+    desktop = SimulatedDesktop()
+    set_screen_source(desktop.render)
+    set_operating_system(SimulatedOperatingSystem(desktop))
+
+The scenario's `solution` lists the operations that move on from each screen,
+which lets a fake model play it.
+"""
+import json
+
+from PIL import Image, ImageDraw, ImageFont
+
+from operate.config import Config
+from operate.utils.metrics import timed
+from operate.utils.operating_system import OperatingSystem
+
+# Load configuration
+config = Config()
+
+DEFAULT_SIZE = (1280, 800)
+FONT_SIZE = 20
+TITLE_BAR_HEIGHT = 40
+COLORS = {
+    "background": (236, 239, 244),
+    "title_bar": (46, 52, 64),
+    "title": (236, 239, 244),
+    "button": (94, 129, 172),
+    "button_text": (255, 255, 255),
+    "field": (255, 255, 255),
+    "field_border": (76, 86, 106),
+    "focus": (191, 97, 106),
+    "placeholder": (140, 140, 140),
+    "text": (30, 30, 30),
+}
+
+DEFAULT_SCENARIO = {
+    "objective": "Open the information page of example.com",
+    "start": "desktop",
+    "goal": "information",
+    "screens": {
+        "desktop": {
+            "title": "Desktop",
+            "elements": [
+                {"type": "button", "text": "Browser", "box": [40, 80, 220, 130], "goto": "browser"},
+                {"type": "button", "text": "Settings", "box": [40, 160, 220, 210], "goto": "settings"},
+            ],
+        },
+        "browser": {
+            "title": "Browser",
+            "elements": [
+                {"type": "field", "name": "address", "text": "Search or type a URL", "box": [120, 70, 1000, 115]},
+                {"type": "button", "text": "Close", "box": [1080, 70, 1240, 115], "goto": "desktop"},
+            ],
+            "submit": {"field": "address", "routes": {"example.com": "example"}, "default": "not_found"},
+        },
+        "example": {
+            "title": "Example Domain",
+            "elements": [
+                {"type": "label", "text": "This domain is for use in documentation examples", "box": [120, 200, 1000, 240]},
+                {"type": "button", "text": "More information", "box": [120, 280, 400, 330], "goto": "information"},
+            ],
+        },
+        "not_found": {
+            "title": "Page not found",
+            "elements": [{"type": "button", "text": "Back", "box": [120, 200, 280, 250], "goto": "browser"}],
+        },
+        "settings": {
+            "title": "Settings",
+            "elements": [{"type": "button", "text": "Close", "box": [1080, 70, 1240, 115], "goto": "desktop"}],
+        },
+        "information": {
+            "title": "Example Domains",
+            "elements": [{"type": "label", "text": "Reserved for documentation", "box": [120, 200, 800, 240]}],
+        },
+    },
+    "solution": {
+        "desktop": [{"operation": "click", "text": "Browser"}],
+        "browser": [
+            {"operation": "click", "text": "Search or type a URL"},
+            {"operation": "write", "content": "example.com"},
+            {"operation": "press", "keys": ["enter"]},
+        ],
+        "example": [{"operation": "click", "text": "More information"}],
+        "not_found": [{"operation": "click", "text": "Back"}],
+        "settings": [{"operation": "click", "text": "Close"}],
+        "information": [{"operation": "done", "summary": "Opened the example domain's information page"}],
+    },
+}
+
+
+def load_scenario(path=None):
+    if path is None:
+        return DEFAULT_SCENARIO
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def load_font(size=FONT_SIZE):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+class SimulatedDesktop:
+    """
+    The state of a scripted desktop, changed by clicks and keystrokes.
+
+    Attributes:
+        scenario (dict): Screens, see `DEFAULT_SCENARIO`.
+        size (tuple): `(width, height)` of the screen in pixels.
+        screen (str): The current screen.
+        focus (str): Name of the focused field, or None.
+        values (dict): Text typed in each field, by `(screen, field)`.
+        actions (int): Actions received since the last reset.
+    """
+
+    def __init__(self, scenario=None, size=DEFAULT_SIZE):
+        self.scenario = scenario or DEFAULT_SCENARIO
+        self.size = tuple(size)
+        self.font = load_font()
+        self.reset()
+
+    def reset(self):
+        self.screen = self.scenario["start"]
+        self.history = []
+        self.focus = None
+        self.values = {}
+        self.actions = 0
+
+    @property
+    def elements(self):
+        return self.scenario["screens"][self.screen]["elements"]
+
+    @property
+    def reached_goal(self):
+        return self.screen == self.scenario.get("goal")
+
+    def go_to(self, screen):
+        if config.verbose:
+            print("[SimulatedDesktop] screen", self.screen, "->", screen)
+        self.history.append(self.screen)
+        self.screen = screen
+        self.focus = None
+
+    def element_at(self, x, y):
+        # later elements are drawn on top
+        for element in reversed(self.elements):
+            x1, y1, x2, y2 = element["box"]
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                return element
+        return None
+
+    def click(self, x, y):
+        self.actions += 1
+        element = self.element_at(x, y)
+        self.focus = None
+        if element is None:
+            return
+        if element["type"] == "button":
+            self.go_to(element["goto"])
+        elif element["type"] == "field":
+            self.focus = element["name"]
+
+    def type_text(self, content):
+        self.actions += 1
+        if self.focus is not None:
+            key = (self.screen, self.focus)
+            self.values[key] = self.values.get(key, "") + content
+
+    def press(self, keys):
+        self.actions += 1
+        keys = [key.lower() for key in keys]
+        if keys == ["enter"] or keys == ["return"]:
+            self.submit()
+        elif keys == ["backspace"] and self.focus is not None:
+            key = (self.screen, self.focus)
+            self.values[key] = self.values.get(key, "")[:-1]
+        elif keys == ["escape"] or keys == ["esc"]:
+            if self.history:
+                self.screen = self.history.pop()
+                self.focus = None
+
+    def submit(self):
+        submit = self.scenario["screens"][self.screen].get("submit")
+        if submit is None or self.focus != submit["field"]:
+            return
+        value = self.values.pop((self.screen, self.focus), "").strip()
+        self.go_to(submit["routes"].get(value, submit["default"]))
+
+    def render(self, file_path=None):
+        """
+        Draws the current screen, and saves it when given a path, which makes
+        this method a screen source.
+
+        Returns:
+        PIL.Image: The screen.
+        """
+        image = Image.new("RGB", self.size, COLORS["background"])
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, 0, self.size[0], TITLE_BAR_HEIGHT), fill=COLORS["title_bar"])
+        title = self.scenario["screens"][self.screen]["title"]
+        draw.text((16, TITLE_BAR_HEIGHT // 2), title, font=self.font, fill=COLORS["title"], anchor="lm")
+
+        for element in self.elements:
+            x1, y1, x2, y2 = element["box"]
+            text, color = element.get("text", ""), COLORS["text"]
+            if element["type"] == "button":
+                draw.rectangle((x1, y1, x2, y2), fill=COLORS["button"])
+                color = COLORS["button_text"]
+            elif element["type"] == "field":
+                focused = self.focus == element["name"]
+                border = COLORS["focus"] if focused else COLORS["field_border"]
+                draw.rectangle((x1, y1, x2, y2), fill=COLORS["field"], outline=border, width=2)
+                value = self.values.get((self.screen, element["name"]))
+                text, color = (value, COLORS["text"]) if value else (text, COLORS["placeholder"])
+            draw.text((x1 + 12, (y1 + y2) // 2), text, font=self.font, fill=color, anchor="lm")
+
+        if file_path is not None:
+            image.save(file_path)
+        return image
+
+    def solution(self, click_target="text"):
+        """
+        Returns the operations that move on from the current screen, with
+        clicks on text, or on coordinates for models that click coordinates.
+        """
+        operations = []
+        for operation in self.scenario["solution"].get(self.screen, []):
+            operation = dict(operation, thought=f"Scripted step on {self.screen}")
+            if operation["operation"] == "click" and click_target == "coordinates":
+                element = next(
+                    element for element in self.elements if element.get("text") == operation["text"]
+                )
+                x1, y1, x2, y2 = element["box"]
+                operation["x"] = str(round((x1 + x2) / 2 / self.size[0], 3))
+                operation["y"] = str(round((y1 + y2) / 2 / self.size[1], 3))
+                del operation["text"]
+            operations.append(operation)
+        return operations
+
+
+class SimulatedOperatingSystem(OperatingSystem):
+    """
+    Sends the loop's actions to a `SimulatedDesktop` instead of pyautogui.
+    Actions are timed under the same stages as on a real desktop.
+    """
+
+    def __init__(self, desktop):
+        self.desktop = desktop
+
+    @timed("action.write")
+    def write(self, content):
+        self.desktop.type_text(content.replace("\\n", "\n"))
+
+    @timed("action.press")
+    def press(self, keys):
+        self.desktop.press(keys)
+
+    def click_at_percentage(self, x_percentage, y_percentage, **kwargs):
+        width, height = self.desktop.size
+        self.desktop.click(float(x_percentage) * width, float(y_percentage) * height)
@@ -0,0 +1,327 @@
+"""
+A local stand-in for the OpenAI, Anthropic and Ollama APIs that records real
+responses to a cassette and replays them offline.
+
+    python -m operate.utils.standin --cassette cassettes/session.json --mode record
+    python -m operate.utils.standin --cassette cassettes/session.json --latency recorded --error-rate 0.1
+
+Point the backend at it with the variables the SDKs already read:
+
+    OPENAI_API_BASE_URL=http://127.0.0.1:8100/v1
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8100
+    OLLAMA_HOST=http://127.0.0.1:8100
+
+Requests are matched to recorded ones by endpoint, model and text: images
+change on every run, so they are left out of the match. A request nothing
+matches gets the next unplayed response recorded for its endpoint. OpenAI
+streams are answered from the full recorded response, cut into chunks.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from operate.config import Config
+
+# Load configuration
+config = Config()
+
+DEFAULT_PORT = 8100
+# path -> provider
+ENDPOINTS = {
+    "/v1/chat/completions": "openai",
+    "/chat/completions": "openai",
+    "/v1/messages": "anthropic",
+    "/api/chat": "ollama",
+}
+# provider -> path of its endpoint on the real API
+UPSTREAM_PATHS = {
+    "openai": "/v1/chat/completions",
+    "anthropic": "/v1/messages",
+    "ollama": "/api/chat",
+}
+DEFAULT_UPSTREAMS = {
+    "openai": "https://api.openai.com",
+    "anthropic": "https://api.anthropic.com",
+    "ollama": "http://127.0.0.1:11434",
+}
+# Request headers not forwarded upstream
+HOP_HEADERS = {"host", "content-length", "accept-encoding", "connection"}
+# Characters per chunk of a replayed stream
+STREAM_CHUNK_SIZE = 16
+
+
+def get_texts(value):
+    """
+    Collects the texts of messages, leaving out their images.
+    """
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [text for item in value for text in get_texts(item)]
+    if isinstance(value, dict):
+        if "text" in value:
+            return get_texts(value["text"])
+        if "content" in value:
+            return get_texts(value["content"])
+    return []
+
+
+def get_request_key(provider, body):
+    digest = hashlib.sha256()
+    digest.update(provider.encode())
+    digest.update(str(body.get("model")).encode())
+    for text in get_texts(body.get("messages", [])) + get_texts(body.get("system", "")):
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Cassette:
+    """
+    Recorded provider responses, saved as JSON after each recording.
+
+    Attributes:
+        path (str): The cassette file.
+        interactions (list): `{"provider", "key", "request", "status", "response", "seconds"}` dicts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.interactions = []
+        self.played = set()
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.interactions = json.load(file)["interactions"]
+
+    def find(self, provider, key):
+        with self.lock:
+            candidates = [
+                index
+                for index, interaction in enumerate(self.interactions)
+                if interaction["provider"] == provider and index not in self.played
+            ]
+            matches = [index for index in candidates if self.interactions[index]["key"] == key]
+            if not matches:
+                # an earlier match may be played again, e.g. when a step is retried
+                matches = [
+                    index
+                    for index, interaction in enumerate(self.interactions)
+                    if interaction["provider"] == provider and interaction["key"] == key
+                ]
+            index = (matches or candidates or [None])[0]
+            if index is None:
+                return None
+            self.played.add(index)
+            return self.interactions[index]
+
+    def add(self, interaction):
+        with self.lock:
+            self.interactions.append(interaction)
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.path, "w", encoding="utf-8") as file:
+                json.dump({"version": 1, "interactions": self.interactions}, file, indent=1)
+
+
+def get_error_body(provider, status, message):
+    if provider == "anthropic":
+        return {"type": "error", "error": {"type": "api_error", "message": message}}
+    if provider == "ollama":
+        return {"error": message}
+    return {"error": {"message": message, "type": "server_error", "code": status}}
+
+
+def get_stream_events(response, include_usage=False):
+    """
+    Cuts a recorded chat completion into the server-sent events of a stream.
+    """
+    content = response["choices"][0]["message"].get("content") or ""
+    chunk = {
+        "id": response.get("id", "standin"),
+        "object": "chat.completion.chunk",
+        "created": response.get("created", int(time.time())),
+        "model": response.get("model"),
+    }
+    pieces = [content[i : i + STREAM_CHUNK_SIZE] for i in range(0, len(content), STREAM_CHUNK_SIZE)]
+    for piece in pieces:
+        yield dict(chunk, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+    yield dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if include_usage and response.get("usage"):
+        yield dict(chunk, choices=[], usage=response["usage"])
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Answers provider requests from the server's cassette, see `make_server`.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if config.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        provider = ENDPOINTS.get(path)
+        length = int(self.headers.get("content-length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if provider is None:
+            return self.send_json(404, {"error": f"Unknown endpoint {path}"})
+
+        options = self.server.options
+        if options["error_rate"] and random.random() < options["error_rate"]:
+            status = random.choice(options["error_statuses"])
+            return self.send_json(
+                status, get_error_body(provider, status, "Error injected by the stand-in"), {"retry-after": "0"}
+            )
+
+        key = get_request_key(provider, body)
+        if options["mode"] == "record":
+            interaction = self.record(provider, body, key)
+            if interaction is None:
+                return
+        else:
+            interaction = self.server.cassette.find(provider, key)
+            if interaction is None:
+                message = f"No recorded {provider} response left in {self.server.cassette.path}"
+                return self.send_json(500, get_error_body(provider, 500, message))
+
+        latency = options["latency"]
+        time.sleep(interaction["seconds"] if latency == "recorded" else float(latency))
+
+        if body.get("stream") and provider == "openai":
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            return self.send_stream(get_stream_events(interaction["response"], include_usage))
+        self.send_json(interaction["status"], interaction["response"])
+
+    def record(self, provider, body, key):
+        """
+        Forwards a request upstream and records the response. Streams are
+        requested whole and cut into chunks on the way back.
+        """
+        upstream_body = dict(body)
+        if provider in ("openai", "ollama"):
+            upstream_body["stream"] = False
+            upstream_body.pop("stream_options", None)
+        headers = {
+            name: value for name, value in self.headers.items() if name.lower() not in HOP_HEADERS
+        }
+        request = urllib.request.Request(
+            self.server.options["upstreams"][provider] + UPSTREAM_PATHS[provider],
+            data=json.dumps(upstream_body).encode(),
+            headers=headers,
+            method="POST",
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=600) as upstream:
+                status, response = upstream.status, json.loads(upstream.read())
+        except urllib.error.HTTPError as e:
+            # errors are passed on, not recorded
+            self.send_raw(e.code, e.read(), e.headers.get("content-type", "application/json"))
+            return None
+        interaction = {
+            "provider": provider,
+            "key": key,
+            "request": {"model": body.get("model"), "texts": get_texts(body.get("messages", []))[-2:]},
+            "status": status,
+            "response": response,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        self.server.cassette.add(interaction)
+        print(f"[standin] recorded {provider} {body.get('model')} in {interaction['seconds']}s")
+        return dict(interaction, seconds=0)
+
+    def send_raw(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, body, headers=None):
+        self.send_raw(status, json.dumps(body).encode(), "application/json", headers)
+
+    def send_stream(self, events):
+        data = b"".join(f"data: {json.dumps(event)}\n\n".encode() for event in events)
+        self.send_raw(200, data + b"data: [DONE]\n\n", "text/event-stream")
+
+
+def make_server(host, port, cassette_path, mode="replay", latency="0", error_rate=0.0, error_statuses=(429, 500, 503), upstreams=None):
+    """
+    Creates the stand-in server, call `serve_forever` on it.
+
+    Parameters:
+    - cassette_path (str): Cassette to replay from, or to record to.
+    - mode (str): "replay" answers from the cassette, "record" forwards to the real APIs.
+    - latency (str): Seconds added to each response, or "recorded" to wait as long as the real API did.
+    - error_rate (float): Share of requests answered with one of `error_statuses` instead.
+    - upstreams (dict): Base URL of each provider's real API when recording.
+    """
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.cassette = Cassette(cassette_path)
+    server.options = {
+        "mode": mode,
+        "latency": latency,
+        "error_rate": error_rate,
+        "error_statuses": list(error_statuses),
+        "upstreams": dict(DEFAULT_UPSTREAMS, **(upstreams or {})),
+    }
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay the model providers' APIs locally.")
+    parser.add_argument("--cassette", required=True, help="JSON file of recorded responses")
+    parser.add_argument("--mode", choices=("replay", "record"), default="replay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--latency",
+        default="0",
+        help='Seconds added to each response, or "recorded" to replay the real latency',
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail")
+    parser.add_argument("--error-statuses", default="429,500,503", help="Comma separated statuses of the failures")
+    parser.add_argument("--seed", type=int, help="Seed of the injected errors")
+    for provider, url in DEFAULT_UPSTREAMS.items():
+        parser.add_argument(f"--{provider}-upstream", default=url, help=f"Real {provider} API when recording")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    if args.latency != "recorded":
+        float(args.latency)  # fails early on a typo
+    if args.seed is not None:
+        random.seed(args.seed)
+    config.verbose = args.verbose
+
+    server = make_server(
+        args.host,
+        args.port,
+        args.cassette,
+        mode=args.mode,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_statuses=[int(status) for status in args.error_statuses.split(",")],
+        upstreams={provider: getattr(args, f"{provider}_upstream").rstrip("/") for provider in DEFAULT_UPSTREAMS},
+    )
+    print(
+        f"[standin] {args.mode} {args.cassette} ({len(server.cassette.interactions)} responses) "
+        f"on http://{args.host}:{args.port}"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+
+from operate.utils.style import ANSI_BRIGHT_MAGENTA, ANSI_GREEN, ANSI_RED, ANSI_RESET
+
+# Modules whose import makes up the cold start of the CLI and of the server
+STARTUP_MODULES = ("operate.operate", "app")
+# Cold start budget in milliseconds, override with STARTUP_BUDGET_MS
+DEFAULT_STARTUP_BUDGET_MS = 1500
+
+
+def measure_imports(module):
+    """
+    Imports `module` in a fresh interpreter with `-X importtime`.
+
+    Returns:
+    tuple: The total import time in milliseconds, and the cumulative
+    milliseconds of each top-level package it pulled in.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.getcwd(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # nested imports are indented under the module that imported them
+        if name.startswith("  "):
+            continue
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(cumulative) / 1000
+    return sum(packages.values()), packages
+
+
+def profile_startup(top=15, budget_ms=None):
+    """
+    Prints what importing the CLI and the server costs, heaviest packages first.
+
+    Returns:
+    bool: Whether every startup stayed within the budget.
+    """
+    budget_ms = budget_ms or float(os.getenv("STARTUP_BUDGET_MS", DEFAULT_STARTUP_BUDGET_MS))
+    within_budget = True
+    for module in STARTUP_MODULES:
+        try:
+            total, packages = measure_imports(module)
+        except RuntimeError as e:
+            print(f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_RED}[Error] importing {module}: {e}{ANSI_RESET}")
+            within_budget = False
+            continue
+
+        color = ANSI_GREEN if total <= budget_ms else ANSI_RED
+        print(f"{ANSI_BRIGHT_MAGENTA}import {module}: {color}{total:.0f} ms{ANSI_RESET} (budget {budget_ms:.0f} ms)")
+        for package, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            print(f"  {cumulative:8.1f} ms  {package}")
+        within_budget = within_budget and total <= budget_ms
+    return within_budget
@@ -0,0 +1,201 @@
+import hashlib
+
+import numpy as np
+from PIL import Image
+
+from operate.config import Config
+from operate.utils.ocr_backends import OCRElement
+
+# Load configuration
+config = Config()
+
+# Side of the square tiles a frame is split into
+TILE_SIZE = 640
+# Pixels neighbouring tiles share, so a word on a tile edge is whole in one of them
+TILE_OVERLAP = 96
+# A detection this close to a tile's inner left or right edge may be a cut line
+EDGE_MARGIN = 2
+# Pixels added above and below the rows read again across the whole frame
+ROW_PADDING = 4
+# Dirty tiles read by the detector at once
+TILE_BATCH_SIZE = 8
+
+
+def get_tiles(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Splits a frame into overlapping tiles.
+
+    Each tile owns the part of the frame closest to it (its "core"), so a
+    detection found in two overlapping tiles is only kept by one of them.
+
+    Returns:
+    list: `(box, core)` pairs, both `(left, top, right, bottom)` in frame pixels.
+    """
+    step = tile_size - overlap
+    tiles = []
+    for top in range(0, max(height - overlap, 1), step):
+        for left in range(0, max(width - overlap, 1), step):
+            right = min(left + tile_size, width)
+            bottom = min(top + tile_size, height)
+            core = (
+                left + overlap // 2 if left > 0 else 0,
+                top + overlap // 2 if top > 0 else 0,
+                right - overlap // 2 if right < width else width,
+                bottom - overlap // 2 if bottom < height else height,
+            )
+            tiles.append(((left, top, right, bottom), core))
+    return tiles
+
+
+def box_center(box):
+    xs = [point[0] for point in box]
+    ys = [point[1] for point in box]
+    return (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+
+
+class TiledOCR:
+    """
+    Reads text from consecutive frames, only running OCR where the frame changed.
+
+    Frames are split into overlapping tiles. A tile whose pixels hash the same
+    as in the previous frame reuses its detections; the changed tiles are read
+    together with `readtext_batched`. The engines read whole lines, which can
+    be longer than the overlap, so a row with a detection reaching a tile's
+    inner left or right edge is read again across the whole frame width and
+    replaces the tiles' detections on it. The result is one list of
+    `OCRElement`s with boxes in frame pixels, so it works with
+    `get_text_element` and `get_text_coordinates`.
+
+    Attributes:
+        reader (OCRBackend): The backend used on the changed tiles.
+        tile_size (int): Side of the tiles in pixels.
+        overlap (int): Pixels shared by neighbouring tiles.
+    """
+
+    def __init__(self, reader, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+        self.reader = reader
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.frame_size = None
+        # tile box -> (pixel digest, detections owned by the tile, rows cut by its edges)
+        self.tiles = {}
+        # row band -> (pixel digest, detections read across the frame)
+        self.rows = {}
+
+    def readtext(self, image_path):
+        with Image.open(image_path) as img:
+            frame = np.asarray(img.convert("RGB"))
+        height, width = frame.shape[:2]
+        if self.frame_size != (width, height):
+            # the tile grid depends on the frame size
+            self.frame_size = (width, height)
+            self.tiles = {}
+            self.rows = {}
+
+        tiles = get_tiles(width, height, self.tile_size, self.overlap)
+        dirty = []
+        for box, core in tiles:
+            left, top, right, bottom = box
+            pixels = frame[top:bottom, left:right]
+            digest = hashlib.blake2b(pixels.tobytes(), digest_size=16).hexdigest()
+            cached = self.tiles.get(box)
+            if cached is None or cached[0] != digest:
+                dirty.append((box, core, digest, pixels))
+
+        if config.verbose:
+            print(f"[TiledOCR][readtext] reading {len(dirty)} of {len(tiles)} tiles")
+
+        for start in range(0, len(dirty), TILE_BATCH_SIZE):
+            batch = dirty[start : start + TILE_BATCH_SIZE]
+            results = self.reader.readtext_batched(
+                [self.pad(pixels) for _, _, _, pixels in batch],
+                batch_size=len(batch),
+            )
+            for (box, core, digest, _), result in zip(batch, results):
+                self.tiles[box] = (digest, *self.to_frame(result, box, core, width))
+
+        detections = []
+        cut_rows = []
+        for box, _ in tiles:
+            detections.extend(self.tiles[box][1])
+            cut_rows.extend(self.tiles[box][2])
+        if not cut_rows:
+            return detections
+
+        rows = self.merge_rows(cut_rows, height)
+        detections = [
+            detection
+            for detection in detections
+            if not any(top <= box_center(detection.box)[1] < bottom for top, bottom in rows)
+        ]
+        for top, bottom in rows:
+            detections.extend(self.read_row(frame, top, bottom))
+        return detections
+
+    def read_row(self, frame, top, bottom):
+        """
+        Reads a band of the frame across its whole width, reusing the last read when its pixels didn't change.
+        """
+        pixels = frame[top:bottom]
+        digest = hashlib.blake2b(pixels.tobytes(), digest_size=16).hexdigest()
+        cached = self.rows.get((top, bottom))
+        if cached is None or cached[0] != digest:
+            if config.verbose:
+                print(f"[TiledOCR][read_row] reading rows {top}-{bottom} across the frame")
+            detections = [
+                OCRElement([[int(x), int(y) + top] for x, y in box], text, float(confidence))
+                for box, text, confidence in self.reader.readtext(pixels)
+            ]
+            cached = (digest, detections)
+            self.rows[(top, bottom)] = cached
+        return cached[1]
+
+    @staticmethod
+    def merge_rows(cut_rows, height):
+        """
+        Pads the cut rows and merges the ones that overlap into `(top, bottom)` bands.
+        """
+        rows = []
+        for top, bottom in sorted(cut_rows):
+            top, bottom = max(top - ROW_PADDING, 0), min(bottom + ROW_PADDING, height)
+            if rows and top <= rows[-1][1]:
+                rows[-1] = (rows[-1][0], max(rows[-1][1], bottom))
+            else:
+                rows.append((top, bottom))
+        return rows
+
+    def pad(self, pixels):
+        # batched detection needs tiles of the same size
+        height, width = pixels.shape[:2]
+        if (width, height) == (self.tile_size, self.tile_size):
+            return pixels
+        return np.pad(
+            pixels,
+            ((0, self.tile_size - height), (0, self.tile_size - width), (0, 0)),
+            constant_values=255,
+        )
+
+    @staticmethod
+    def to_frame(result, box, core, width):
+        """
+        Moves a tile's detections into frame pixels and keeps those centered in the tile's core.
+
+        Returns:
+        tuple: The kept detections, and the `(top, bottom)` rows of the detections
+        reaching the tile's left or right edge inside the frame.
+        """
+        left, top, right = box[0], box[1], box[2]
+        detections = []
+        cut_rows = []
+        for element_box, text, confidence in result:
+            element_box = [[int(x) + left, int(y) + top] for x, y in element_box]
+            xs = [point[0] for point in element_box]
+            ys = [point[1] for point in element_box]
+            if (left > 0 and min(xs) <= left + EDGE_MARGIN) or (
+                right < width and max(xs) >= right - EDGE_MARGIN
+            ):
+                cut_rows.append((min(ys), max(ys)))
+            x, y = box_center(element_box)
+            if core[0] <= x < core[2] and core[1] <= y < core[3]:
+                detections.append(OCRElement(element_box, text, float(confidence)))
+        return detections, cut_rows
@@ -0,0 +1,171 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from operate.config import Config
+
+# Load configuration
+config = Config()
+
+TRACES_DIR = "traces"
+# Share of sessions traced, override with TRACE_SAMPLE_RATE (0 turns tracing off)
+DEFAULT_SAMPLE_RATE = 0.1
+
+# The tracer of the session running in this context, None when it isn't sampled
+_tracer = contextvars.ContextVar("tracer", default=None)
+
+
+class Tracer:
+    """
+    Collects the spans of one session as Chrome trace events.
+
+    The saved file opens in chrome://tracing, Perfetto (ui.perfetto.dev) or any
+    viewer of the Trace Event Format. Spans are "complete" events, so nesting
+    comes from their times on the same thread.
+
+    Attributes:
+        session_id (str): The session being traced.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.origin = time.perf_counter()
+        self.started_at = time.time()
+        self.pid = os.getpid()
+        self.events = []
+        self.stack = []
+        self.step = None
+
+    def now(self):
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def begin(self, name, category, args):
+        span = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round(self.now(), 1),
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        self.stack.append(span)
+        return span
+
+    def end(self, span):
+        span["dur"] = round(self.now() - span["ts"], 1)
+        if span in self.stack:
+            self.stack.remove(span)
+        self.events.append(span)
+
+    def next_step(self, index):
+        """
+        Closes the span of the previous loop iteration and opens the next one.
+        """
+        if self.step is not None:
+            self.end(self.step)
+        self.step = self.begin("step", "loop", {"index": index})
+
+    def to_dict(self):
+        metadata = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self.pid,
+                "args": {"name": f"operate {self.session_id}"},
+            }
+        ]
+        return {
+            "traceEvents": metadata + sorted(self.events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"session_id": self.session_id, "started_at": self.started_at},
+        }
+
+    def save(self):
+        if self.step is not None:
+            self.end(self.step)
+            self.step = None
+        # spans still open when the session ended, e.g. after an error
+        for span in list(self.stack):
+            span["args"]["unfinished"] = True
+            self.end(span)
+
+        if not os.path.exists(TRACES_DIR):
+            os.makedirs(TRACES_DIR)
+        path = os.path.join(TRACES_DIR, f"{self.session_id}.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file)
+        if config.verbose:
+            print("[Tracer][save] trace saved at:", path)
+        return path
+
+
+def start_trace(session_id, sample_rate=None):
+    """
+    Starts tracing the session running in this context, if it is sampled.
+
+    Returns:
+    Tracer: The session's tracer, or None when the session isn't traced.
+    """
+    if sample_rate is None:
+        sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", DEFAULT_SAMPLE_RATE))
+    tracer = Tracer(session_id) if random.random() < sample_rate else None
+    _tracer.set(tracer)
+    return tracer
+
+
+def trace_step(index):
+    tracer = _tracer.get()
+    if tracer is not None:
+        tracer.next_step(index)
+
+
+def finish_trace():
+    """
+    Saves the running session's trace and stops tracing.
+
+    Returns:
+    str: The path of the saved trace, or None if the session wasn't traced.
+    """
+    tracer = _tracer.get()
+    _tracer.set(None)
+    if tracer is None:
+        return None
+    return tracer.save()
+
+
+@contextmanager
+def span(name, category="operate", **args):
+    """
+    Traces a block, or a function when used as a decorator. Costs next to
+    nothing when the session isn't traced.
+
+    Yields:
+    dict: The span's arguments, to add details to.
+    """
+    tracer = _tracer.get()
+    if tracer is None:
+        yield {}
+        return
+    record = tracer.begin(name, category, args)
+    try:
+        yield record["args"]
+    except Exception as e:
+        record["args"]["error"] = f"{type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        tracer.end(record)
+
+
+def annotate(**args):
+    """
+    Adds details to the innermost open span.
+    """
+    tracer = _tracer.get()
+    if tracer is not None and tracer.stack:
+        tracer.stack[-1]["args"].update(args)
+
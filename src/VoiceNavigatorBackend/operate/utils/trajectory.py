@@ -0,0 +1,144 @@
+import contextvars
+import json
+import os
+import time
+import uuid
+
+from operate.config import Config
+
+# Load configuration
+config = Config()
+
+TRAJECTORIES_DIR = "trajectories"
+
+# Operation keys worth keeping, everything else (e.g. `macro`, `expect`) is dropped
+RECORDED_KEYS = ("operation", "thought", "keys", "content", "summary", "text", "label", "x", "y")
+
+
+class TrajectoryRecorder:
+    """
+    Records a session as a compact trajectory that can be replayed without a model.
+
+    Each step is one iteration of the agent loop. Each operation is stored with
+    the fingerprint of the frame it was executed on, its resolved click
+    coordinates and how long it took.
+
+    Attributes:
+        session_id (str): The session being recorded.
+        objective (str): The user's objective.
+        model (str): The model that chose the operations.
+    """
+
+    def __init__(self, session_id, objective, model):
+        self.session_id = session_id
+        self.objective = objective
+        self.model = model
+        self.started_at = time.time()
+        self.start_time = time.monotonic()
+        self.steps = []
+
+    def next_step(self):
+        if self.steps:
+            self.steps[-1]["duration"] = time.monotonic() - self.steps[-1]["_start"]
+        self.steps.append(
+            {
+                "index": len(self.steps),
+                "_start": time.monotonic(),
+                "operations": [],
+            }
+        )
+
+    def record_operation(self, operation, frame_fingerprint, started_at, duration):
+        if not self.steps:
+            self.next_step()
+        recorded = {key: operation[key] for key in RECORDED_KEYS if key in operation}
+        recorded["frame"] = frame_fingerprint
+        recorded["started_at"] = round(started_at - self.start_time, 3)
+        recorded["duration"] = round(duration, 3)
+        self.steps[-1]["operations"].append(recorded)
+
+    def to_dict(self):
+        steps = []
+        for step in self.steps:
+            step = dict(step)
+            start = step.pop("_start")
+            step.setdefault("duration", time.monotonic() - start)
+            step["duration"] = round(step["duration"], 3)
+            steps.append(step)
+        return {
+            "session_id": self.session_id,
+            "objective": self.objective,
+            "model": self.model,
+            "created_at": self.started_at,
+            "duration": round(time.monotonic() - self.start_time, 3),
+            "steps": steps,
+        }
+
+    def save(self):
+        if not os.path.exists(TRAJECTORIES_DIR):
+            os.makedirs(TRAJECTORIES_DIR)
+        path = get_trajectory_path(self.session_id)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file)
+        if config.verbose:
+            print("[TrajectoryRecorder][save] trajectory saved at:", path)
+        return path
+
+
+# TrajectoryRecorder of the session running in this context
+_recorder = contextvars.ContextVar("trajectory_recorder", default=None)
+
+
+def get_trajectory_path(session_id):
+    """
+    Returns where a session's trajectory is saved.
+
+    Raises:
+    ValueError: If `session_id` is not a UUID, so it can't name any other file.
+    """
+    if not isinstance(session_id, str):
+        raise ValueError(f"Invalid session ID {session_id!r}")
+    return os.path.join(TRAJECTORIES_DIR, f"{uuid.UUID(session_id)}.json")
+
+
+def start_trajectory(session_id, objective, model):
+    recorder = TrajectoryRecorder(session_id, objective, model)
+    _recorder.set(recorder)
+    return recorder
+
+
+def get_trajectory_recorder():
+    """
+    Returns the recorder of the running session, or None outside of a session.
+    """
+    return _recorder.get()
+
+
+def finish_trajectory():
+    """
+    Saves the running session's trajectory and stops recording.
+
+    Returns:
+    str: The path of the saved trajectory, or None if nothing was recorded.
+    """
+    recorder = _recorder.get()
+    _recorder.set(None)
+    if recorder is None or not recorder.steps:
+        return None
+    return recorder.save()
+
+
+def load_trajectory(session_id):
+    """
+    Loads the trajectory recorded for a session.
+
+    Raises:
+    ValueError: If `session_id` is not a UUID.
+    FileNotFoundError: If nothing was recorded for it.
+    """
+    return load_trajectory_file(get_trajectory_path(session_id))
+
+
+def load_trajectory_file(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
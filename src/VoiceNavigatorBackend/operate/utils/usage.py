@@ -0,0 +1,380 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from operate.config import Config
+from operate.exceptions import BudgetExceededException
+from operate.utils.style import ANSI_BRIGHT_MAGENTA, ANSI_GREEN, ANSI_RESET
+from operate.utils.tracing import annotate
+
+# Load configuration
+config = Config()
+
+# USD per million input and output tokens of each provider model, list prices
+# as of 2024-10. USAGE_PRICES overrides them with JSON, e.g. '{"gpt-4o": [2.5, 10]}'
+PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "o1": (15.0, 60.0),
+    "claude-3-opus-20240229": (15.0, 75.0),
+    "claude-3-haiku-20240307": (0.25, 1.25),
+    "gemini-pro-vision": (0.5, 1.5),
+    "llava": (0.0, 0.0),
+}
+# Cheaper model each provider model is swapped for once a session is downgraded
+DOWNGRADE_MODELS = {
+    "gpt-4o": "gpt-4o-mini",
+    "o1": "gpt-4o",
+    "claude-3-opus-20240229": "claude-3-haiku-20240307",
+}
+# Screenshots are sent at this scale once a session is downgraded
+DOWNGRADE_IMAGE_SCALE = 0.5
+# Share of a budget at which the session is downgraded, it's stopped at the full budget
+DOWNGRADE_AT = 0.8
+# Budget name -> environment variable holding its default
+BUDGET_VARIABLES = {
+    "tokens": "USAGE_BUDGET_TOKENS",
+    "cost": "USAGE_BUDGET_COST",
+    "image_bytes": "USAGE_BUDGET_IMAGE_BYTES",
+}
+
+_lock = threading.Lock()
+# PRICES with the USAGE_PRICES overrides, see `get_prices`
+_prices = None
+# provider -> totals since the process started
+_provider_totals = {}
+# SessionUsage of the session running in this context
+_session_usage = contextvars.ContextVar("session_usage", default=None)
+
+
+def new_totals():
+    return {
+        "requests": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "request_bytes": 0,
+        "image_bytes": 0,
+        "seconds": 0.0,
+        "cost": 0.0,
+    }
+
+
+def add_totals(totals, record):
+    totals["requests"] += 1
+    for key in ("input_tokens", "output_tokens", "request_bytes", "image_bytes", "seconds", "cost"):
+        totals[key] += record[key]
+
+
+def rounded(totals):
+    return dict(totals, seconds=round(totals["seconds"], 3), cost=round(totals["cost"], 6))
+
+
+def get_payload_size(messages):
+    """
+    Measures a message history the way it is sent.
+
+    Returns:
+    tuple: Bytes of text and bytes of images (base64 for OpenAI and Anthropic,
+    the files for Ollama).
+    """
+    text_bytes = image_bytes = 0
+    for message in messages:
+        content = message.get("content")
+        items = content if isinstance(content, list) else [{"type": "text", "text": content}]
+        for item in items:
+            if not isinstance(item, dict):
+                text_bytes += len(str(item).encode("utf-8"))
+            elif item.get("type") == "image_url":
+                image_bytes += len(item["image_url"]["url"])
+            elif item.get("type") == "image":
+                image_bytes += len(item["source"]["data"])
+            else:
+                text_bytes += len(str(item.get("text") or "").encode("utf-8"))
+        for path in message.get("images") or []:
+            if os.path.exists(path):
+                image_bytes += os.path.getsize(path)
+    return text_bytes, image_bytes
+
+
+def get_token_counts(response):
+    """
+    Reads the input and output token counts of any provider's response, or of
+    the `usage` of the final chunk of an OpenAI stream.
+
+    Returns:
+    tuple: `(input_tokens, output_tokens)`, zeros when the provider didn't say.
+    """
+    if response is None:
+        return 0, 0
+    if isinstance(response, dict):
+        # ollama
+        return response.get("prompt_eval_count") or 0, response.get("eval_count") or 0
+    usage = getattr(response, "usage", None) or getattr(response, "usage_metadata", None) or response
+    for input_name, output_name in (
+        ("prompt_tokens", "completion_tokens"),  # openai
+        ("input_tokens", "output_tokens"),  # anthropic
+        ("prompt_token_count", "candidates_token_count"),  # google
+        ("prompt_eval_count", "eval_count"),  # ollama
+    ):
+        if getattr(usage, input_name, None) is not None:
+            return getattr(usage, input_name) or 0, getattr(usage, output_name, None) or 0
+    return 0, 0
+
+
+def get_prices():
+    """
+    Returns `PRICES` with the overrides of USAGE_PRICES, read once.
+    """
+    global _prices
+    if _prices is None:
+        prices = dict(PRICES)
+        overrides = os.getenv("USAGE_PRICES")
+        if overrides:
+            try:
+                prices.update(
+                    {model: (float(price[0]), float(price[1])) for model, price in json.loads(overrides).items()}
+                )
+            except (ValueError, TypeError, IndexError, AttributeError) as e:
+                print(f"[get_prices] ignoring USAGE_PRICES: {e}")
+        _prices = prices
+    return _prices
+
+
+def get_cost(model, input_tokens, output_tokens):
+    input_price, output_price = get_prices().get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def get_budget(overrides=None):
+    """
+    Returns the session budget, `{"tokens": int, "cost": float, "image_bytes": int}`
+    with None for no limit. Defaults come from USAGE_BUDGET_TOKENS,
+    USAGE_BUDGET_COST (USD) and USAGE_BUDGET_IMAGE_BYTES.
+    """
+    overrides = overrides or {}
+    budget = {}
+    for name, variable in BUDGET_VARIABLES.items():
+        value = overrides.get(name, os.getenv(variable))
+        budget[name] = float(value) if value not in (None, "") else None
+    return budget
+
+
+class SessionUsage:
+    """
+    What one session sent to and got back from the providers.
+
+    Attributes:
+        budget (dict): Limits from `get_budget`.
+        total (dict): Totals of every request.
+        providers (dict): Totals per provider.
+        requests (list): One record per request.
+        downgraded (bool): Whether the session moved to cheaper models and smaller screenshots.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.total = new_totals()
+        self.providers = {}
+        self.requests = []
+        self.downgraded = False
+
+    def add(self, record):
+        self.requests.append(record)
+        add_totals(self.total, record)
+        add_totals(self.providers.setdefault(record["provider"], new_totals()), record)
+
+    def used(self, name):
+        if name == "tokens":
+            return self.total["input_tokens"] + self.total["output_tokens"]
+        return self.total[name]
+
+    def exceeded(self, share=1.0):
+        """
+        Returns the first budget whose `share` is used up, or None.
+        """
+        for name, limit in self.budget.items():
+            if limit is not None and self.used(name) >= limit * share:
+                return name
+        return None
+
+    def to_dict(self):
+        return {
+            "total": rounded(self.total),
+            "providers": {provider: rounded(totals) for provider, totals in sorted(self.providers.items())},
+            "requests": self.requests,
+            "budget": self.budget,
+            "downgraded": self.downgraded,
+        }
+
+
+def start_session_usage(budget=None):
+    """
+    Starts accounting the requests of the session running in this context.
+
+    Parameters:
+    - budget (dict): Overrides of the environment's budget, see `get_budget`.
+    """
+    usage = SessionUsage(get_budget(budget))
+    _session_usage.set(usage)
+    return usage
+
+
+def get_session_usage():
+    usage = _session_usage.get()
+    return usage.to_dict() if usage is not None else None
+
+
+def get_model_name(model):
+    """
+    Returns the provider model to call, the cheaper one once the session is downgraded.
+    """
+    usage = _session_usage.get()
+    if usage is not None and usage.downgraded:
+        return DOWNGRADE_MODELS.get(model, model)
+    return model
+
+
+def get_image_scale():
+    usage = _session_usage.get()
+    return DOWNGRADE_IMAGE_SCALE if usage is not None and usage.downgraded else 1.0
+
+
+def enforce_budget():
+    """
+    Checked before each step: downgrades the session once `DOWNGRADE_AT` of a
+    budget is used and stops it once the whole budget is.
+
+    Raises:
+    BudgetExceededException: If a budget is used up.
+    """
+    usage = _session_usage.get()
+    if usage is None:
+        return
+    name = usage.exceeded()
+    if name is not None:
+        raise BudgetExceededException(name, usage.used(name), usage.budget[name])
+    if not usage.downgraded and usage.exceeded(DOWNGRADE_AT) is not None:
+        usage.downgraded = True
+        print(
+            f"{ANSI_GREEN}[Self-Operating Computer]{ANSI_BRIGHT_MAGENTA}[budget] Switching to cheaper models and smaller screenshots {ANSI_RESET}"
+        )
+
+
+class Meter:
+    """
+    One request being accounted, see `metered`.
+
+    Attributes:
+        provider (str): The provider called.
+        model (str): The provider model to call, downgraded if needed.
+        response: Set to the provider's response, or to the `usage` of a stream.
+    """
+
+    def __init__(self, provider, model):
+        self.provider = provider
+        self.model = get_model_name(model)
+        self.response = None
+
+
+@contextmanager
+def metered(provider, model, messages=(), image_bytes=0):
+    """
+    Accounts the request made in the block, failed ones included.
+
+    Parameters:
+    - provider (str): The provider called, e.g. "openai".
+    - model (str): The provider model, e.g. "gpt-4o". Call `meter.model` instead,
+      it is the cheaper model once the session is downgraded.
+    - messages (list): The message history sent.
+    - image_bytes (int): Images sent besides the messages.
+
+    Yields:
+    Meter: Set its `response` to the provider's response.
+    """
+    meter = Meter(provider, model)
+    text_bytes, message_image_bytes = get_payload_size(messages)
+    start = time.perf_counter()
+    try:
+        yield meter
+    finally:
+        input_tokens, output_tokens = get_token_counts(meter.response)
+        record = {
+            "provider": provider,
+            "model": meter.model,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "request_bytes": text_bytes + message_image_bytes + image_bytes,
+            "image_bytes": message_image_bytes + image_bytes,
+            "seconds": round(time.perf_counter() - start, 3),
+            "cost": get_cost(meter.model, input_tokens, output_tokens),
+        }
+        with _lock:
+            add_totals(_provider_totals.setdefault(provider, new_totals()), record)
+        usage = _session_usage.get()
+        if usage is not None:
+            usage.add(record)
+        annotate(**{key: record[key] for key in ("model", "input_tokens", "output_tokens", "request_bytes", "image_bytes")})
+        if config.verbose:
+            print("[metered]", record)
+
+
+def get_provider_totals():
+    """
+    Returns `{provider: totals}` since the process started.
+    """
+    with _lock:
+        return {provider: dict(totals) for provider, totals in _provider_totals.items()}
+
+
+def render_prometheus(provider_totals=None):
+    """
+    Exports the per-provider totals in the Prometheus text format, each family's
+    samples under its own HELP and TYPE. Bytes are split into text and image
+    kinds, so their sum is what was sent.
+
+    Parameters:
+    - provider_totals (dict): What `get_provider_totals` returns, e.g. summed over workers. This process' by default.
+    """
+    if provider_totals is None:
+        provider_totals = get_provider_totals()
+    providers = sorted(provider_totals.items())
+
+    families = (
+        (
+            "operate_provider_requests_total",
+            "Requests made to each provider.",
+            lambda provider, totals: [(f'provider="{provider}"', totals["requests"])],
+        ),
+        (
+            "operate_provider_tokens_total",
+            "Tokens sent to and received from each provider.",
+            lambda provider, totals: [
+                (f'provider="{provider}",direction="input"', totals["input_tokens"]),
+                (f'provider="{provider}",direction="output"', totals["output_tokens"]),
+            ],
+        ),
+        (
+            "operate_provider_bytes_total",
+            "Bytes sent to each provider, text and images.",
+            lambda provider, totals: [
+                (f'provider="{provider}",kind="text"', totals["request_bytes"] - totals["image_bytes"]),
+                (f'provider="{provider}",kind="image"', totals["image_bytes"]),
+            ],
+        ),
+        (
+            "operate_provider_cost_usd_total",
+            "Estimated spend on each provider.",
+            lambda provider, totals: [(f'provider="{provider}"', f'{totals["cost"]:.6f}')],
+        ),
+    )
+    lines = []
+    for name, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for provider, totals in providers:
+            for labels, value in samples(provider, totals):
+                lines.append(f"{name}{{{labels}}} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,206 @@
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageChops, ImageStat
+
+from operate.config import Config
+from operate.utils.element_map import get_element_map
+from operate.utils.grounding import get_active_window, locate_text_near
+from operate.utils.screenshot import capture_screen_with_cursor
+
+# Load configuration
+config = Config()
+
+# Mean per-pixel difference (0-255) above which two frames count as changed
+FRAME_CHANGE_THRESHOLD = 2.0
+# Frames are compared at this width, which is plenty to notice a page change
+FRAME_COMPARE_WIDTH = 320
+# Normalized correlation above which a template counts as found
+TEMPLATE_MATCH_THRESHOLD = 0.9
+# Screenshots and templates are searched at this scale
+TEMPLATE_MATCH_SCALE = 0.5
+
+def capture_frame(name="verify"):
+    screenshots_dir = "screenshots"
+    if not os.path.exists(screenshots_dir):
+        os.makedirs(screenshots_dir)
+    screenshot_filename = os.path.join(screenshots_dir, f"{name}.png")
+    capture_screen_with_cursor(screenshot_filename)
+    return screenshot_filename
+
+
+def frame_difference(image_path_a, image_path_b):
+    """
+    Returns the mean absolute difference between two screenshots, compared in grayscale at a small size.
+    """
+    frames = []
+    for image_path in (image_path_a, image_path_b):
+        with Image.open(image_path) as img:
+            height = max(1, int(img.height * FRAME_COMPARE_WIDTH / img.width))
+            frames.append(img.convert("L").resize((FRAME_COMPARE_WIDTH, height)))
+    difference = ImageChops.difference(frames[0], frames[1])
+    return ImageStat.Stat(difference).mean[0]
+
+
+def is_text_visible(text, screenshot_filename, hint=None):
+    """
+    Looks for `text` on the screenshot, only in the region around `hint` when
+    given, see `locate_text_near`, or on the whole screen.
+    """
+    if hint is not None:
+        return locate_text_near(text, screenshot_filename, hint)[1] is not None
+    element_map = get_element_map(screenshot_filename)
+    return element_map.find_text(text, case_sensitive=False) is not None
+
+
+def check_expectation(expect, before_frame=None, hint=None):
+    """
+    Checks an action's `expect` against a fresh screenshot.
+
+    Parameters:
+    - expect (dict): `{"text": str or None, "change": bool or None}`.
+    - before_frame (str): Screenshot taken before the action, needed for `change`.
+    - hint (dict): Where to look for the text, as screen percentages, None for the whole screen.
+
+    Returns:
+    tuple: Whether the expectation holds, and a reason when it doesn't.
+    """
+    after_frame = capture_frame()
+
+    if expect.get("change") and before_frame:
+        difference = frame_difference(before_frame, after_frame)
+        if config.verbose:
+            print("[check_expectation] frame difference", difference)
+        if difference < FRAME_CHANGE_THRESHOLD:
+            return False, "the screen did not change"
+
+    if expect.get("text") and not is_text_visible(expect["text"], after_frame, hint):
+        return False, f"the text '{expect['text']}' is not visible"
+
+    return True, None
+
+
+def wait_for_expectation(expect, before_frame=None, timeout=5.0, interval=0.5, hint=None):
+    """
+    Polls `check_expectation` until it holds or `timeout` seconds have passed, giving
+    pages and windows time to load.
+
+    With a `hint`, the polls only read the region around it, and the whole
+    screen is read once, at the end, before giving up.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        last = time.monotonic() >= deadline
+        met, reason = check_expectation(expect, before_frame, None if last else hint)
+        if met or last:
+            return met, reason
+        time.sleep(interval)
+
+
+def load_gray(image_path, scale):
+    with Image.open(image_path) as img:
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        return np.asarray(img.convert("L").resize(size, Image.BILINEAR), dtype=np.float64)
+
+
+def match_template(template_path, screenshot_filename, scale=TEMPLATE_MATCH_SCALE):
+    """
+    Returns the best normalized cross-correlation of a template anywhere on a
+    screenshot, from -1.0 to 1.0. The correlation is computed with FFTs and the
+    window sums with integral images, so a full screen takes milliseconds.
+    """
+    image = load_gray(screenshot_filename, scale)
+    template = load_gray(template_path, scale)
+    height, width = template.shape
+    if height > image.shape[0] or width > image.shape[1]:
+        return -1.0
+
+    template = template - template.mean()
+    template_norm = np.sqrt((template**2).sum())
+    if template_norm == 0:
+        # a flat template matches anywhere, which proves nothing
+        return -1.0
+
+    shape = (image.shape[0] + height - 1, image.shape[1] + width - 1)
+    correlation = np.fft.irfft2(
+        np.fft.rfft2(image, shape) * np.fft.rfft2(template[::-1, ::-1], shape), shape
+    )[height - 1 : image.shape[0], width - 1 : image.shape[1]]
+
+    def window_sums(values):
+        integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+        integral[1:, 1:] = values.cumsum(0).cumsum(1)
+        return (
+            integral[height:, width:]
+            - integral[:-height, width:]
+            - integral[height:, :-width]
+            + integral[:-height, :-width]
+        )
+
+    sums = window_sums(image)
+    variance = np.maximum(window_sums(image**2) - sums**2 / template.size, 0)
+    denominator = np.sqrt(variance) * template_norm
+    scores = np.where(denominator > 1e-6, correlation / np.maximum(denominator, 1e-6), 0)
+    return float(scores.max())
+
+
+def count_detected_elements(screenshot_filename, region=None):
+    """
+    Counts the detector's elements that intersect a region given in screen
+    fractions, `[x1, y1, x2, y2]`, the whole screen by default.
+    """
+    element_map = get_element_map(screenshot_filename, ("detector",))
+    width, height = element_map.image_size
+    x1, y1, x2, y2 = region or (0, 0, 1, 1)
+    indices = element_map.query((x1 * width, y1 * height, x2 * width, y2 * height))
+    return len(np.intersect1d(indices, element_map.of_source("detector")))
+
+
+def check_guideline(checks, screenshot_filename):
+    """
+    Judges a final screenshot with local checks, all of which must hold.
+
+    Parameters:
+    - checks (dict): Any of
+      `"text"`: a text, or a list of texts, read on the screen (case insensitive),
+      `"window"`: a text the focused window's title contains (case insensitive),
+      `"template"`: path of an image found on the screen,
+      `"element"`: `{"region": [x1, y1, x2, y2], "count": int}`, at least `count`
+      elements found by the detector in the region, given in screen fractions.
+    - screenshot_filename (str): The final screenshot.
+
+    Returns:
+    tuple: Whether the checks hold, and a reason when they don't.
+
+    Raises:
+    ValueError: If a check is unknown.
+    """
+    unknown = set(checks) - {"text", "window", "template", "element"}
+    if unknown:
+        raise ValueError(f"Unknown guideline checks {sorted(unknown)}")
+
+    texts = checks.get("text") or []
+    for text in [texts] if isinstance(texts, str) else texts:
+        if not is_text_visible(text, screenshot_filename):
+            return False, f"the text '{text}' is not visible"
+
+    if checks.get("window"):
+        window = get_active_window()
+        title = window.get("title", "") if window is not None else ""
+        if checks["window"].lower() not in title.lower():
+            return False, f"the focused window '{title}' is not '{checks['window']}'"
+
+    if checks.get("template"):
+        score = match_template(checks["template"], screenshot_filename)
+        if config.verbose:
+            print("[check_guideline] template match", checks["template"], score)
+        if score < TEMPLATE_MATCH_THRESHOLD:
+            return False, f"the image {checks['template']} is not on the screen"
+
+    if checks.get("element"):
+        element = checks["element"]
+        count = count_detected_elements(screenshot_filename, element.get("region"))
+        if count < element.get("count", 1):
+            return False, f"{count} elements detected in {element.get('region', 'the screen')}"
+
+    return True, None
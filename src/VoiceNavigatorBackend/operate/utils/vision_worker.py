@@ -0,0 +1,290 @@
+"""
+A local process that loads the OCR and detection models once and serves every
+backend worker over a Unix socket.
+
+Start it with `python -m operate.utils.vision_worker`, then set
+VISION_WORKER_SOCKET in the backend workers: `get_ocr_backend` and
+`get_detector` return thin clients that forward their calls to it. Requests
+that arrive together, from any session, are run as one batch.
+"""
+import argparse
+import io
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from PIL import Image
+
+from operate.config import Config
+
+# Load configuration
+config = Config()
+
+DEFAULT_SOCKET = "/tmp/operate-vision.sock"
+# How long the batcher waits for more requests after the first one
+BATCH_WINDOW = 0.01
+MAX_BATCH_SIZE = 16
+
+
+def get_authkey():
+    return os.getenv("VISION_WORKER_AUTHKEY", "operate-vision").encode()
+
+
+def encode_image(image):
+    """
+    Prepares an image for the socket. Files are sent as their compressed bytes.
+    """
+    if isinstance(image, str):
+        with open(image, "rb") as file:
+            return file.read()
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert("RGB"))
+    return image
+
+
+def decode_image(image):
+    if isinstance(image, bytes):
+        with Image.open(io.BytesIO(image)) as img:
+            return np.asarray(img.convert("RGB"))
+    return image
+
+
+class VisionWorker:
+    """
+    Serves OCR and detection requests, batching the ones that arrive together.
+
+    Attributes:
+        socket_path (str): The Unix socket the worker listens on.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        self.socket_path = socket_path
+        self.requests = queue.Queue()
+
+    def load(self):
+        # imported here so the clients never load the models
+        from operate.utils.detector import get_detector
+        from operate.utils.ocr_backends import get_ocr_backend
+
+        # the worker runs the models itself instead of being its own client
+        os.environ.pop("VISION_WORKER_SOCKET", None)
+        start = time.perf_counter()
+        self.ocr = get_ocr_backend()
+        self.ocr.engine  # the engine loads lazily, load it before serving
+        self.detector = get_detector()
+        print(f"[VisionWorker] models loaded in {time.perf_counter() - start:.1f}s")
+
+    def serve(self):
+        if not hasattr(self, "detector"):
+            self.load()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = Listener(self.socket_path, family="AF_UNIX", authkey=get_authkey())
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self.run_batches, daemon=True).start()
+        print(f"[VisionWorker] listening on {self.socket_path}")
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    print("[VisionWorker] rejected a connection:", e)
+                    continue
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def handle(self, connection):
+        """
+        Answers the requests of one client connection, in order.
+        """
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+                # each image is queued on its own so it can join other sessions' batches
+                futures = []
+                for image in request["images"]:
+                    future = Future()
+                    self.requests.put(({**request, "image": image}, future))
+                    futures.append(future)
+                try:
+                    connection.send(("ok", [future.result() for future in futures]))
+                except Exception as e:
+                    connection.send(("error", f"{type(e).__name__}: {e}"))
+
+    def run_batches(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + BATCH_WINDOW
+            while len(batch) < MAX_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        # only requests for the same call on same-sized images can share a batch
+        groups = {}
+        for request, future in batch:
+            try:
+                image = decode_image(request["image"])
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            kwargs = request.get("kwargs", {})
+            key = (request["op"], image.shape, tuple(sorted(kwargs.items())))
+            groups.setdefault(key, []).append((image, future))
+
+        for (op, _, kwargs), items in groups.items():
+            images = [image for image, _ in items]
+            if config.verbose:
+                print(f"[VisionWorker] {op} batch of {len(images)}")
+            try:
+                if op == "readtext" and len(images) > 1:
+                    results = self.ocr.readtext_batched(
+                        images, batch_size=len(images), **dict(kwargs)
+                    )
+                elif op == "readtext":
+                    results = [self.ocr.readtext(images[0], **dict(kwargs))]
+                elif op == "detect":
+                    results = self.detector.detect_batch(
+                        [Image.fromarray(image) for image in images]
+                    )
+                else:
+                    raise ValueError(f"Unknown vision request '{op}'")
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                future.set_result([tuple(element) for element in result])
+
+
+class VisionClient:
+    """
+    Forwards OCR and detection calls to the vision worker. Each thread keeps its own connection.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.local = threading.local()
+
+    def request(self, op, images, **kwargs):
+        """
+        Runs `op` on each image in the worker.
+
+        Returns:
+        list: One result per image.
+        """
+        message = {"op": op, "images": [encode_image(image) for image in images], "kwargs": kwargs}
+        for attempt in range(2):
+            connection = getattr(self.local, "connection", None)
+            try:
+                if connection is None:
+                    connection = Client(
+                        self.socket_path, family="AF_UNIX", authkey=get_authkey()
+                    )
+                    self.local.connection = connection
+                connection.send(message)
+                status, result = connection.recv()
+                break
+            except (EOFError, OSError):
+                # the worker restarted, reconnect once
+                if connection is not None:
+                    connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+        if status == "error":
+            raise Exception(f"[VisionWorker] {result}")
+        return result
+
+
+class RemoteOCRBackend:
+    """
+    OCR backend that runs in the vision worker. See `operate.utils.ocr_backends`.
+    """
+
+    name = "worker"
+
+    def __init__(self, client):
+        self.client = client
+
+    @property
+    def engine(self):
+        return self.client
+
+    def readtext(self, image, **kwargs):
+        return self.readtext_batched([image], **kwargs)[0]
+
+    def readtext_batched(self, images, **kwargs):
+        from operate.utils.ocr_backends import OCRElement
+
+        # the worker picks its own batch size
+        kwargs.pop("batch_size", None)
+        return [
+            [OCRElement(*element) for element in result]
+            for result in self.client.request("readtext", images, **kwargs)
+        ]
+
+
+class RemoteDetector:
+    """
+    Labeling detector that runs in the vision worker. See `operate.utils.detector`.
+    """
+
+    name = "worker"
+
+    def __init__(self, client):
+        self.client = client
+        self.model_path = client.socket_path
+
+    def detect(self, image):
+        return [tuple(box) for box in self.client.request("detect", [image])[0]]
+
+
+_client = None
+
+
+def get_vision_client():
+    """
+    Returns the client of the vision worker, or None when VISION_WORKER_SOCKET isn't set.
+    """
+    global _client
+    socket_path = os.getenv("VISION_WORKER_SOCKET")
+    if not socket_path:
+        return None
+    if _client is None or _client.socket_path != socket_path:
+        _client = VisionClient(socket_path)
+    return _client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve OCR and detection to the backend workers.")
+    parser.add_argument(
+        "--socket",
+        default=os.getenv("VISION_WORKER_SOCKET", DEFAULT_SOCKET),
+        help="Unix socket to listen on",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Log every batch")
+    args = parser.parse_args()
+    worker = VisionWorker(args.socket)
+    # loading imports the detector, which imports this file again as its own module
+    worker.load()
+    config.verbose = args.verbose
+    worker.serve()
+
+
+if __name__ == "__main__":
+    main()
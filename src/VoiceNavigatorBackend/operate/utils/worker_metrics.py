@@ -0,0 +1,101 @@
+"""
+/metrics across the pre-forked workers of server.py.
+
+Each worker keeps its own histograms and provider totals, and a scrape reaches
+any one of them. With METRICS_DIR set, every worker saves its totals there
+every METRICS_SAVE_INTERVAL seconds (default 5) and right before answering a
+scrape, which exports the sum of all the files. The files of workers that
+exited are kept, so the counters never go back when a worker is restarted.
+"""
+import json
+import os
+import threading
+import time
+
+from operate.config import Config
+from operate.utils.metrics import get_histograms, render_prometheus
+from operate.utils.usage import get_provider_totals, new_totals
+from operate.utils.usage import render_prometheus as render_usage_prometheus
+
+# Load configuration
+config = Config()
+
+
+def get_metrics_dir():
+    """
+    Returns the directory the workers share their totals in, or None outside server.py.
+    """
+    return os.getenv("METRICS_DIR") or None
+
+
+def save_worker_metrics():
+    """
+    Writes this worker's totals to METRICS_DIR, atomically so a scrape never reads half a file.
+    """
+    metrics_dir = get_metrics_dir()
+    path = os.path.join(metrics_dir, f"{os.getpid()}.json")
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump({"histograms": get_histograms(), "providers": get_provider_totals()}, file)
+    os.replace(temporary_path, path)
+
+
+def start_worker_metrics():
+    """
+    Saves this worker's totals in the background, so the others' scrapes see them.
+    """
+    interval = float(os.getenv("METRICS_SAVE_INTERVAL", 5))
+
+    def save_periodically():
+        while True:
+            time.sleep(interval)
+            try:
+                save_worker_metrics()
+            except OSError as e:
+                print("[start_worker_metrics] could not save the metrics:", e)
+
+    threading.Thread(target=save_periodically, daemon=True).start()
+
+
+def load_all_metrics():
+    """
+    Sums the totals saved by every worker.
+
+    Returns:
+    tuple: The histograms and the provider totals, shaped as `get_histograms`
+    and `get_provider_totals` return them.
+    """
+    histograms = {}
+    providers = {}
+    metrics_dir = get_metrics_dir()
+    for name in sorted(os.listdir(metrics_dir)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(metrics_dir, name)) as file:
+                saved = json.load(file)
+        except (OSError, ValueError) as e:
+            if config.verbose:
+                print(f"[load_all_metrics] skipping {name}:", e)
+            continue
+        for stage, histogram in saved["histograms"].items():
+            total = histograms.setdefault(
+                stage, {"bucket_counts": [0] * len(histogram["bucket_counts"]), "count": 0, "sum": 0.0}
+            )
+            total["bucket_counts"] = [a + b for a, b in zip(total["bucket_counts"], histogram["bucket_counts"])]
+            total["count"] += histogram["count"]
+            total["sum"] += histogram["sum"]
+        for provider, totals in saved["providers"].items():
+            total = providers.setdefault(provider, new_totals())
+            for key, value in totals.items():
+                total[key] += value
+    return histograms, providers
+
+
+def render_all_metrics():
+    """
+    Exports the totals of every worker in the Prometheus text format.
+    """
+    save_worker_metrics()
+    histograms, providers = load_all_metrics()
+    return render_prometheus(histograms) + render_usage_prometheus(providers)
@@ -0,0 +1,193 @@
+"""
+Production entry point: preloads the models and SDKs once, then forks workers that share them.
+
+    python server.py --workers 4 --preload ocr,yolo,openai
+
+The parent loads the configured models and provider SDKs, then binds the port
+and forks, so every worker starts with them shared copy-on-write and accepts
+connections on the same socket. torch stays single threaded in the parent, so
+no OpenMP pool is inherited, and each worker sets its own share of threads
+(TORCH_THREADS). The ONNX backends start their thread pools as soon as they
+load, so each worker loads those after forking instead; the vision worker
+(VISION_WORKER_SOCKET) keeps a single copy of any backend. Workers that die
+are restarted.
+
+Every worker has its own metrics; they share them through METRICS_DIR (a
+fresh temporary directory by default), so `/metrics` answers the sum over all
+workers whichever one is scraped, see `operate.utils.worker_metrics`.
+
+Nothing listens until the warm-up is done, so a load balancer sees the port
+closed rather than slow requests. `/readyz` then answers 503 only when a
+component failed to load, the same in every worker.
+
+All workers drive the same desktop, so only one session runs at a time, see
+`operate.utils.desktop_lock`; the others get a 409 while it does. Several
+workers still keep the probes, /metrics and /api/logs answering during a session.
+"""
+import argparse
+import glob
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from werkzeug.serving import make_server
+
+from app import create_app
+from operate.utils.readiness import (
+    MODEL_COMPONENTS,
+    PRELOADABLE,
+    is_fork_safe,
+    limit_threads_before_fork,
+    preload,
+    restore_threads_after_fork,
+    set_ready,
+)
+from operate.utils.style import ANSI_GREEN, ANSI_RED, ANSI_RESET
+from operate.utils.worker_metrics import start_worker_metrics
+
+# Seconds to wait before restarting a worker that keeps dying
+RESTART_DELAY = 1.0
+
+
+def bind_socket(host, port, backlog=128):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, host, port, ready, components, workers):
+    # the parent's signal handlers are not the worker's
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    restore_threads_after_fork(workers)
+    start_worker_metrics()
+    # the components that can't be shared load before this worker accepts connections
+    ready = preload(components) and ready
+    set_ready(ready)
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    print(f"{ANSI_GREEN}[server] worker {os.getpid()} serving{ANSI_RESET}")
+    server.serve_forever()
+
+
+def spawn_worker(app, sock, host, port, ready, components, workers):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(app, sock, host, port, ready, components, workers)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def prepare_metrics_dir():
+    """
+    Points the workers at an empty METRICS_DIR, a new temporary one unless set.
+
+    Returns:
+    str: The directory to remove on exit, or None when it was given.
+    """
+    metrics_dir = os.getenv("METRICS_DIR")
+    if not metrics_dir:
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="operate-metrics-")
+        return os.environ["METRICS_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    # the totals of a previous run would be added to this one's
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        os.remove(path)
+    return None
+
+
+def serve(host, port, workers, components):
+    app = create_app()
+    created_metrics_dir = prepare_metrics_dir()
+
+    worker_components = [component for component in components if not is_fork_safe(component)]
+    components = [component for component in components if is_fork_safe(component)]
+
+    if any(component in MODEL_COMPONENTS for component in components):
+        limit_threads_before_fork()
+    start = time.perf_counter()
+    ready = preload(components)
+    print(
+        f"{ANSI_GREEN}[server] preloaded {', '.join(components) or 'nothing'} "
+        f"in {time.perf_counter() - start:.1f}s{ANSI_RESET}"
+    )
+    if worker_components:
+        print(f"{ANSI_GREEN}[server] each worker loads {', '.join(worker_components)} after forking{ANSI_RESET}")
+    if not ready:
+        print(f"{ANSI_RED}[server] some components failed to load, /readyz will report 503{ANSI_RESET}")
+
+    # bound once warm, so no connection waits on the models
+    sock = bind_socket(host, port)
+    children = {
+        spawn_worker(app, sock, host, port, ready, worker_components, workers)
+        for _ in range(workers)
+    }
+    print(f"{ANSI_GREEN}[server] listening on {host}:{port} with {workers} workers{ANSI_RESET}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if stopping:
+            continue
+        print(f"{ANSI_RED}[server] worker {pid} exited with status {status}, restarting{ANSI_RESET}")
+        time.sleep(RESTART_DELAY)
+        children.add(spawn_worker(app, sock, host, port, ready, worker_components, workers))
+    sock.close()
+    if created_metrics_dir:
+        shutil.rmtree(created_metrics_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend with pre-forked workers.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", 2)),
+        help="Number of forked workers",
+    )
+    parser.add_argument(
+        "--preload",
+        default=os.getenv("PRELOAD", "ocr,openai"),
+        help=f"Comma separated components to load up front: {','.join(PRELOADABLE)}. "
+        "ONNX backends of ocr and yolo are loaded by each worker after forking",
+    )
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        sys.exit("server.py needs os.fork, use `python app.py` on this platform")
+
+    components = [component for component in args.preload.split(",") if component]
+    serve(args.host, args.port, args.workers, components)
+
+
+if __name__ == "__main__":
+    main()